@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
-from asyncio import run
-from mentor_whirlpool.telegram import bot
-from mentor_whirlpool.database import Database
+from argparse import ArgumentParser
+from asyncio import run, create_task
+from os import environ as env
+import logging
+from mentor_whirlpool.telegram import bot, state_storage
+from mentor_whirlpool.database import Database, open_pool, close_pool
 
 # here will be handles importing
 import mentor_whirlpool.common
@@ -12,12 +15,54 @@ import mentor_whirlpool.admin_handle
 import mentor_whirlpool.mentor_handle
 import mentor_whirlpool.support_handles
 import mentor_whirlpool.support_request_handler
+from mentor_whirlpool.webhook import serve_webhook
+from mentor_whirlpool.matching import matching_job
+from mentor_whirlpool.metrics import serve_metrics, log_metrics_job
+from mentor_whirlpool.mentor_handle.course_works import notify_assignment
 
 
-async def main():
-    db = Database()
-    await db.initdb()
-    await bot.infinity_polling()
+async def main(webhook=False):
+    await open_pool()
+    try:
+        db = Database()
+        await db.initdb()
+        fixed = await db.reconcile_loads()
+        if fixed:
+            logging.warn(f'LOAD of {fixed} mentors was out of sync, fixed')
+        subjects_listener = create_task(db.listen_subjects())
+        jobs = [subjects_listener]
+        if hasattr(state_storage, 'listen_states'):
+            jobs.append(create_task(state_storage.listen_states()))
+        # automatic assignment is off unless MATCHING_INTERVAL is set
+        if float(env.get('MATCHING_INTERVAL', 0)) > 0:
+            jobs.append(create_task(matching_job(
+                db, float(env['MATCHING_INTERVAL']),
+                default_capacity=int(env.get('MATCHING_DEFAULT_CAPACITY', 5)),
+                notify=notify_assignment)))
+        # metrics are served if METRICS_PORT is set and logged every
+        # METRICS_LOG_INTERVAL seconds if it is set
+        if env.get('METRICS_PORT'):
+            jobs.append(create_task(serve_metrics(env.get('METRICS_HOST', '0.0.0.0'),
+                                                  int(env['METRICS_PORT']))))
+        if float(env.get('METRICS_LOG_INTERVAL', 0)) > 0:
+            jobs.append(create_task(log_metrics_job(float(env['METRICS_LOG_INTERVAL']))))
+        if webhook:
+            await serve_webhook()
+        else:
+            await bot.delete_webhook()
+            await bot.infinity_polling()
+            await bot.dispatcher.stop()
+        for job in jobs:
+            job.cancel()
+    finally:
+        if hasattr(state_storage, 'flush'):
+            await state_storage.flush()
+        await close_pool()
 
 if __name__ == '__main__':
-    run(main())
+    parser = ArgumentParser(prog='mentor_whirlpool')
+    parser.add_argument('--webhook', action='store_true',
+                        help='receive updates with a webhook server configured '
+                             'by WEBHOOK_* environment variables instead of '
+                             'polling')
+    run(main(parser.parse_args().webhook))
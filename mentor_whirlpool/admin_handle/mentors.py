@@ -3,7 +3,8 @@ from telebot import types
 from mentor_whirlpool.database import Database
 from asyncio import gather
 from mentor_whirlpool.support_handles import support_start
-from mentor_whirlpool.utils import get_name, get_pretty_mention_db, get_pretty_mention
+from mentor_whirlpool.utils import (get_name, get_pretty_mention_db, get_pretty_mention,
+                                    PAGE_SIZE, split_page, paging_buttons, parse_paging)
 from mentor_whirlpool.student_handle import start
 from mentor_whirlpool.mentor_handle.start import mentor_start
 import logging
@@ -26,39 +27,54 @@ async def list_mentors(message: types.Message) -> None:
         return
 
     logging.debug(f'chat_id: {message.from_user.id} in MENTORS')
-    mentors = await db.get_mentors()
-    tasks = []
-    for mentor in mentors:
-
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton('Выбрать', callback_data=f'admin_choose_mentor_{mentor["chat_id"]}'))
-
-        if not mentor['subjects']:
-            tasks.append(
-                bot.send_message(message.from_user.id, f'__{get_pretty_mention_db(mentor)}__\nНет выбранных направлений',
-                                 reply_markup=markup))
-            continue
-
-        subjects_count_dict = dict.fromkeys([subj['subject'] for subj in mentor['subjects']], 0)
-
-        for student in mentor['students']:
-            for subject in [subj['subject'] for subj in student['course_works'][0]['subjects']]:
+    text, markup = await mentors_page(db)
+    await gather(bot.send_message(message.from_user.id, text, reply_markup=markup),
+                 bot.delete_message(message.chat.id, message.id))
+    logging.debug(f'chat_id: {message.from_user.id} sent MENTORS')
 
-                if subject in subjects_count_dict:
-                    subjects_count_dict[subject] += 1
-                else:
-                    continue
 
-        message_subjects = '\n'.join(f'{k} - {v}' for k, v in subjects_count_dict.items())
+async def mentors_page(db, after_id=None, before_id=None):
+    """
+    Prepares a page of the mentors overview: amount of students of every
+    mentor per subject, with a button to choose each mentor
 
-        tasks.append(
-            bot.send_message(message.from_user.id, f'__{get_pretty_mention_db(mentor)}__\n'
-                                                   f'{message_subjects}',
-                             reply_markup=markup))
+    Returns
+    -------
+    tuple(str, telebot.types.InlineKeyboardMarkup)
+    """
+    mentors, has_prev, has_next = split_page(
+        await db.get_mentors_overview(limit=PAGE_SIZE + 1, after_id=after_id,
+                                      before_id=before_id),
+        after_id, before_id)
+    if not mentors:
+        return 'Нет менторов', types.InlineKeyboardMarkup()
+    lines = []
+    markup = types.InlineKeyboardMarkup()
+    for mentor in mentors:
+        lines.append(f'__{get_pretty_mention_db(mentor)}__ ({mentor["load"]})')
+        if mentor['subjects']:
+            lines.extend(f'{subj["subject"]} - {subj["students"]}'
+                         for subj in mentor['subjects'])
+        else:
+            lines.append('Нет выбранных направлений')
+        markup.add(types.InlineKeyboardButton(f'Выбрать {mentor["name"]}',
+                                              callback_data=f'admin_choose_mentor_{mentor["chat_id"]}'))
+    markup.row(*paging_buttons('admin_mentors_page_', mentors, has_prev, has_next))
+    return '\n'.join(lines), markup
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('admin_mentors_page_'))
+async def callback_mentors_page(call: types.CallbackQuery) -> None:
+    db = Database()
+    if not await db.check_is_admin(call.from_user.id):
+        logging.warn(f'MENTORS: chat_id: {call.from_user.id} is not an admin')
+        return
 
-    logging.debug(f'chat_id: {message.from_user.id} preparing MENTORS')
-    await gather(*tasks, bot.delete_message(message.chat.id, message.id))
-    logging.debug(f'chat_id: {message.from_user.id} sent MENTORS')
+    after_id, before_id = parse_paging(call.data, 'admin_mentors_page_')
+    text, markup = await mentors_page(db, after_id, before_id)
+    await gather(bot.answer_callback_query(call.id),
+                 bot.edit_message_text(text, call.from_user.id, call.message.id,
+                                       reply_markup=markup))
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('admin_choose_mentor_'))
@@ -166,11 +182,7 @@ async def callback_add_student(call: types.CallbackQuery) -> None:
 async def callback_user_add_subject(message: types.Message) -> None:
     db = Database()
     mentor_chat_id, subject_name = message.reply_to_message.text[35:].split(" ", 1)
-    subject = None
-    for subj in await db.get_subjects():
-        if subject_name == subj['subject']:
-            subject = subj
-            break
+    subject = (await db.get_subjects(name=subject_name) or [None])[0]
     if subject is None:
         await bot.send_message(message.from_user.id, f'Направление {subject_name} НЕ НАЙДЕНО')
         return
@@ -190,12 +202,13 @@ async def callback_user_add_subject(message: types.Message) -> None:
         return
 
     logging.debug(f'chat_id: {message.from_user.id} preparing ADD_STUDENT_FOR')
-    await gather(
-        db.accept_work(mentor["id"], await db.add_course_work(
+    async with db.transaction():
+        await db.accept_work(mentor["id"], await db.add_course_work(
             {'name': student["name"],
              'chat_id': student["chat_id"],
              'subjects': [subject['id']],
-             'description': course_work_name})),
+             'description': course_work_name}))
+    await gather(
         bot.send_message(message.from_user.id,
                          f'Студент {get_pretty_mention_db(student)} ' \
                          f'добавлен к ментору {get_pretty_mention_db(mentor)}'),
@@ -356,13 +369,14 @@ async def callback_add_mentor(call):
     if await db.check_is_support(call.from_user.id):
         mentor_markup.add(*[types.KeyboardButton(task)
                             for task in await support_start()])
-    await gather(db.add_mentor({'name': get_name(new_mentor_info),
-                                'chat_id': call.data[21:],
-                                'subjects': None}),
-                 bot.send_message(call.data[21:], 'Теперь Вы ментор!', reply_markup=mentor_markup),
+    async with db.transaction():
+        await db.add_mentor({'name': get_name(new_mentor_info),
+                             'chat_id': call.data[21:],
+                             'subjects': None})
+        if student_info:
+            await db.remove_student(student_info[0]['id'])
+    await gather(bot.send_message(call.data[21:], 'Теперь Вы ментор!', reply_markup=mentor_markup),
                  bot.send_message(call.from_user.id, f'@{new_mentor_info.username} стал ментором'),
                  bot.answer_callback_query(call.id),
                  bot.delete_message(call.from_user.id, call.message.id))
-    if student_info:
-        await db.remove_student(student_info[0]['id'])
 
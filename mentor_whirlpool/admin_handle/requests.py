@@ -1,10 +1,38 @@
 from mentor_whirlpool.telegram import bot
+from telebot import types
 from mentor_whirlpool.database import Database
 from asyncio import gather
-from mentor_whirlpool.utils import get_pretty_mention_db
+from mentor_whirlpool.utils import (get_pretty_mention_db, PAGE_SIZE, split_page,
+                                    paging_buttons, parse_paging)
 import logging
 
 
+async def requests_page(db, after_id=None, before_id=None):
+    """
+    Prepares a page of course work requests
+
+    Returns
+    -------
+    tuple(str or None, telebot.types.InlineKeyboardMarkup)
+        Text of the page, None if there are no requests, and paging buttons
+    """
+    course_works, has_prev, has_next = split_page(
+        await db.get_course_works(limit=PAGE_SIZE + 1, after_id=after_id,
+                                  before_id=before_id),
+        after_id, before_id)
+    markup = types.InlineKeyboardMarkup()
+    markup.row(*paging_buttons('adm_req_page_', course_works, has_prev, has_next))
+    if not course_works:
+        return None, markup
+
+    async def get_message(work):
+        stud = await db.get_students(work["student"])
+        return f'{get_pretty_mention_db(stud[0])}\n'\
+               f'{work["description"]}'
+    messages = await gather(*[get_message(work) for work in course_works])
+    return '\n--------\n'.join(messages), markup
+
+
 @bot.message_handler(func=lambda msg: msg.text == 'Запросы (админ)')
 async def course_work(message):
     db = Database()
@@ -12,15 +40,26 @@ async def course_work(message):
         logging.warn(f'MENTORS: chat_id: {message.from_user.id} is not an admin')
         return
 
-    course_works = await db.get_course_works()
-    if course_works:
-        async def get_message(work):
-            stud = await db.get_students(work["student"])
-            return f'{get_pretty_mention_db(stud[0])}\n'\
-                   f'{work["description"]}'
-        messages = await gather(*[get_message(work) for work in course_works])
-        message_course_works = '\n--------\n'.join(messages)
-        await bot.send_message(message.from_user.id, message_course_works)
+    message_course_works, markup = await requests_page(db)
+    if message_course_works is not None:
+        await bot.send_message(message.from_user.id, message_course_works,
+                               reply_markup=markup)
     else:
         await bot.send_message(message.from_user.id, 'Нет запросов курсовых работ')
     await bot.delete_message(message.chat.id, message.id)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('adm_req_page_'))
+async def callback_requests_page(call: types.CallbackQuery) -> None:
+    db = Database()
+    if not await db.check_is_admin(call.from_user.id):
+        logging.warn(f'MENTORS: chat_id: {call.from_user.id} is not an admin')
+        return
+
+    after_id, before_id = parse_paging(call.data, 'adm_req_page_')
+    message_course_works, markup = await requests_page(db, after_id, before_id)
+    if message_course_works is None:
+        message_course_works = 'Нет запросов курсовых работ'
+    await gather(bot.answer_callback_query(call.id),
+                 bot.edit_message_text(message_course_works, call.from_user.id,
+                                       call.message.id, reply_markup=markup))
@@ -83,10 +83,11 @@ async def add_support_chat_id_handler(message: types.Message) -> None:
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.add(*[types.KeyboardButton(task)
                  for task in await support_start()])
-    await gather(db.add_support(supp_dict),
-                 bot.delete_state(message.from_user.id),
+    async with db.transaction():
+        await db.add_support(supp_dict)
+        stud = await db.get_students(chat_id=supp_chat_id)
+        if stud:
+            await db.remove_student(stud[0]['id'])
+    await gather(bot.delete_state(message.from_user.id),
                  bot.send_message(message.from_user.id, 'Саппорт успешно добавлен'),
                  bot.send_message(supp_chat_id, 'Теперь вы член группы поддержки!', reply_markup=markup))
-    stud = await db.get_students(chat_id=supp_chat_id)
-    if stud:
-        await db.remove_student(stud[0]['id'])
@@ -14,7 +14,8 @@ async def start(message):
     help_task = create_task(help(message))
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
     db = Database()
-    if await db.check_is_support(message.from_user.id):
+    roles = await db.get_roles(message.from_user.id)
+    if roles['support']:
         logging.warn(f'chat_id: {message.from_user.id} is support')
 
         keyboard.add(*[types.KeyboardButton(task)
@@ -24,11 +25,11 @@ async def start(message):
                                reply_markup=keyboard, parse_mode='Html')
         return
 
-    if await db.check_is_mentor(message.from_user.id):
+    if roles['mentor']:
         logging.warn(f'chat_id: {message.from_user.id} is mentor')
         keyboard.add(*[types.KeyboardButton(task)
                        for task in await mentor_whirlpool.mentor_handle.start.mentor_start()])
-    elif await db.check_is_admin(message.from_user.id):
+    elif roles['admin']:
         logging.warn(f'chat_id: {message.from_user.id} is admin')
         keyboard.add(*[types.KeyboardButton(task)
                        for task in await mentor_whirlpool.admin_handle.start.admin_start()])
@@ -45,15 +46,16 @@ async def start(message):
 @bot.message_handler(commands=['help'])
 async def help(message):
     db = Database()
-    if await db.check_is_mentor(message.from_user.id):
+    roles = await db.get_roles(message.from_user.id)
+    if roles['mentor']:
         logging.warn(f'chat_id: {message.from_user.id} is mentor and requested help')
         await bot.send_message(message.from_user.id,
                                await mentor_whirlpool.mentor_handle.start.mentor_help(), parse_mode='html')
-    elif await db.check_is_admin(message.from_user.id):
+    elif roles['admin']:
         logging.warn(f'chat_id: {message.from_user.id} is admin and requested help')
         await bot.send_message(message.from_user.id,
                                await mentor_whirlpool.admin_handle.start.admin_help(), parse_mode='html')
-    elif await db.check_is_support(message.from_user.id):
+    elif roles['support']:
         logging.warn(f'chat_id: {message.from_user.id} is support and requested help')
         await bot.send_message(message.from_user.id,
                                'Ого, гуру нужна помощь? Набираем 911!')
@@ -1,6 +1,6 @@
-import psycopg
-from os import environ as env
-from asyncio import gather
+from mentor_whirlpool.database.pool import (open_pool, close_pool, connection,
+                                            current_connection, with_connection,
+                                            transaction, commit, read_conninfo)
 from mentor_whirlpool.database.students_tables import StudentTables
 from mentor_whirlpool.database.course_works_tables import CourseWorksTables
 from mentor_whirlpool.database.accepted_tables import AcceptedTables
@@ -9,80 +9,90 @@ from mentor_whirlpool.database.admins_tables import AdminsTables
 from mentor_whirlpool.database.supports_tables import SupportsTables
 from mentor_whirlpool.database.subjects_tables import SubjectsTables
 from mentor_whirlpool.database.ideas_tables import IdeasTables
+from mentor_whirlpool.database.roles_tables import RolesTables
+from mentor_whirlpool.database.schema import migrate
 
 
 class Database(StudentTables, CourseWorksTables, AcceptedTables, MentorsTables,
-               IdeasTables, AdminsTables, SupportsTables, SubjectsTables):
-    def __init__(self):
-        self.db = None
-        self.conn_opts = ('dbname=mentor_whirlpool '
-                          f'user={env["POSTGRE_USER"]} '
-                          f'host={env["POSTGRE_ADDRESS"]} '
-                          f'port={env["POSTGRE_PORT"]} '
-                          f'password={env["POSTGRE_PASSWD"]}')
+               IdeasTables, AdminsTables, SupportsTables, SubjectsTables,
+               RolesTables):
+    def __init__(self, read_dsn=None):
+        """
+        Parameters
+        ----------
+        read_dsn : str or None
+            DSN of a read-only replica, POSTGRE_REPLICA_DSN by default. Heavy
+            getters run on it until this Database writes something, without
+            one everything runs on the primary
+        """
+        self.read_dsn = read_dsn if read_dsn is not None else read_conninfo()
+        # set by the first commit, reads go to the primary from then on
+        self.wrote = False
+
+    @property
+    def db(self):
+        """
+        Pooled connection of the running Database method, None outside of one
+        """
+        return current_connection()
+
+    def connection(self):
+        """
+        Checks out a pooled connection for the duration of an async with block.
+        Database methods called within the block run on it
+        """
+        return connection()
+
+    def transaction(self):
+        """
+        Runs Database methods called within an async with block as a single
+        transaction, committed once on exit, e.g.
+
+        async with db.transaction():
+            await db.accept_work(mentor_id, await db.add_course_work(line))
+        """
+        return transaction()
 
+    async def executemany(self, query, params_seq):
+        """
+        Runs a statement once for every set of parameters on the connection
+        of the running Database method. psycopg sends them all in pipeline
+        mode and waits for the results once, so use it instead of gathering
+        execute calls, which the connection would run one round trip after
+        another
+
+        Parameters
+        ----------
+        query : str
+        params_seq : iterable
+            Parameters of every run, nothing is executed if empty
+        """
+        params_seq = list(params_seq)
+        if not params_seq:
+            return
+        async with self.db.cursor() as cur:
+            await cur.executemany(query, params_seq)
+
+    def pipeline(self):
+        """
+        Sends statements executed within an async with block without waiting
+        for the result of each, for a batch of different statements. Results
+        are not available until the block exits, unless fetched
+        """
+        return self.db.pipeline()
+
+    async def commit(self):
+        """
+        Commits the running Database method, unless it is part of
+        a transaction block. Later reads of this Database go to the primary
+        """
+        self.wrote = True
+        await commit()
+
+    @with_connection
     async def initdb(self):
         """
-        Creates database model if not declared already
-        """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        await gather(self.db.execute('CREATE TABLE IF NOT EXISTS STUDENTS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'NAME TEXT NOT NULL,'
-                                     'CHAT_ID BIGINT NOT NULL UNIQUE)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS COURSE_WORKS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'STUDENT BIGINT NOT NULL REFERENCES STUDENTS(ID),'
-                                     'DESCRIPTION TEXT)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS SUBJECTS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'SUBJECT TEXT NOT NULL UNIQUE,'
-                                     'COUNT INT)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS COURSE_WORKS_SUBJECTS('
-                                     'COURSE_WORK BIGINT NOT NULL REFERENCES COURSE_WORKS(ID),'
-                                     'SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),'
-                                     'UNIQUE(COURSE_WORK, SUBJECT))'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS ACCEPTED('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'STUDENT BIGINT NOT NULL UNIQUE REFERENCES STUDENTS(ID),'
-                                     'DESCRIPTION TEXT)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS ACCEPTED_SUBJECTS('
-                                     'COURSE_WORK BIGINT NOT NULL REFERENCES ACCEPTED(ID),'
-                                     'SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),'
-                                     'UNIQUE(COURSE_WORK, SUBJECT))'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS MENTORS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'NAME TEXT NOT NULL,'
-                                     'CHAT_ID BIGINT NOT NULL UNIQUE,'
-                                     'LOAD INT)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS MENTORS_SUBJECTS('
-                                     'MENTOR BIGINT NOT NULL REFERENCES MENTORS(ID),'
-                                     'SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),'
-                                     'UNIQUE(MENTOR, SUBJECT))'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS MENTORS_STUDENTS('
-                                     'MENTOR BIGINT NOT NULL REFERENCES MENTORS(ID),'
-                                     'STUDENT BIGINT NOT NULL REFERENCES STUDENTS(ID),'
-                                     'UNIQUE(MENTOR, STUDENT))'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS IDEAS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'MENTOR BIGINT NOT NULL REFERENCES MENTORS(ID),'
-                                     'DESCRIPTION TEXT)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS IDEAS_SUBJECTS('
-                                     'IDEA BIGINT NOT NULL REFERENCES IDEAS(ID),'
-                                     'SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),'
-                                     'UNIQUE(IDEA, SUBJECT))'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS ADMINS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'CHAT_ID BIGINT NOT NULL UNIQUE)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS SUPPORTS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'CHAT_ID BIGINT NOT NULL UNIQUE,'
-                                     'NAME TEXT NOT NULL)'),
-                     self.db.execute('CREATE TABLE IF NOT EXISTS SUPPORT_REQUESTS('
-                                     'ID BIGSERIAL PRIMARY KEY,'
-                                     'CHAT_ID BIGINT NOT NULL UNIQUE,'
-                                     'NAME TEXT NOT NULL,'
-                                     'ISSUE TEXT,'
-                                     'SUPPORT BIGINT REFERENCES SUPPORTS(ID) DEFERRABLE INITIALLY DEFERRED)'))
-        await self.db.commit()
+        Brings database model up to date by applying pending migrations from
+        database/migrations, see schema.migrate
+        """
+        await migrate(self.db)
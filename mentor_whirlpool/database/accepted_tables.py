@@ -1,73 +1,78 @@
-import psycopg
-from asyncio import gather
+from mentor_whirlpool.database.pool import with_connection, read_only, after_commit
+from mentor_whirlpool.database.course_works_tables import PENDING_CONDITION
 
 
 class AcceptedTables:
+    @with_connection
     async def accept_idea(self, student, work_id):
         """
-        Moves a line from COURSE_WORKS to ACCEPTED table, increments LOAD
-        column in MENTORS table and appends ID into COURSE_WORKS column
-        Does nothing if a line exists
+        Moves a line from IDEAS to ACCEPTED table, increments LOAD column in
+        MENTORS table and links the student to the mentor of the idea
+        Other course works of the student are removed
+
+        Runs in a single transaction. If the idea is being accepted by someone
+        else at the same time, it is skipped instead of waiting. Acceptances
+        for the same student run one after another, see _lock_student
 
         Parameters
         ----------
-        student_id: dict
+        student : dict
             Dict with field names: 'name' and 'chat_id'
         work_id : int
-            database id of the course work
+            database id of the idea
 
         Raises
         ------
         DBAccessError whatever
-        DBDoesNotExist
-        DBAlreadyExists
+
+        Returns
+        -------
+        bool
+            True if the idea was accepted, False if it does not exist
+            anymore or is being accepted concurrently
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        await self.db.execute('INSERT INTO STUDENTS VALUES('
-                              'DEFAULT, %(name)s, %(chat_id)s) '
-                              'ON CONFLICT (CHAT_ID) DO NOTHING', student)
-        (student_id,) = await (await self.db.execute('SELECT ID FROM STUDENTS WHERE CHAT_ID = %s',
-                                                  (student['chat_id'],))).fetchone()
-        line = await (await self.db.execute('SELECT * FROM IDEAS '
-                                            'WHERE ID = %s', (work_id,))).fetchone()
+        line = await (await self.db.execute('SELECT MENTOR, DESCRIPTION FROM IDEAS '
+                                            'WHERE ID = %s FOR UPDATE SKIP LOCKED',
+                                            (work_id,))).fetchone()
         if line is None:
-            return
-        cw_subj = await (await self.db.execute('SELECT SUBJECT FROM IDEAS_SUBJECTS '
-                                               'WHERE IDEA = %s', (work_id,))).fetchall()
-        accepted_from_stud = await self.get_accepted(student=student_id)
-        if not accepted_from_stud:
-            await gather(self.db.execute('INSERT INTO ACCEPTED VALUES('
-                                         '%s, %s, %s)',
-                                         (line[0], student_id, line[2],)),
-                                       # id      student  description
-                         *[self.db.execute('INSERT INTO ACCEPTED_SUBJECTS VALUES('
-                                           '%s, %s) ON CONFLICT (COURSE_WORK, SUBJECT) DO NOTHING',
-                                           (work_id, subj,))
-                           for (subj,) in cw_subj])
-        else:
-            await gather(*[self.db.execute('INSERT INTO ACCEPTED_SUBJECTS VALUES('
-                                           '%s, %s)',
-                                           (accepted_from_stud[0]['id'], subj,))
-                           for (subj,) in cw_subj])
-        student_works = await (await self.db.execute('SELECT ID FROM COURSE_WORKS WHERE STUDENT = %s', (student_id,))).fetchall()
-        await gather()
-        await gather(self.remove_idea(line[0]),
-                     *[self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS WHERE COURSE_WORK = %s',
-                                        work) for work in student_works],
-                     self.db.execute('DELETE FROM COURSE_WORKS WHERE STUDENT = %s',
-                                     (student_id,)),
-                     self.db.execute('UPDATE MENTORS SET LOAD = LOAD + 1 '
-                                     'WHERE ID = %s', (line[1],)),
-                     self.db.execute('INSERT INTO MENTORS_STUDENTS VALUES('
-                                     '%s, %s)', (line[1], student_id,)))
-        await self.db.commit()
-
-    async def accept_work(self, mentor_id, work_id):
+            return False
+        (mentor_id, description) = line
+        # no-op update, so that an existing student's id is returned as well
+        (student_id,) = await (await self.db.execute('INSERT INTO STUDENTS VALUES('
+                                                     'DEFAULT, %(name)s, %(chat_id)s) '
+                                                     'ON CONFLICT (CHAT_ID) DO UPDATE '
+                                                     'SET CHAT_ID = EXCLUDED.CHAT_ID '
+                                                     'RETURNING ID', student)).fetchone()
+        await self._lock_student(student_id)
+        args = {'work': work_id, 'student': student_id, 'description': description}
+        await self.db.execute('INSERT INTO ACCEPTED VALUES('
+                              '%(work)s, %(student)s, %(description)s) '
+                              'ON CONFLICT (STUDENT) DO NOTHING', args)
+        await self.db.execute('INSERT INTO ACCEPTED_SUBJECTS '
+                              'SELECT A.ID, I.SUBJECT FROM ACCEPTED A '
+                              'JOIN IDEAS_SUBJECTS I ON I.IDEA = %(work)s '
+                              'WHERE A.STUDENT = %(student)s '
+                              'ON CONFLICT (COURSE_WORK, SUBJECT) DO NOTHING', args)
+        await self._drop_student_course_works(student_id)
+        await self.db.execute('DELETE FROM IDEAS_SUBJECTS WHERE IDEA = %(work)s', args)
+        await self.db.execute('DELETE FROM IDEAS WHERE ID = %(work)s', args)
+        await self._link_mentor_student(mentor_id, student_id)
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
+        return True
+
+    @with_connection
+    async def accept_work(self, mentor_id, work_id, new_student=False):
         """
         Moves a line from COURSE_WORKS to ACCEPTED table, increments LOAD
-        column in MENTORS table and appends ID into COURSE_WORKS column
-        Does nothing if a line exists
+        column in MENTORS table and links the student to the mentor
+        Other course works of the student are removed. If the student already
+        has an accepted work, subjects of the course work are appended to it
+
+        Runs in a single transaction. Acceptances of course works of the same
+        student run one after another, see _lock_student, so if the course
+        work is being accepted by another mentor at the same time, it is
+        found gone afterwards
 
         Parameters
         ----------
@@ -75,59 +80,124 @@ class AcceptedTables:
             database id of the mentor
         work_id : int
             database id of the course work
+        new_student : bool
+            Only accept the course work if its student has no accepted work
+            yet, as the matching engine does
 
         Raises
         ------
         DBAccessError whatever
-        DBDoesNotExist
-        DBAlreadyExists
+
+        Returns
+        -------
+        bool
+            True if the course work was accepted, False if it does not exist
+            anymore, is being accepted concurrently or, with new_student, its
+            student has an accepted work
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        line = await (await self.db.execute('SELECT * FROM COURSE_WORKS '
+        line = await (await self.db.execute('SELECT STUDENT FROM COURSE_WORKS '
                                             'WHERE ID = %s', (work_id,))).fetchone()
         if line is None:
-            return
-        to_delete = await (await self.db.execute('SELECT ID FROM COURSE_WORKS '
-                                                 'WHERE STUDENT = %s', (line[1],))).fetchall()
-        to_delete.remove((line[0],))
-        cw_subj = await (await self.db.execute('SELECT SUBJECT FROM COURSE_WORKS_SUBJECTS '
-                                               'WHERE COURSE_WORK = %s', (work_id,))).fetchall()
-        accepted_from_stud = await self.get_accepted(student=line[1])
-        if not accepted_from_stud:
-            await gather(self.db.execute('INSERT INTO ACCEPTED VALUES('
-                                         '%s, %s, %s)',
-                                         (line[0], line[1], line[2],)),
-                                       # id      student  description
-                         *[self.db.execute('INSERT INTO ACCEPTED_SUBJECTS VALUES('
-                                           '%s, %s) ON CONFLICT (COURSE_WORK, SUBJECT) DO NOTHING',
-                                           (work_id, subj,))
-                           for (subj,) in cw_subj])
-        else:
-            await gather(*[self.db.execute('INSERT INTO ACCEPTED_SUBJECTS VALUES('
-                                           '%s, %s)',
-                                           (accepted_from_stud[0]['id'], subj,))
-                           for (subj,) in cw_subj])
-        await gather(self.remove_course_work(line[0]),
-                     self.db.execute('UPDATE MENTORS SET LOAD = LOAD + 1 '
-                                     'WHERE ID = %s', (mentor_id,)),
-                     self.db.execute('INSERT INTO MENTORS_STUDENTS VALUES('
-                                     '%s, %s)', (mentor_id, line[1],)),
-                     *[self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
-                                       'WHERE COURSE_WORK = %s', (id_f,))
-                       for (id_f,) in to_delete],
-                     *[self.db.execute('DELETE FROM COURSE_WORKS '
-                                       'WHERE ID = %s', (id_f,))
-                       for (id_f,) in to_delete])
-        await self.db.commit()
+            return False
+        await self._lock_student(line[0])
+        # might have been accepted or dropped while we were waiting
+        query = ('SELECT STUDENT, DESCRIPTION FROM COURSE_WORKS W WHERE ID = %s' +
+                 (f' AND {PENDING_CONDITION}' if new_student else '') +
+                 ' FOR UPDATE SKIP LOCKED')
+        line = await (await self.db.execute(query, (work_id,))).fetchone()
+        if line is None:
+            return False
+        (student_id, description) = line
+        args = {'work': work_id, 'student': student_id, 'description': description}
+        await self.db.execute('INSERT INTO ACCEPTED VALUES('
+                              '%(work)s, %(student)s, %(description)s) '
+                              'ON CONFLICT (STUDENT) DO NOTHING', args)
+        await self.db.execute('INSERT INTO ACCEPTED_SUBJECTS '
+                              'SELECT A.ID, CWS.SUBJECT FROM ACCEPTED A '
+                              'JOIN COURSE_WORKS_SUBJECTS CWS ON CWS.COURSE_WORK = %(work)s '
+                              'WHERE A.STUDENT = %(student)s '
+                              'ON CONFLICT (COURSE_WORK, SUBJECT) DO NOTHING', args)
+        await self._drop_student_course_works(student_id)
+        await self._link_mentor_student(mentor_id, student_id)
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
+        return True
+
+    async def _lock_student(self, student_id):
+        # serialises acceptances for a student. Otherwise two mentors
+        # accepting different works of the student deadlock: each holds the
+        # lock of its course work, which the other one deletes, and waits for
+        # the other's ACCEPTED line of the student. NO KEY UPDATE doesn't
+        # block inserts referencing the student
+        await self.db.execute('SELECT 1 FROM STUDENTS WHERE ID = %s '
+                              'FOR NO KEY UPDATE', (student_id,))
+
+    async def _drop_student_course_works(self, student_id):
+        await self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS CWS '
+                              'USING COURSE_WORKS CW '
+                              'WHERE CWS.COURSE_WORK = CW.ID AND CW.STUDENT = %s',
+                              (student_id,))
+        await self.db.execute('DELETE FROM COURSE_WORKS WHERE STUDENT = %s',
+                              (student_id,))
+
+    async def _link_mentor_student(self, mentor_id, student_id):
+        # LOAD is only incremented if the student wasn't linked already
+        await self.db.execute('WITH NEW AS ('
+                              'INSERT INTO MENTORS_STUDENTS VALUES(%s, %s) '
+                              'ON CONFLICT (MENTOR, STUDENT) DO NOTHING '
+                              'RETURNING MENTOR) '
+                              'UPDATE MENTORS SET LOAD = LOAD + 1 '
+                              'WHERE ID IN (SELECT MENTOR FROM NEW)',
+                              (mentor_id, student_id,))
+
+    async def _release_students(self, mentor_id, student_id=None):
+        """
+        Moves accepted works of students of a mentor back to COURSE_WORKS
+        table, unlinks them from the mentor and decrements its LOAD
+
+        Parameters
+        ----------
+        mentor_id : int
+            database id of the mentor
+        student_id : int or None
+            database id of the only student to release, all if None
+        """
+        link = 'MS.MENTOR = %s'
+        params = [mentor_id]
+        if student_id is not None:
+            link += ' AND MS.STUDENT = %s'
+            params.append(student_id)
+        await self.db.execute('INSERT INTO COURSE_WORKS '
+                              'SELECT A.ID, A.STUDENT, A.DESCRIPTION FROM ACCEPTED A '
+                              'JOIN MENTORS_STUDENTS MS ON MS.STUDENT = A.STUDENT '
+                              f'WHERE {link}', params)
+        await self.db.execute('INSERT INTO COURSE_WORKS_SUBJECTS '
+                              'SELECT ACS.COURSE_WORK, ACS.SUBJECT FROM ACCEPTED_SUBJECTS ACS '
+                              'JOIN ACCEPTED A ON A.ID = ACS.COURSE_WORK '
+                              'JOIN MENTORS_STUDENTS MS ON MS.STUDENT = A.STUDENT '
+                              f'WHERE {link} ON CONFLICT DO NOTHING', params)
+        await self.db.execute('DELETE FROM ACCEPTED_SUBJECTS AS ACS '
+                              'USING ACCEPTED A, MENTORS_STUDENTS MS '
+                              'WHERE ACS.COURSE_WORK = A.ID AND MS.STUDENT = A.STUDENT '
+                              f'AND {link}', params)
+        await self.db.execute('DELETE FROM ACCEPTED A USING MENTORS_STUDENTS MS '
+                              f'WHERE MS.STUDENT = A.STUDENT AND {link}', params)
+        await self.db.execute('WITH GONE AS ('
+                              f'DELETE FROM MENTORS_STUDENTS MS WHERE {link} '
+                              'RETURNING MENTOR) '
+                              'UPDATE MENTORS SET LOAD = LOAD - '
+                              '(SELECT COUNT(*) FROM GONE) '
+                              'WHERE ID = %s AND EXISTS(SELECT * FROM GONE)',
+                              params + [mentor_id])
 
+    @with_connection
     async def reject_student(self, mentor_id, stud_id):
         """
         Disown a student
 
         Moves a line from ACCEPTED to COURSE_WORK table, decrements LOAD
-        column in MENTORS table and subtracts ID from COURSE_WORKS column
-        Does nothing if a line does not exist
+        column in MENTORS table and unlinks the student from the mentor
+        Does nothing if the student is not a student of the mentor
 
         Parameters
         ----------
@@ -139,36 +209,12 @@ class AcceptedTables:
         Raises
         ------
         DBAccessError whatever
-        DBDoesNotExist
-        DBAlreadyExists
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        line = await (await self.db.execute('SELECT * FROM ACCEPTED '
-                                            'WHERE STUDENT = %s', (stud_id,))).fetchone()
-        cw_subj = await (await self.db.execute('SELECT SUBJECT FROM ACCEPTED_SUBJECTS '
-                                               'WHERE COURSE_WORK = %s', (line[0],))).fetchall() 
-        if line is None:
-            return
-        await gather(self.db.execute('INSERT INTO COURSE_WORKS VALUES('
-                                     '%s, %s, %s)',
-                                     (line[0], line[1], line[2],)),
-                     #                id      student  description
-                     *[self.db.execute('INSERT INTO COURSE_WORKS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING',
-                                       (line[0], subj))
-                       for (subj,) in cw_subj],
-                     self.db.execute('DELETE FROM ACCEPTED_SUBJECTS '
-                                     'WHERE COURSE_WORK = %s', (line[0],)),
-                     self.db.execute('DELETE FROM ACCEPTED '
-                                     'WHERE ID = %s', (line[0],)),
-                     self.db.execute('UPDATE MENTORS SET LOAD = LOAD + 1 '
-                                     'WHERE ID = %s', (mentor_id,)),
-                     self.db.execute('DELETE FROM MENTORS_STUDENTS '
-                                     'WHERE MENTOR = %s AND '
-                                     'STUDENT = %s', (mentor_id, line[1],)))
-        await self.db.commit()
+        await self._release_students(mentor_id, stud_id)
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
 
+    @with_connection
     async def readmission_work(self, work_id, new_subj=None):
         """
         Copies a line from ACCEPTED table to COURSE_WORKS table
@@ -191,8 +237,6 @@ class AcceptedTables:
         int
             Database ID of readmissioned work
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         line = await (await self.db.execute('SELECT * FROM ACCEPTED '
                                             'WHERE ID = %s', (work_id,))).fetchone()
         (cw_id,) = await (await self.db.execute('INSERT INTO COURSE_WORKS VALUES('
@@ -202,23 +246,22 @@ class AcceptedTables:
         if new_subj is not None:
             await self.db.execute('INSERT INTO COURSE_WORKS_SUBJECTS VALUES('
                                   '%s, %s)', (cw_id, new_subj,))
-        await self.db.commit()
+        await self.commit()
         return cw_id
 
+    @read_only
     async def get_accepted(self, id_field=None, subjects=[], student=None):
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         if id_field is not None:
             res = [await (await self.db.execute('SELECT * FROM ACCEPTED '
                                                 'WHERE ID = %s', (id_field,))).fetchone()]
             return await self.assemble_courses_dict(res)
         if subjects:
-            ids = [cur for (cur,) in
-                   await (await self.db.execute('SELECT COURSE_WORK FROM COURSE_WORKS_SUBJECTS '
-                                                'WHERE SUBJECT = ANY(%s)', tuple(subjects))).fetchall()]
-            works = [await (await self.db.execute('SELECT * FROM ACCEPTED '
-                                                  'WHERE ID = %s', (id_f,))).fetchone()
-                     for id_f in ids]
+            works = await (await self.db.execute('SELECT * FROM ACCEPTED '
+                                                 'WHERE ID IN (SELECT COURSE_WORK '
+                                                 'FROM ACCEPTED_SUBJECTS '
+                                                 'WHERE SUBJECT = ANY(%s)) '
+                                                 'ORDER BY ID',
+                                                 (list(subjects),))).fetchall()
             return await self.assemble_courses_dict(works)
         if student is not None:
             res = await (await self.db.execute('SELECT * FROM ACCEPTED '
@@ -1,7 +1,8 @@
-import psycopg
+from mentor_whirlpool.database.pool import with_connection, after_commit
 
 
 class AdminsTables:
+    @with_connection
     async def add_admin(self, chat_id):
         """
         Adds a line to ADMINS table
@@ -11,12 +12,12 @@ class AdminsTables:
         DBAccessError whatever
         DBAlreadyExists
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('INSERT INTO ADMINS VALUES('
                               'DEFAULT, %s)', (chat_id,))
-        await self.db.commit()
+        await self.commit()
+        after_commit(self.invalidate_roles, chat_id)
 
+    @with_connection
     async def get_admins(self):
         """
         Gets all lines from ADMINS table
@@ -26,8 +27,6 @@ class AdminsTables:
         iterable
             Iterable over all subjects (str's)
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         cur = await (await self.db.execute('SELECT * FROM ADMINS')).fetchall()
         return [{'id': adm[0], 'chat_id': adm[1]} for adm in cur]
 
@@ -45,13 +44,9 @@ class AdminsTables:
         boolean
             True if exists, false otherwise
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        return (await (await self.db.execute('SELECT EXISTS('
-                                             'SELECT * FROM ADMINS '
-                                             'WHERE CHAT_ID = %s)',
-                                             (chat_id,))).fetchone())[0]
+        return (await self.get_roles(chat_id))['admin']
 
+    @with_connection
     async def remove_admin(self, id=None, chat_id=None):
         """
         Removes a line from ADMINS table
@@ -66,12 +61,11 @@ class AdminsTables:
         DBAccessError whatever
         DBDoesNotExist
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         if id is not None:
             await self.db.execute('DELETE FROM ADMINS '
                                   'WHERE ID = %s', (id,))
         if chat_id is not None:
             await self.db.execute('DELETE FROM ADMINS '
                                   'WHERE CHAT_ID = %s', (chat_id,))
-        await self.db.commit()
+        await self.commit()
+        after_commit(self.invalidate_roles, chat_id)
@@ -1,8 +1,14 @@
-import psycopg
-from asyncio import gather
+from mentor_whirlpool.database.pool import with_connection, read_only
+from mentor_whirlpool.database.paging import fetch_page
+from mentor_whirlpool.database.mentors_tables import WORK_SUBJECTS_JSON
+
+# course works the matching engine may assign, of students with no accepted
+# work
+PENDING_CONDITION = 'NOT EXISTS(SELECT * FROM ACCEPTED A WHERE A.STUDENT = W.STUDENT)'
 
 
 class CourseWorksTables:
+    @with_connection
     async def add_course_work(self, line):
         """
         Adds a new course work to the database
@@ -23,8 +29,6 @@ class CourseWorksTables:
         int
             Database ID of inserted course work
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('INSERT INTO STUDENTS VALUES('
                               'DEFAULT, %(name)s, %(chat_id)s) '
                               'ON CONFLICT (CHAT_ID) DO NOTHING',
@@ -36,36 +40,49 @@ class CourseWorksTables:
                                              'DEFAULT, %s, %s) '
                                              'RETURNING ID',
                                              (stud_id, line['description'],))).fetchone())[0]
-        await gather(*[self.db.execute('INSERT INTO COURSE_WORKS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING', (work, subj,))
-                       for subj in line['subjects']])
-        await self.db.commit()
+        await self.executemany('INSERT INTO COURSE_WORKS_SUBJECTS VALUES('
+                               '%s, %s) ON CONFLICT DO NOTHING',
+                               [(work, subj,) for subj in line['subjects']])
+        await self.commit()
         return work
 
     async def assemble_courses_dict(self, cursor):
+        cursor = [i for i in cursor if i is not None]
+        subjects = await self.get_subjects_for_works(i[0] for i in cursor)
         list = []
         for i in cursor:
-            if i is None:
-                continue
             line = {
                 'id': i[0],
                 'student': i[1],
-                'subjects': await self.get_subjects(work_id=i[0]),
+                'subjects': subjects[i[0]],
                 'description': i[2],
             }
             list.append(line)
         return list
 
-    async def get_course_works(self, id_field=None, subjects=[], student=None):
+    @read_only
+    async def get_course_works(self, id_field=None, subjects=[], student=None,
+                               limit=None, after_id=None, before_id=None):
         """
         Gets all submitted course works that satisfy the argument subject
         Subject may be empty, in this case, return all course works
+        Course works are ordered by database id
 
         Parameters
         ----------
+        id_field : int
+            Database id of the course work
         subjects : iterable(integer)
             All database ids, indicating needed subjects
             If empty, consider all possible subjects needed
+        student : int
+            Database id of the student
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this, next page
+        before_id : int or None
+            Return lines with database id less than this, previous page
 
         Raises
         ------
@@ -76,30 +93,113 @@ class CourseWorksTables:
         iterable
             Iterable over all compliant lines (dict of columns excluding ID)
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
+        conditions = []
+        params = []
         if id_field is not None:
-            res = [await (await self.db.execute('SELECT * FROM COURSE_WORKS '
-                                                'WHERE ID = %s', (id_field,))).fetchone()]
-            return await self.assemble_courses_dict(res)
+            conditions.append('ID = %s')
+            params.append(id_field)
         if subjects:
-            ids = await (await self.db.execute('SELECT COURSE_WORK FROM COURSE_WORKS_SUBJECTS '
-                                               'WHERE SUBJECT = ANY(%s)', (subjects,))).fetchall()
-            ids += await (await self.db.execute('SELECT COURSE_WORK FROM ACCEPTED_SUBJECTS '
-                                                'WHERE SUBJECT = ANY(%s)', (subjects,))).fetchall()
-            ids = set(ids)
-            works = [await (await self.db.execute('SELECT * FROM COURSE_WORKS '
-                                                  'WHERE ID = %s', (id_f,))).fetchone()
-                     for (id_f,) in ids]
-            return await self.assemble_courses_dict(works)
+            conditions.append('ID IN (SELECT COURSE_WORK FROM COURSE_WORKS_SUBJECTS '
+                              'WHERE SUBJECT = ANY(%s))')
+            params.append(list(subjects))
         if student is not None:
-            res = await (await self.db.execute('SELECT * FROM COURSE_WORKS '
-                                               'WHERE STUDENT = %s',
-                                               (student,))).fetchall()
-            return await self.assemble_courses_dict(res)
-        res = await (await self.db.execute('SELECT * FROM COURSE_WORKS')).fetchall()
+            conditions.append('STUDENT = %s')
+            params.append(student)
+        res = await fetch_page(self.db, 'SELECT * FROM COURSE_WORKS', conditions, params,
+                               limit=limit, after_id=after_id, before_id=before_id)
         return await self.assemble_courses_dict(res)
 
+    @read_only
+    async def get_open_requests_for_mentor(self, mentor_id, limit=None,
+                                           after_id=None, before_id=None):
+        """
+        Gets course works a mentor may accept: ones with a subject of the
+        mentor, excluding works of the mentor's students. Ordered by
+        database id, takes a single query
+
+        Parameters
+        ----------
+        mentor_id : int
+            database id of the mentor
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this, next page
+        before_id : int or None
+            Return lines with database id less than this, previous page
+
+        Returns
+        -------
+        list(dict)
+            Course works with fields 'id', 'student', 'subjects',
+            'description', 'student_name', 'student_chat_id' and
+            'additional', which is True if the student already has a mentor
+        """
+        lines = await fetch_page(self.db,
+                                 'SELECT W.ID, W.STUDENT, W.DESCRIPTION, '
+                                 f'{WORK_SUBJECTS_JSON}, ST.NAME, ST.CHAT_ID, '
+                                 'EXISTS(SELECT * FROM ACCEPTED A WHERE A.STUDENT = W.STUDENT) '
+                                 'FROM COURSE_WORKS W '
+                                 'JOIN STUDENTS ST ON ST.ID = W.STUDENT',
+                                 ['EXISTS(SELECT * FROM COURSE_WORKS_SUBJECTS CWS '
+                                  'JOIN MENTORS_SUBJECTS MS ON MS.SUBJECT = CWS.SUBJECT '
+                                  'WHERE CWS.COURSE_WORK = W.ID AND MS.MENTOR = %s)',
+                                  'W.STUDENT NOT IN (SELECT STUDENT FROM MENTORS_STUDENTS '
+                                  'WHERE MENTOR = %s)'],
+                                 [mentor_id, mentor_id], column='W.ID', limit=limit,
+                                 after_id=after_id, before_id=before_id)
+        return [{
+            'id': i[0],
+            'student': i[1],
+            'subjects': i[3],
+            'description': i[2],
+            'student_name': i[4],
+            'student_chat_id': i[5],
+            'additional': i[6],
+        } for i in lines]
+
+    @with_connection
+    async def get_pending_requests(self, limit=None, after_id=None):
+        """
+        Gets course works in a compact form for the matching engine, ordered
+        by database id. Course works of students, who have an accepted work
+        already, are left out, they are never assigned automatically
+
+        Parameters
+        ----------
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this
+
+        Returns
+        -------
+        list(dict)
+            Dicts with fields 'id', 'student' and 'subjects' (list of
+            database ids)
+        """
+        lines = await fetch_page(self.db,
+                                 'SELECT W.ID, W.STUDENT, ARRAY(SELECT SUBJECT '
+                                 'FROM COURSE_WORKS_SUBJECTS WHERE COURSE_WORK = W.ID) '
+                                 'FROM COURSE_WORKS W', [PENDING_CONDITION], [],
+                                 column='W.ID', limit=limit, after_id=after_id)
+        return [{'id': i[0], 'student': i[1], 'subjects': i[2]} for i in lines]
+
+    @with_connection
+    async def get_pending_request_ids(self):
+        """
+        Gets database ids of every course work get_pending_requests would
+        return, for the matching engine to drop requests which are gone
+
+        Returns
+        -------
+        set(int)
+        """
+        lines = await (await self.db.execute('SELECT W.ID FROM COURSE_WORKS W '
+                                             f'WHERE {PENDING_CONDITION}')).fetchall()
+        return {i[0] for i in lines}
+
+    @with_connection
     async def modify_course_work(self, line):
         """
         Modifies an existing line in the database, matching 'chat_id' field
@@ -115,40 +215,34 @@ class CourseWorksTables:
         DBAccessError whatever
         DBDoesNotExists
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         old_ids = await (await self.db.execute('SELECT SUBJECT FROM COURSE_WORKS_SUBJECTS '
                                                'WHERE COURSE_WORK = %(id)s',
                                                line)).fetchall()
-        old = [subj for (subj,) in
-               [await (await self.db.execute('SELECT SUBJECT FROM SUBJECTS '
-                                             'WHERE ID = %s', (id_f,))).fetchone()
-                for (id_f,) in old_ids]]
-        tasks = []
+        catalog = await self.load_subjects()
+        if any(id_f not in catalog for (id_f,) in old_ids):
+            catalog = await self.load_subjects(reload=True)
+        old = [catalog[id_f] for (id_f,) in old_ids]
         for new in set(line['subjects']).difference(old):
-            tasks.append(self.add_subject(new))
-        for removed in set(old).difference(line['subjects']):
-            tasks.append(self.db.execute('UPDATE SUBJECTS '
-                                         'SET COUNT = COUNT - 1 '
-                                         'WHERE SUBJECT = %s', (removed,)))
-        await gather(*tasks)
-        subjects = [id_f for (id_f,) in
-                    [await (await self.db.execute('SELECT ID FROM SUBJECTS '
-                                                  'WHERE SUBJECT = %s',
-                                                  (subj,))).fetchone()
-                     for subj in line['subjects']]]
-        await gather(self.db.execute('UPDATE COURSE_WORKS SET '
-                                     'DESCRIPTION = %s '
-                                     'WHERE ID = %s',
-                                     (line['description'], line['id'],)),
-                     self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
-                                     'WHERE COURSE_WORK = %s', (line['id'],)))
-        await gather(*[self.db.execute('INSERT INTO COURSE_WORKS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING',
-                                       (line['id'], subj,))
-                       for subj in subjects])
-        await self.db.commit()
+            await self.add_subject(new)
+        await self.executemany('UPDATE SUBJECTS '
+                               'SET COUNT = COUNT - 1 '
+                               'WHERE SUBJECT = %s',
+                               [(removed,) for removed in set(old).difference(line['subjects'])])
+        subjects = [(await self.get_subjects(name=subj))[0]['id']
+                    for subj in line['subjects']]
+        async with self.pipeline():
+            await self.db.execute('UPDATE COURSE_WORKS SET '
+                                  'DESCRIPTION = %s '
+                                  'WHERE ID = %s',
+                                  (line['description'], line['id'],))
+            await self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
+                                  'WHERE COURSE_WORK = %s', (line['id'],))
+            await self.executemany('INSERT INTO COURSE_WORKS_SUBJECTS VALUES('
+                                   '%s, %s) ON CONFLICT DO NOTHING',
+                                   [(line['id'], subj,) for subj in subjects])
+        await self.commit()
 
+    @with_connection
     async def remove_course_work(self, id_field):
         """
         Removes a line from COURSE_WORKS table
@@ -163,8 +257,6 @@ class CourseWorksTables:
         ------
         DBAccessError whatever
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         (stud_id,) = await (await self.db.execute('SELECT STUDENT FROM COURSE_WORKS '
                                                   'WHERE ID = %s', (id_field,))).fetchone()
         await self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
@@ -182,4 +274,4 @@ class CourseWorksTables:
         if not student_relevant:
             await self.db.execute('DELETE FROM STUDENTS '
                                   'WHERE ID = %s', (stud_id,))
-        await self.db.commit()
+        await self.commit()
@@ -1,8 +1,9 @@
-import psycopg
-from asyncio import gather
+from mentor_whirlpool.database.pool import with_connection, read_only
+from mentor_whirlpool.database.paging import fetch_page
 
 
 class IdeasTables:
+    @with_connection
     async def add_idea(self, line):
         """
         Adds a new idea to the database
@@ -22,8 +23,6 @@ class IdeasTables:
         int
             Database ID of inserted course work
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('INSERT INTO STUDENTS VALUES('
                               'DEFAULT, %(name)s, %(chat_id)s) '
                               'ON CONFLICT (CHAT_ID) DO NOTHING',
@@ -35,36 +34,49 @@ class IdeasTables:
                                              'DEFAULT, %s, %s) '
                                              'RETURNING ID',
                                              (mentor_id, line['description'],))).fetchone())[0]
-        await gather(*[self.db.execute('INSERT INTO IDEAS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING', (work, subj,))
-                       for subj in line['subjects']])
-        await self.db.commit()
+        await self.executemany('INSERT INTO IDEAS_SUBJECTS VALUES('
+                               '%s, %s) ON CONFLICT DO NOTHING',
+                               [(work, subj,) for subj in line['subjects']])
+        await self.commit()
         return work
 
     async def assemble_ideas_dict(self, cursor):
+        cursor = [i for i in cursor if i is not None]
+        subjects = await self.get_subjects_for_ideas(i[0] for i in cursor)
         list = []
         for i in cursor:
-            if i is None:
-                continue
             line = {
                 'id': i[0],
                 'mentor': i[1],
-                'subjects': await self.get_subjects(work_id=i[0]),
+                'subjects': subjects[i[0]],
                 'description': i[2],
             }
             list.append(line)
         return list
 
-    async def get_ideas(self, id_field=None, subjects=[], mentor=None):
+    @read_only
+    async def get_ideas(self, id_field=None, subjects=[], mentor=None,
+                        limit=None, after_id=None, before_id=None):
         """
         Gets all submitted ideas that satisfy the argument subject
         Subject may be empty, in this case, return all course works
+        Ideas are ordered by database id
 
         Parameters
         ----------
+        id_field : int
+            Database id of the idea
         subjects : iterable(integer)
             All database ids, indicating needed subjects
             If empty, consider all possible subjects needed
+        mentor : int
+            Database id of the mentor
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this, next page
+        before_id : int or None
+            Return lines with database id less than this, previous page
 
         Raises
         ------
@@ -75,27 +87,23 @@ class IdeasTables:
         iterable
             Iterable over all compliant lines (dict of columns excluding ID)
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
+        conditions = []
+        params = []
         if id_field is not None:
-            res = [await (await self.db.execute('SELECT * FROM IDEAS '
-                                                'WHERE ID = %s', (id_field,))).fetchone()]
-            return await self.assemble_ideas_dict(res)
+            conditions.append('ID = %s')
+            params.append(id_field)
         if subjects:
-            ids = await (await self.db.execute('SELECT IDEA FROM IDEAS_SUBJECTS '
-                                               'WHERE SUBJECT = ANY(%s)', (subjects,))).fetchall()
-            works = [await (await self.db.execute('SELECT * FROM IDEAS '
-                                                  'WHERE ID = %s', (id_f,))).fetchone()
-                     for (id_f,) in ids]
-            return await self.assemble_ideas_dict(works)
+            conditions.append('ID IN (SELECT IDEA FROM IDEAS_SUBJECTS '
+                              'WHERE SUBJECT = ANY(%s))')
+            params.append(list(subjects))
         if mentor is not None:
-            res = await (await self.db.execute('SELECT * FROM IDEAS '
-                                               'WHERE MENTOR = %s',
-                                               (mentor,))).fetchall()
-            return await self.assemble_ideas_dict(res)
-        res = await (await self.db.execute('SELECT * FROM IDEAS')).fetchall()
+            conditions.append('MENTOR = %s')
+            params.append(mentor)
+        res = await fetch_page(self.db, 'SELECT * FROM IDEAS', conditions, params,
+                               limit=limit, after_id=after_id, before_id=before_id)
         return await self.assemble_ideas_dict(res)
 
+    @with_connection
     async def modify_idea(self, line):
         """
         Modifies an existing line in the database, matching 'chat_id' field
@@ -111,40 +119,34 @@ class IdeasTables:
         DBAccessError whatever
         DBDoesNotExists
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         old_ids = await (await self.db.execute('SELECT SUBJECT FROM IDEAS_SUBJECTS '
                                                'WHERE IDEA = %(id)s',
                                                line)).fetchall()
-        old = [subj for (subj,) in
-               [await (await self.db.execute('SELECT SUBJECT FROM SUBJECTS '
-                                             'WHERE ID = %s', (id_f,))).fetchone()
-                for (id_f,) in old_ids]]
-        tasks = []
+        catalog = await self.load_subjects()
+        if any(id_f not in catalog for (id_f,) in old_ids):
+            catalog = await self.load_subjects(reload=True)
+        old = [catalog[id_f] for (id_f,) in old_ids]
         for new in set(line['subjects']).difference(old):
-            tasks.append(self.add_subject(new))
-        for removed in set(old).difference(line['subjects']):
-            tasks.append(self.db.execute('UPDATE SUBJECTS '
-                                         'SET COUNT = COUNT - 1 '
-                                         'WHERE SUBJECT = %s', (removed,)))
-        await gather(*tasks)
-        subjects = [id_f for (id_f,) in
-                    [await (await self.db.execute('SELECT ID FROM SUBJECTS '
-                                                  'WHERE SUBJECT = %s',
-                                                  (subj,))).fetchone()
-                     for subj in line['subjects']]]
-        await gather(self.db.execute('UPDATE IDEAS SET '
-                                     'DESCRIPTION = %s '
-                                     'WHERE ID = %s',
-                                     (line['description'], line['id'],)),
-                     self.db.execute('DELETE FROM IDEAS_SUBJECTS '
-                                     'WHERE IDEA = %s', (line['id'],)))
-        await gather(*[self.db.execute('INSERT INTO IDEAS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING',
-                                       (line['id'], subj,))
-                       for subj in subjects])
-        await self.db.commit()
-
+            await self.add_subject(new)
+        await self.executemany('UPDATE SUBJECTS '
+                               'SET COUNT = COUNT - 1 '
+                               'WHERE SUBJECT = %s',
+                               [(removed,) for removed in set(old).difference(line['subjects'])])
+        subjects = [(await self.get_subjects(name=subj))[0]['id']
+                    for subj in line['subjects']]
+        async with self.pipeline():
+            await self.db.execute('UPDATE IDEAS SET '
+                                  'DESCRIPTION = %s '
+                                  'WHERE ID = %s',
+                                  (line['description'], line['id'],))
+            await self.db.execute('DELETE FROM IDEAS_SUBJECTS '
+                                  'WHERE IDEA = %s', (line['id'],))
+            await self.executemany('INSERT INTO IDEAS_SUBJECTS VALUES('
+                                   '%s, %s) ON CONFLICT DO NOTHING',
+                                   [(line['id'], subj,) for subj in subjects])
+        await self.commit()
+
+    @with_connection
     async def remove_idea(self, id_field):
         """
         Removes a line from COURSE_WORKS table
@@ -159,10 +161,8 @@ class IdeasTables:
         ------
         DBAccessError whatever
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('DELETE FROM IDEAS_SUBJECTS '
                               'WHERE IDEA = %s', (id_field,))
         await self.db.execute('DELETE FROM IDEAS '
                               'WHERE ID = %s', (id_field,))
-        await self.db.commit()
+        await self.commit()
@@ -1,8 +1,66 @@
-import psycopg
-from asyncio import gather
+from mentor_whirlpool.database.pool import (with_connection, read_only, detached,
+                                            after_commit)
+from mentor_whirlpool.database.paging import fetch_page
+from asyncio import sleep, create_task, get_running_loop
+from os import environ as env
+import logging
+
+# subjects of a course work are looked up by its id in both link tables, the
+# same way get_subjects(work_id=...) does
+WORK_SUBJECTS_JSON = ("COALESCE((SELECT json_agg(json_build_object("
+                      "'id', S.ID, 'subject', S.SUBJECT)) "
+                      'FROM (SELECT SUBJECT FROM COURSE_WORKS_SUBJECTS '
+                      'WHERE COURSE_WORK = W.ID '
+                      'UNION ALL '
+                      'SELECT SUBJECT FROM ACCEPTED_SUBJECTS '
+                      'WHERE COURSE_WORK = W.ID) WS '
+                      "JOIN SUBJECTS S ON S.ID = WS.SUBJECT), '[]')")
+
+# pending course works go first, followed by the accepted one, matching
+# get_course_works(student=...) + get_accepted(student=...)
+STUDENT_WORKS_JSON = ("COALESCE((SELECT json_agg(json_build_object("
+                      "'id', W.ID, 'student', W.STUDENT, "
+                      f"'subjects', {WORK_SUBJECTS_JSON}, "
+                      "'description', W.DESCRIPTION) "
+                      'ORDER BY W.ACCEPTED, W.ID) '
+                      'FROM (SELECT ID, STUDENT, DESCRIPTION, FALSE AS ACCEPTED '
+                      'FROM COURSE_WORKS WHERE STUDENT = ST.ID '
+                      'UNION ALL '
+                      'SELECT ID, STUDENT, DESCRIPTION, TRUE '
+                      "FROM ACCEPTED WHERE STUDENT = ST.ID) W), '[]')")
+
+MENTORS_QUERY = ('SELECT M.ID, M.NAME, M.CHAT_ID, M.LOAD, '
+                 "COALESCE((SELECT json_agg(json_build_object("
+                 "'id', S.ID, 'subject', S.SUBJECT)) "
+                 'FROM MENTORS_SUBJECTS MS '
+                 'JOIN SUBJECTS S ON S.ID = MS.SUBJECT '
+                 "WHERE MS.MENTOR = M.ID), '[]'), "
+                 "COALESCE((SELECT json_agg(json_build_object("
+                 "'id', ST.ID, 'name', ST.NAME, 'chat_id', ST.CHAT_ID, "
+                 f"'course_works', {STUDENT_WORKS_JSON})) "
+                 'FROM MENTORS_STUDENTS MST '
+                 'JOIN STUDENTS ST ON ST.ID = MST.STUDENT '
+                 "WHERE MST.MENTOR = M.ID), '[]') "
+                 'FROM MENTORS M')
+
+# MENTORS_STATS is a materialized view, see migrations/0004_mentors_stats.sql
+MENTORS_OVERVIEW_QUERY = ('SELECT M.ID, M.NAME, M.CHAT_ID, M.LOAD, '
+                          "COALESCE((SELECT json_agg(json_build_object("
+                          "'subject', S.SUBJECT, 'students', STATS.STUDENTS) "
+                          'ORDER BY S.SUBJECT) '
+                          'FROM MENTORS_STATS STATS '
+                          'JOIN SUBJECTS S ON S.ID = STATS.SUBJECT '
+                          "WHERE STATS.MENTOR = M.ID), '[]') "
+                          'FROM MENTORS M')
 
 
 class MentorsTables:
+    # pending refresh of MENTORS_STATS, shared by the whole process, so that
+    # Database instances of all handlers are debounced together
+    _stats_refresh = None
+    stats_refresh_delay = float(env.get('MENTORS_STATS_REFRESH_DELAY', 2))
+
+    @with_connection
     async def add_mentor(self, line):
         """
         Adds a new mentor to the database
@@ -17,42 +75,45 @@ class MentorsTables:
         DBAccessError whatever
         DBAlreadyExists
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         (ment_id,) = await (await self.db.execute('INSERT INTO MENTORS VALUES('
                                                   'DEFAULT, %(name)s, %(chat_id)s, 0) '
                                                   'RETURNING ID', line)).fetchone()
-        subj_ids = []
-        if line['subjects'] is not None:
-            subj_ids = await gather(*[self.add_subject(subj) for subj in line['subjects']])
-        await gather(*[self.db.execute('INSERT INTO MENTORS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING',
-                                       (ment_id, subj,)) for subj in subj_ids])
-        await self.db.commit()
+        subj_ids = [await self.add_subject(subj) for subj in line['subjects'] or []]
+        await self.executemany('INSERT INTO MENTORS_SUBJECTS VALUES('
+                               '%s, %s) ON CONFLICT DO NOTHING',
+                               [(ment_id, subj,) for subj in subj_ids])
+        await self.commit()
+        after_commit(self.invalidate_roles, line['chat_id'])
+        after_commit(self.schedule_stats_refresh)
 
     async def assemble_mentors_dict(self, cursor):
         list = []
         for i in cursor:
             if i is None:
                 continue
-            students = await self.get_students(mentor_id=i[0])
             line = {
                 'id': i[0],
                 'name': i[1],
                 'chat_id': i[2],
-                'subjects': await self.get_subjects(mentor_id=i[0]),
+                'subjects': i[4],
                 'load': i[3],
-                'students': students,
+                'students': i[5],
             }
             list.append(line)
         return list
 
-    async def get_mentors(self, id=None, chat_id=None, student=None):
+    @read_only
+    async def get_mentors(self, id=None, chat_id=None, student=None,
+                          limit=None, after_id=None, before_id=None):
         """
         Gets all lines from MENTORS table
         If student argument is supplied, search for a mentor for a specific
         student
 
+        Subjects, students and their course works are aggregated by the
+        database, so this takes a single query regardless of the number of
+        mentors
+
         Parameters
         ----------
         id : int
@@ -61,40 +122,147 @@ class MentorsTables:
             telegram chat_id of required mentor
         student : int
             database id of student to search mentor by
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this, next page
+        before_id : int or None
+            Return lines with database id less than this, previous page
 
         Returns
         ------
         iterable
             Iterable over all mentors
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        mentors = None
+        conditions = []
+        params = []
         if id is not None:
-            mentors = [await (await self.db.execute('SELECT * FROM MENTORS '
-                                                    'WHERE ID = %s',
-                                                    (id,))).fetchone()]
+            conditions.append('M.ID = %s')
+            params.append(id)
         if chat_id is not None:
-            mentors = [await (await self.db.execute('SELECT * FROM MENTORS '
-                                                    'WHERE CHAT_ID = %s',
-                                                    (chat_id,))).fetchone()]
+            conditions.append('M.CHAT_ID = %s')
+            params.append(chat_id)
         if student is not None:
-            mentors = await (await self.db.execute('SELECT MENTOR FROM MENTORS_STUDENTS '
-                                                   'WHERE STUDENT= %s',
-                                                   (student,))).fetchall()
-            if not mentors:
-                return []
-            # parameter is just mentor, as it is already a tuple
-            # beneficial to do so, because fetchone will return None if
-            # mentor has not been found
-            mentors = [await (await self.db.execute('SELECT * FROM MENTORS '
-                                                    'WHERE ID = %s',
-                                                    (ment,))).fetchone()
-                       for (ment,) in mentors]
-        if id is None and chat_id is None and student is None:
-            mentors = await (await self.db.execute('SELECT * FROM MENTORS')).fetchall()
+            conditions.append('M.ID IN (SELECT MENTOR FROM MENTORS_STUDENTS '
+                              'WHERE STUDENT = %s)')
+            params.append(student)
+        mentors = await fetch_page(self.db, MENTORS_QUERY, conditions, params,
+                                   column='M.ID', limit=limit,
+                                   after_id=after_id, before_id=before_id)
         return await self.assemble_mentors_dict(mentors)
 
+    @read_only
+    async def get_mentors_overview(self, limit=None, after_id=None, before_id=None):
+        """
+        Gets mentors with the amount of their students per subject for the
+        admin overview. Counts are read from MENTORS_STATS, which is refreshed
+        shortly after changes, see schedule_stats_refresh
+
+        Parameters
+        ----------
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this, next page
+        before_id : int or None
+            Return lines with database id less than this, previous page
+
+        Returns
+        -------
+        list(dict)
+            Dicts with fields 'id', 'name', 'chat_id', 'load' and 'subjects',
+            a list of dicts with fields 'subject' and 'students'
+        """
+        mentors = await fetch_page(self.db, MENTORS_OVERVIEW_QUERY, [], [],
+                                   column='M.ID', limit=limit,
+                                   after_id=after_id, before_id=before_id)
+        return [{'id': i[0], 'name': i[1], 'chat_id': i[2], 'load': i[3],
+                 'subjects': i[4]} for i in mentors]
+
+    @with_connection
+    async def refresh_mentors_stats(self):
+        """
+        Recomputes MENTORS_STATS. Readers are not blocked while it runs
+        """
+        await self.db.execute('REFRESH MATERIALIZED VIEW CONCURRENTLY MENTORS_STATS')
+        await self.commit()
+
+    def schedule_stats_refresh(self):
+        """
+        Refreshes MENTORS_STATS in MENTORS_STATS_REFRESH_DELAY seconds
+        (2 by default), unless a refresh is pending already. Changes made in
+        the meantime are picked up by that refresh, so bursts of changes cost
+        a single one
+        """
+        pending = MentorsTables._stats_refresh
+        # a task left on a closed event loop will never run
+        if pending is not None and not pending.done() and \
+                pending.get_loop() is get_running_loop():
+            return
+        MentorsTables._stats_refresh = create_task(detached(self._refresh_stats_later))
+
+    async def _refresh_stats_later(self):
+        await sleep(self.stats_refresh_delay)
+        # changes committed from now on need another refresh
+        MentorsTables._stats_refresh = None
+        try:
+            await self.refresh_mentors_stats()
+        except Exception:
+            logging.exception('MENTORS_STATS: refresh failed')
+
+    @with_connection
+    async def get_mentor_chat_ids_for_subject(self, subject_id, exclude_student=None):
+        """
+        Gets chat ids of mentors, who lead a subject, to notify them of a new
+        request. Takes a single lookup by MENTORS_SUBJECTS index
+
+        Parameters
+        ----------
+        subject_id : int
+            database id of the subject
+        exclude_student : int or None
+            database id of a student, whose mentors are left out
+
+        Returns
+        -------
+        list(int)
+            Telegram chat ids of the mentors
+        """
+        query = ('SELECT M.CHAT_ID FROM MENTORS_SUBJECTS MS '
+                 'JOIN MENTORS M ON M.ID = MS.MENTOR '
+                 'WHERE MS.SUBJECT = %s')
+        params = [subject_id]
+        if exclude_student is not None:
+            query += (' AND MS.MENTOR NOT IN (SELECT MENTOR FROM MENTORS_STUDENTS '
+                      'WHERE STUDENT = %s)')
+            params.append(exclude_student)
+        return [chat_id for (chat_id,) in
+                await (await self.db.execute(query, params)).fetchall()]
+
+    @with_connection
+    async def get_mentors_for_matching(self, default_capacity):
+        """
+        Gets what the matching engine needs to know about every mentor
+
+        Parameters
+        ----------
+        default_capacity : int
+            Capacity of mentors with no CAPACITY set
+
+        Returns
+        -------
+        list(dict)
+            Dicts with fields 'id', 'subjects' and 'students' (lists of
+            database ids), 'load' and 'capacity'
+        """
+        lines = await (await self.db.execute(
+            'SELECT M.ID, ARRAY(SELECT SUBJECT FROM MENTORS_SUBJECTS WHERE MENTOR = M.ID), '
+            'ARRAY(SELECT STUDENT FROM MENTORS_STUDENTS WHERE MENTOR = M.ID), '
+            'COALESCE(M.LOAD, 0), COALESCE(M.CAPACITY, %s) FROM MENTORS M',
+            (default_capacity,))).fetchall()
+        return [{'id': i[0], 'subjects': i[1], 'students': i[2],
+                 'load': i[3], 'capacity': i[4]} for i in lines]
+
     async def check_is_mentor(self, chat_id):
         """
         Checks if specified chat_id is present in database as a mentor
@@ -109,16 +277,16 @@ class MentorsTables:
         boolean
             True if exists, false otherwise
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        return (await (await self.db.execute('SELECT EXISTS('
-                                             'SELECT * FROM MENTORS '
-                                             'WHERE CHAT_ID = %s)',
-                                             (chat_id,))).fetchone())[0]
+        return (await self.get_roles(chat_id))['mentor']
 
+    @with_connection
     async def remove_mentor(self, id_field=None, chat_id=None):
         """
-        Removes a line from MENTORS table
+        Removes a line from MENTORS table along with ideas of the mentor
+        Accepted works of the students of the mentor are moved back to
+        COURSE_WORKS table
+
+        Runs in a single transaction with a fixed number of statements
 
         Parameters
         ----------
@@ -132,25 +300,45 @@ class MentorsTables:
         DBAccessError whatever
         DBDoesNotExist
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         if chat_id is not None:
             (id_field,) = await (await self.db.execute('SELECT ID FROM MENTORS '
                                                 'WHERE CHAT_ID = %s', (chat_id,))
                                  ).fetchone()
-        students = await (await self.db.execute('SELECT STUDENT FROM MENTORS_STUDENTS '
-                                                'WHERE MENTOR = %s', (id_field,))).fetchall()
-
-        await gather(self.db.execute('DELETE FROM MENTORS_SUBJECTS '
-                                     'WHERE MENTOR = %s', (id_field,)),
-                     self.db.execute('DELETE FROM MENTORS_STUDENTS '
-                                     'WHERE MENTOR = %s', (id_field,)),
-                     self.db.execute('DELETE FROM MENTORS '
-                                     'WHERE ID = %s', (id_field,)),
-                     *[self.reject_student(id_field, stud)
-                       for (stud,) in students])
-        await self.db.commit()
+        await self.db.execute('DELETE FROM IDEAS_SUBJECTS AS I USING IDEAS '
+                              'WHERE I.IDEA = IDEAS.ID AND IDEAS.MENTOR = %s',
+                              (id_field,))
+        await self.db.execute('DELETE FROM IDEAS WHERE MENTOR = %s', (id_field,))
+        await self.db.execute('DELETE FROM MENTORS_SUBJECTS WHERE MENTOR = %s',
+                              (id_field,))
+        await self._release_students(id_field)
+        await self.db.execute('DELETE FROM MENTORS WHERE ID = %s', (id_field,))
+        await self.commit()
+        after_commit(self.invalidate_roles, chat_id)
+        after_commit(self.schedule_stats_refresh)
+
+    @with_connection
+    async def reconcile_loads(self):
+        """
+        Recomputes LOAD of every mentor from MENTORS_STUDENTS in a single
+        UPDATE. LOAD is kept in sync by the statements linking and unlinking
+        students, this repairs counters which have drifted before
+
+        Returns
+        -------
+        int
+            Amount of mentors whose LOAD was wrong
+        """
+        fixed = await (await self.db.execute(
+            'UPDATE MENTORS M SET LOAD = C.STUDENTS '
+            'FROM (SELECT MENTORS.ID, COUNT(MS.STUDENT) AS STUDENTS FROM MENTORS '
+            'LEFT JOIN MENTORS_STUDENTS MS ON MS.MENTOR = MENTORS.ID '
+            'GROUP BY MENTORS.ID) C '
+            'WHERE C.ID = M.ID AND M.LOAD IS DISTINCT FROM C.STUDENTS '
+            'RETURNING M.ID')).fetchall()
+        await self.commit()
+        return len(fixed)
 
+    @with_connection
     async def add_mentor_subjects(self, id_field, subjects):
         """
         Add subjects to mentor
@@ -167,13 +355,13 @@ class MentorsTables:
         DBAccessError whatever
         DBDoesNotExist
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        await gather(*[self.db.execute('INSERT INTO MENTORS_SUBJECTS VALUES('
-                                       '%s, %s) ON CONFLICT DO NOTHING', (id_field, subj,)) 
-                       for subj in subjects])
-        await self.db.commit()
+        await self.executemany('INSERT INTO MENTORS_SUBJECTS VALUES('
+                               '%s, %s) ON CONFLICT DO NOTHING',
+                               [(id_field, subj,) for subj in subjects])
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
 
+    @with_connection
     async def remove_mentor_subjects(self, id_field, subjects):
         """
         Removes a string from SUBJECTS array of a mentor with a specified ID
@@ -190,10 +378,8 @@ class MentorsTables:
         DBAccessError whatever
         DBDoesNotExist
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        await gather(*[self.db.execute('DELETE FROM MENTORS_SUBJECTS '
-                                       'WHERE MENTOR = %s AND '
-                                       'SUBJECT = %s', (id_field, subj,))
-                       for subj in subjects])
-        await self.db.commit()
+        await self.executemany('DELETE FROM MENTORS_SUBJECTS '
+                               'WHERE MENTOR = %s AND '
+                               'SUBJECT = %s', [(id_field, subj,) for subj in subjects])
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
@@ -0,0 +1,80 @@
+-- tables created by initdb before migrations existed, IF NOT EXISTS keeps it
+-- applicable to databases created back then
+CREATE TABLE IF NOT EXISTS STUDENTS(
+    ID BIGSERIAL PRIMARY KEY,
+    NAME TEXT NOT NULL,
+    CHAT_ID BIGINT NOT NULL UNIQUE);
+
+CREATE TABLE IF NOT EXISTS COURSE_WORKS(
+    ID BIGSERIAL PRIMARY KEY,
+    STUDENT BIGINT NOT NULL REFERENCES STUDENTS(ID),
+    DESCRIPTION TEXT);
+
+CREATE TABLE IF NOT EXISTS SUBJECTS(
+    ID BIGSERIAL PRIMARY KEY,
+    SUBJECT TEXT NOT NULL UNIQUE,
+    COUNT INT);
+
+CREATE TABLE IF NOT EXISTS COURSE_WORKS_SUBJECTS(
+    COURSE_WORK BIGINT NOT NULL REFERENCES COURSE_WORKS(ID),
+    SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),
+    UNIQUE(COURSE_WORK, SUBJECT));
+
+CREATE TABLE IF NOT EXISTS ACCEPTED(
+    ID BIGSERIAL PRIMARY KEY,
+    STUDENT BIGINT NOT NULL UNIQUE REFERENCES STUDENTS(ID),
+    DESCRIPTION TEXT);
+
+CREATE TABLE IF NOT EXISTS ACCEPTED_SUBJECTS(
+    COURSE_WORK BIGINT NOT NULL REFERENCES ACCEPTED(ID),
+    SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),
+    UNIQUE(COURSE_WORK, SUBJECT));
+
+CREATE TABLE IF NOT EXISTS MENTORS(
+    ID BIGSERIAL PRIMARY KEY,
+    NAME TEXT NOT NULL,
+    CHAT_ID BIGINT NOT NULL UNIQUE,
+    LOAD INT);
+
+CREATE TABLE IF NOT EXISTS MENTORS_SUBJECTS(
+    MENTOR BIGINT NOT NULL REFERENCES MENTORS(ID),
+    SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),
+    UNIQUE(MENTOR, SUBJECT));
+
+CREATE TABLE IF NOT EXISTS MENTORS_STUDENTS(
+    MENTOR BIGINT NOT NULL REFERENCES MENTORS(ID),
+    STUDENT BIGINT NOT NULL REFERENCES STUDENTS(ID),
+    UNIQUE(MENTOR, STUDENT));
+
+CREATE TABLE IF NOT EXISTS IDEAS(
+    ID BIGSERIAL PRIMARY KEY,
+    MENTOR BIGINT NOT NULL REFERENCES MENTORS(ID),
+    DESCRIPTION TEXT);
+
+CREATE TABLE IF NOT EXISTS IDEAS_SUBJECTS(
+    IDEA BIGINT NOT NULL REFERENCES IDEAS(ID),
+    SUBJECT BIGINT NOT NULL REFERENCES SUBJECTS(ID),
+    UNIQUE(IDEA, SUBJECT));
+
+CREATE TABLE IF NOT EXISTS ADMINS(
+    ID BIGSERIAL PRIMARY KEY,
+    CHAT_ID BIGINT NOT NULL UNIQUE);
+
+CREATE TABLE IF NOT EXISTS SUPPORTS(
+    ID BIGSERIAL PRIMARY KEY,
+    CHAT_ID BIGINT NOT NULL UNIQUE,
+    NAME TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS SUPPORT_REQUESTS(
+    ID BIGSERIAL PRIMARY KEY,
+    CHAT_ID BIGINT NOT NULL UNIQUE,
+    NAME TEXT NOT NULL,
+    ISSUE TEXT,
+    SUPPORT BIGINT REFERENCES SUPPORTS(ID) DEFERRABLE INITIALLY DEFERRED);
+
+CREATE TABLE IF NOT EXISTS STATES(
+    CHAT_ID BIGINT NOT NULL,
+    USER_ID BIGINT NOT NULL,
+    STATE TEXT NOT NULL,
+    DATA JSONB NOT NULL DEFAULT '{}',
+    PRIMARY KEY(CHAT_ID, USER_ID));
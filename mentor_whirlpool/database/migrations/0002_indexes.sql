@@ -0,0 +1,10 @@
+-- lookups by the first column of link tables are covered by their UNIQUE
+-- constraints, these are the rest of the filtered columns
+CREATE INDEX IF NOT EXISTS COURSE_WORKS_STUDENT_IDX ON COURSE_WORKS(STUDENT);
+CREATE INDEX IF NOT EXISTS IDEAS_MENTOR_IDX ON IDEAS(MENTOR);
+CREATE INDEX IF NOT EXISTS COURSE_WORKS_SUBJECTS_SUBJECT_IDX ON COURSE_WORKS_SUBJECTS(SUBJECT);
+CREATE INDEX IF NOT EXISTS ACCEPTED_SUBJECTS_SUBJECT_IDX ON ACCEPTED_SUBJECTS(SUBJECT);
+CREATE INDEX IF NOT EXISTS IDEAS_SUBJECTS_SUBJECT_IDX ON IDEAS_SUBJECTS(SUBJECT);
+CREATE INDEX IF NOT EXISTS MENTORS_SUBJECTS_SUBJECT_IDX ON MENTORS_SUBJECTS(SUBJECT);
+CREATE INDEX IF NOT EXISTS MENTORS_STUDENTS_STUDENT_IDX ON MENTORS_STUDENTS(STUDENT);
+CREATE INDEX IF NOT EXISTS SUPPORT_REQUESTS_SUPPORT_IDX ON SUPPORT_REQUESTS(SUPPORT);
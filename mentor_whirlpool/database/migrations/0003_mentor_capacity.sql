@@ -0,0 +1,3 @@
+-- maximum amount of students the matching engine assigns to a mentor,
+-- MATCHING_DEFAULT_CAPACITY applies if NULL
+ALTER TABLE MENTORS ADD COLUMN IF NOT EXISTS CAPACITY INT;
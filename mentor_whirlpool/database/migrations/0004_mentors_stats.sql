@@ -0,0 +1,14 @@
+-- students of every mentor per subject of the mentor, shown to admins
+-- refreshed by MentorsTables.refresh_mentors_stats after changes
+CREATE MATERIALIZED VIEW IF NOT EXISTS MENTORS_STATS AS
+SELECT MSU.MENTOR, MSU.SUBJECT,
+       (SELECT COUNT(*) FROM MENTORS_STUDENTS MST
+        JOIN ACCEPTED A ON A.STUDENT = MST.STUDENT
+        WHERE MST.MENTOR = MSU.MENTOR AND EXISTS(
+            SELECT * FROM ACCEPTED_SUBJECTS ACS
+            WHERE ACS.COURSE_WORK = A.ID AND ACS.SUBJECT = MSU.SUBJECT)) AS STUDENTS
+FROM MENTORS_SUBJECTS MSU;
+
+-- needed by REFRESH MATERIALIZED VIEW CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS MENTORS_STATS_MENTOR_SUBJECT_IDX
+    ON MENTORS_STATS(MENTOR, SUBJECT);
@@ -0,0 +1,52 @@
+async def fetch_page(conn, query, conditions, params, column='ID',
+                     limit=None, after_id=None, before_id=None):
+    """
+    Runs a query on a page of lines ordered by a unique column
+
+    Pages are found by comparing the column with the edge of the previous
+    page (keyset pagination), so that the database seeks them by the index
+    instead of skipping lines as OFFSET does
+
+    Parameters
+    ----------
+    conn : psycopg.AsyncConnection
+    query : str
+        SELECT ... FROM ... without WHERE clause
+    conditions : list(str)
+        Conditions to AND into WHERE clause
+    params : list
+        Positional parameters of conditions
+    column : str
+        Unique column to order lines by
+    limit : int or None
+        Maximum amount of lines, all lines if None
+    after_id : int or None
+        Only lines with column greater than this
+    before_id : int or None
+        Only lines with column less than this. If after_id is None, the last
+        limit lines before it are returned
+
+    Returns
+    -------
+    list(tuple)
+        Lines ordered by column ascending
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after_id is not None:
+        conditions.append(f'{column} > %s')
+        params.append(after_id)
+    if before_id is not None:
+        conditions.append(f'{column} < %s')
+        params.append(before_id)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    backwards = before_id is not None and after_id is None
+    query += f' ORDER BY {column}' + (' DESC' if backwards else '')
+    if limit is not None:
+        query += ' LIMIT %s'
+        params.append(limit)
+    lines = await (await conn.execute(query, params)).fetchall()
+    if backwards:
+        lines.reverse()
+    return lines
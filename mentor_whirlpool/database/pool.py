@@ -0,0 +1,304 @@
+from psycopg import AsyncCursor
+from psycopg_pool import AsyncConnectionPool
+from mentor_whirlpool.metrics import metrics
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from functools import wraps
+from os import environ as env
+from time import perf_counter
+from uuid import uuid4
+
+_pool = None
+# tells notifications of this process from those of others
+PROCESS_TOKEN = uuid4().hex
+# read-only DSN -> pool of connections to that replica
+_read_pools = {}
+# connection checked out by the current task, shared with every task it spawns
+_connection = ContextVar('connection', default=None)
+# True within a transaction block, where Database methods don't commit
+_in_transaction = ContextVar('in_transaction', default=False)
+# callbacks the transaction block runs once it commits
+_after_commit = ContextVar('after_commit', default=None)
+
+
+class InstrumentedCursor(AsyncCursor):
+    """
+    Cursor of pooled connections, which reports every query to metrics
+    """
+    async def execute(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await super().execute(*args, **kwargs)
+        finally:
+            metrics.record_query(perf_counter() - start)
+
+    async def executemany(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return await super().executemany(*args, **kwargs)
+        finally:
+            metrics.record_query(perf_counter() - start)
+
+
+def conninfo():
+    return ('dbname=mentor_whirlpool '
+            f'user={env["POSTGRE_USER"]} '
+            f'host={env["POSTGRE_ADDRESS"]} '
+            f'port={env["POSTGRE_PORT"]} '
+            f'password={env["POSTGRE_PASSWD"]}')
+
+
+async def open_pool(min_size=None, max_size=None, max_idle=None):
+    """
+    Opens the process-wide connection pool. Should be called once on startup,
+    subsequent calls return the already opened pool
+
+    Parameters
+    ----------
+    min_size : int or None
+        Connections kept open at all times, POSTGRE_POOL_MIN_SIZE or 2
+    max_size : int or None
+        Upper bound of simultaneously open connections,
+        POSTGRE_POOL_MAX_SIZE or 10
+    max_idle : float or None
+        Seconds an unused connection above min_size is kept around,
+        POSTGRE_POOL_MAX_IDLE or 300
+
+    Returns
+    -------
+    psycopg_pool.AsyncConnectionPool
+    """
+    global _pool
+    if _pool is not None:
+        return _pool
+    if min_size is None:
+        min_size = int(env.get('POSTGRE_POOL_MIN_SIZE', 2))
+    if max_size is None:
+        max_size = int(env.get('POSTGRE_POOL_MAX_SIZE', 10))
+    if max_idle is None:
+        max_idle = float(env.get('POSTGRE_POOL_MAX_IDLE', 300))
+    # assigned before opening, so that concurrent callers won't create
+    # a second pool while this one is connecting
+    _pool = AsyncConnectionPool(conninfo(), min_size=min_size,
+                                max_size=max_size, max_idle=max_idle,
+                                check=AsyncConnectionPool.check_connection,
+                                kwargs={'cursor_factory': InstrumentedCursor},
+                                open=False)
+    await _pool.open(wait=True)
+    return _pool
+
+
+def read_conninfo():
+    """
+    Returns
+    -------
+    str or None
+        POSTGRE_REPLICA_DSN, DSN of a read-only replica, None if not set
+    """
+    return env.get('POSTGRE_REPLICA_DSN') or None
+
+
+async def open_read_pool(dsn):
+    """
+    Opens the process-wide pool of connections to a read-only replica,
+    subsequent calls with the same DSN return the already opened pool.
+    Sized like the primary one, with POSTGRE_REPLICA_POOL_MIN_SIZE and
+    POSTGRE_REPLICA_POOL_MAX_SIZE
+
+    Parameters
+    ----------
+    dsn : str
+
+    Returns
+    -------
+    psycopg_pool.AsyncConnectionPool
+    """
+    pool = _read_pools.get(dsn)
+    if pool is not None:
+        return pool
+    min_size = int(env.get('POSTGRE_REPLICA_POOL_MIN_SIZE',
+                           env.get('POSTGRE_POOL_MIN_SIZE', 2)))
+    max_size = int(env.get('POSTGRE_REPLICA_POOL_MAX_SIZE',
+                           env.get('POSTGRE_POOL_MAX_SIZE', 10)))
+    max_idle = float(env.get('POSTGRE_POOL_MAX_IDLE', 300))
+    pool = _read_pools[dsn] = AsyncConnectionPool(
+        dsn, min_size=min_size, max_size=max_size, max_idle=max_idle,
+        check=AsyncConnectionPool.check_connection,
+        kwargs={'cursor_factory': InstrumentedCursor}, open=False)
+    await pool.open(wait=True)
+    return pool
+
+
+def read_pool(dsn):
+    """
+    Returns
+    -------
+    psycopg_pool.AsyncConnectionPool or None
+        Pool of the replica with the DSN, None if it wasn't opened
+    """
+    return _read_pools.get(dsn)
+
+
+async def close_pool():
+    """
+    Closes the process-wide connection pool and replica pools, if they are
+    open
+    """
+    global _pool
+    pools = list(_read_pools.values())
+    _read_pools.clear()
+    if _pool is not None:
+        pools.append(_pool)
+        _pool = None
+    for pool in pools:
+        await pool.close()
+
+
+def current_connection():
+    """
+    Returns
+    -------
+    psycopg.AsyncConnection or None
+        Connection held by the current task, None if there is none
+    """
+    return _connection.get()
+
+
+@asynccontextmanager
+async def connection():
+    """
+    Yields the connection held by the current task or checks out a new one
+    from the pool, returning it on exit. The pool commits the transaction
+    left open on a returned connection, or rolls it back on an exception
+    """
+    conn = _connection.get()
+    if conn is not None:
+        yield conn
+        return
+    async with (await open_pool()).connection() as conn:
+        token = _connection.set(conn)
+        try:
+            yield conn
+        finally:
+            _connection.reset(token)
+
+
+@asynccontextmanager
+async def read_connection(dsn):
+    """
+    Checks out a connection to the read-only replica with the DSN for the
+    current task, returning it on exit. Methods called within the block
+    join it like they join a primary connection
+    """
+    async with (await open_read_pool(dsn)).connection() as conn:
+        token = _connection.set(conn)
+        try:
+            yield conn
+        finally:
+            _connection.reset(token)
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Unit of work. Database methods called within the block run on one
+    connection and skip their commits, the block commits once on exit or
+    rolls back if it raises. Nested blocks join the outermost one. Callbacks
+    registered with after_commit run after the commit, or never if the block
+    rolls back
+
+    Yields
+    ------
+    psycopg.AsyncConnection
+    """
+    if _in_transaction.get():
+        yield _connection.get()
+        return
+    callbacks = []
+    async with connection() as conn:
+        token = _in_transaction.set(True)
+        callbacks_token = _after_commit.set(callbacks)
+        try:
+            yield conn
+        except BaseException:
+            await conn.rollback()
+            raise
+        else:
+            await conn.commit()
+        finally:
+            _after_commit.reset(callbacks_token)
+            _in_transaction.reset(token)
+    for (callback, args) in callbacks:
+        callback(*args)
+
+
+async def commit():
+    """
+    Commits the connection of the current task, unless it's within
+    a transaction block, which commits on its own
+    """
+    if not _in_transaction.get():
+        await _connection.get().commit()
+
+
+def after_commit(callback, *args):
+    """
+    Calls callback(*args) once changes of the current task are committed,
+    e.g. to update in-memory caches. Outside of a transaction block it is
+    called right away, so call it after commit. Within one it is called after
+    the block commits, and dropped if the block rolls back
+    """
+    if _in_transaction.get():
+        _after_commit.get().append((callback, args))
+    else:
+        callback(*args)
+
+
+def with_connection(method):
+    """
+    Runs a Database method on a pooled connection, available as self.db
+
+    Methods called from another method (directly or through gather) join the
+    connection of the caller instead of checking out their own
+    """
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        async with connection():
+            return await method(self, *args, **kwargs)
+    return wrapper
+
+
+def read_only(method):
+    """
+    Runs a pure getter of Database like with_connection, but on a replica
+    if the Database has a read_dsn and hasn't written anything yet. Reads
+    which follow a write of the same Database go to the primary, so that
+    a handler sees its own changes despite replication lag. Called from
+    another method, or within a transaction block, it joins the connection
+    of the caller
+
+    The getter and every method it calls must not write, replicas are
+    read-only
+    """
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if (_connection.get() is None and self.read_dsn is not None
+                and not self.wrote):
+            async with read_connection(self.read_dsn):
+                return await method(self, *args, **kwargs)
+        async with connection():
+            return await method(self, *args, **kwargs)
+    return wrapper
+
+
+async def detached(method, *args, **kwargs):
+    """
+    Awaits method(*args, **kwargs) without the connection of the current task
+
+    Tasks inherit the connection of the task which created them, so a task
+    created within a Database method has to be started with detached, or it
+    would keep using the connection after it is returned to the pool
+    """
+    _connection.set(None)
+    _in_transaction.set(False)
+    return await method(*args, **kwargs)
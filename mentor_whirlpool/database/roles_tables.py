@@ -0,0 +1,68 @@
+from mentor_whirlpool.database.pool import with_connection
+from os import environ as env
+from time import monotonic
+
+
+class RolesTables:
+    # chat_id -> (expiration time, roles), shared by the whole process
+    _roles = {}
+    # bumped on every invalidation, so that a lookup which raced with it
+    # won't put stale roles back into the cache
+    _roles_generation = 0
+    roles_ttl = float(env.get('ROLES_CACHE_TTL', 60))
+
+    async def get_roles(self, chat_id):
+        """
+        Gets all roles of a user at once
+
+        Roles are cached for ROLES_CACHE_TTL seconds (60 by default). Adding
+        or removing mentors, admins and supports invalidates the cache
+
+        Parameters
+        ----------
+        chat_id : int
+            a chat id to check
+
+        Returns
+        -------
+        dict
+            A dictionary with keys: 'mentor' : bool, 'admin' : bool,
+            'support' : bool
+        """
+        chat_id = int(chat_id)
+        cached = RolesTables._roles.get(chat_id)
+        if cached is not None and cached[0] > monotonic():
+            return dict(cached[1])
+        generation = RolesTables._roles_generation
+        roles = await self._fetch_roles(chat_id)
+        if generation == RolesTables._roles_generation:
+            if len(RolesTables._roles) > 10000:
+                now = monotonic()
+                RolesTables._roles = {key: val for (key, val) in RolesTables._roles.items()
+                                      if val[0] > now}
+            RolesTables._roles[chat_id] = (monotonic() + self.roles_ttl, roles)
+        return dict(roles)
+
+    @with_connection
+    async def _fetch_roles(self, chat_id):
+        (mentor, admin, support) = await (await self.db.execute(
+            'SELECT EXISTS(SELECT * FROM MENTORS WHERE CHAT_ID = %(chat_id)s), '
+            'EXISTS(SELECT * FROM ADMINS WHERE CHAT_ID = %(chat_id)s), '
+            'EXISTS(SELECT * FROM SUPPORTS WHERE CHAT_ID = %(chat_id)s)',
+            {'chat_id': chat_id})).fetchone()
+        return {'mentor': mentor, 'admin': admin, 'support': support}
+
+    def invalidate_roles(self, chat_id=None):
+        """
+        Drops cached roles
+
+        Parameters
+        ----------
+        chat_id : int or None
+            chat id to drop roles of, drops all roles if None
+        """
+        RolesTables._roles_generation += 1
+        if chat_id is None:
+            RolesTables._roles = {}
+        else:
+            RolesTables._roles.pop(int(chat_id), None)
@@ -0,0 +1,80 @@
+from pathlib import Path
+import logging
+import re
+
+MIGRATIONS_DIR = Path(__file__).parent / 'migrations'
+# arbitrary key of the advisory lock held while migrating
+MIGRATION_LOCK = 0x6d656e746f72
+
+
+def migrations():
+    """
+    Lists migrations shipped with the package
+
+    Migrations are files in database/migrations named NNNN_description.sql,
+    applied in the order of their numbers. Applied migrations must never be
+    edited, changes to the schema go into a new file
+
+    Returns
+    -------
+    list(tuple(int, str, pathlib.Path))
+        Version, name and path of every migration, sorted by version
+    """
+    found = []
+    for path in MIGRATIONS_DIR.glob('*.sql'):
+        match = re.fullmatch(r'(\d+)_(.+)\.sql', path.name)
+        if match is None:
+            raise ValueError(f'Malformed migration name {path.name}')
+        found.append((int(match[1]), match[2], path))
+    found.sort()
+    return found
+
+
+async def schema_version(conn):
+    """
+    Returns
+    -------
+    int
+        Version of the last applied migration, 0 if there are none
+    """
+    (exists,) = await (await conn.execute("SELECT to_regclass('SCHEMA_VERSION') "
+                                          'IS NOT NULL')).fetchone()
+    if not exists:
+        return 0
+    (version,) = await (await conn.execute('SELECT COALESCE(MAX(VERSION), 0) '
+                                           'FROM SCHEMA_VERSION')).fetchone()
+    return version
+
+
+async def migrate(conn):
+    """
+    Applies migrations newer than the current schema version
+
+    Does not take any locks if the schema is current. Otherwise migrates
+    under an advisory lock in a single transaction, so that processes started
+    at the same time apply every migration exactly once
+
+    Parameters
+    ----------
+    conn : psycopg.AsyncConnection
+        Connection to migrate with, the transaction is committed
+    """
+    pending = migrations()
+    if await schema_version(conn) >= pending[-1][0]:
+        await conn.commit()
+        return
+    await conn.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK,))
+    await conn.execute('CREATE TABLE IF NOT EXISTS SCHEMA_VERSION('
+                       'VERSION INT PRIMARY KEY,'
+                       'NAME TEXT NOT NULL,'
+                       'APPLIED TIMESTAMPTZ NOT NULL DEFAULT NOW())')
+    # another process might have migrated while we were waiting for the lock
+    current = await schema_version(conn)
+    for (version, name, path) in pending:
+        if version <= current:
+            continue
+        logging.info(f'SCHEMA: applying migration {version} {name}')
+        await conn.execute(path.read_text())
+        await conn.execute('INSERT INTO SCHEMA_VERSION VALUES(%s, %s)',
+                           (version, name))
+    await conn.commit()
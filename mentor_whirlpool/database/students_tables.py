@@ -1,5 +1,10 @@
-import psycopg
-from asyncio import gather
+from mentor_whirlpool.database.pool import with_connection, read_only, after_commit
+from mentor_whirlpool.database.paging import fetch_page
+from mentor_whirlpool.database.mentors_tables import STUDENT_WORKS_JSON
+
+
+STUDENTS_QUERY = ('SELECT ST.ID, ST.NAME, ST.CHAT_ID, '
+                  f'{STUDENT_WORKS_JSON} FROM STUDENTS ST')
 
 
 class StudentTables():
@@ -12,16 +17,19 @@ class StudentTables():
                 'id': i[0],
                 'name': i[1],
                 'chat_id': i[2],
-                'course_works': (await self.get_course_works(student=i[0]) +
-                                 await self.get_accepted(student=i[0])),
+                'course_works': i[3],
             }
             list.append(line)
         return list
 
-    async def get_students(self, id_field=None, chat_id=None, mentor_id=None):
+    @read_only
+    async def get_students(self, id_field=None, chat_id=None, mentor_id=None,
+                           limit=None, after_id=None, before_id=None):
         """
         If any arguments are supplied, they are used as a key to find
         a specific student. Otherwise, fetches all students from the database
+        Course works of the students are aggregated by the database, so this
+        takes a single query
 
         Parameters
         ----------
@@ -31,36 +39,38 @@ class StudentTables():
             Telegram chat ID of specified student
         mentor_id : int
             Database ID of a mentor from which to get the students
+        limit : int or None
+            Maximum amount of lines to return, all if None
+        after_id : int or None
+            Return lines with database id greater than this, next page
+        before_id : int or None
+            Return lines with database id less than this, previous page
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        values = []
+        conditions = []
+        params = []
         if id_field is not None:
-            values = await self.db.execute('SELECT * FROM STUDENTS '
-                                           'WHERE ID = %s', (id_field,))
-            return await self.assemble_students_dict(await values.fetchall())
+            conditions.append('ST.ID = %s')
+            params.append(id_field)
         if chat_id is not None:
-            values = await self.db.execute('SELECT * FROM STUDENTS '
-                                           'WHERE CHAT_ID = %s', (chat_id,))
-            return await self.assemble_students_dict(await values.fetchall())
+            conditions.append('ST.CHAT_ID = %s')
+            params.append(chat_id)
         if mentor_id is not None:
-            ids = await (await self.db.execute('SELECT STUDENT FROM MENTORS_STUDENTS WHERE '
-                                               'MENTOR = %s', (mentor_id,))).fetchall()
-            if ids is None:
-                return []
-            cursors = await gather(*[self.db.execute('SELECT * FROM STUDENTS '
-                                                     'WHERE ID = %s', (id_f,))
-                                     for (id_f,) in ids])
-            return await self.assemble_students_dict(await gather(*[curs.fetchone()
-                                                                    for curs in cursors]))
-        return await self.assemble_students_dict(
-            await (await self.db.execute('SELECT * FROM STUDENTS')).fetchall()
-        )
+            conditions.append('ST.ID IN (SELECT STUDENT FROM MENTORS_STUDENTS '
+                              'WHERE MENTOR = %s)')
+            params.append(mentor_id)
+        students = await fetch_page(self.db, STUDENTS_QUERY, conditions, params,
+                                    column='ST.ID', limit=limit,
+                                    after_id=after_id, before_id=before_id)
+        return await self.assemble_students_dict(students)
 
+    @with_connection
     async def remove_student(self, id_field):
         """
-        Removes a line from COURSE_WORKS table
-        Removing a course work decrements COUNT column in SUBJECTS table
+        Removes a line from STUDENTS table along with all course works of the
+        student, accepted ones included, and links to mentors. LOAD of the
+        mentors is decremented
+
+        Runs in a single transaction with a fixed number of statements
 
         Parameters
         ----------
@@ -71,25 +81,17 @@ class StudentTables():
         ------
         DBAccessError whatever
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        course_works = await (await self.db.execute('SELECT ID FROM COURSE_WORKS '
-                                                    'WHERE STUDENT = %s', (id_field,))).fetchall()
-        accepted = await (await self.db.execute('SELECT ID FROM ACCEPTED '
-                                                'WHERE STUDENT = %s', (id_field,))).fetchall()
-        await gather(self.db.execute('DELETE FROM MENTORS_STUDENTS '
-                                     'WHERE STUDENT = %s', (id_field,)),
-                     *[self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
-                                       'WHERE COURSE_WORK = %s', (cw_id,))
-                       for (cw_id,) in course_works],
-                     *[self.db.execute('DELETE FROM ACCEPTED_SUBJECTS '
-                                       'WHERE COURSE_WORK = %s', (cw_id,))
-                       for (cw_id,) in accepted])
-        await gather(self.db.execute('DELETE FROM COURSE_WORKS '
-                                     'WHERE STUDENT = %s', (id_field,)),
-                     self.db.execute('DELETE FROM ACCEPTED '
-                                     'WHERE STUDENT = %s', (id_field,)),
-                     self.db.execute('DELETE FROM STUDENTS '
-                                     'WHERE ID = %s', (id_field,)))
-        await self.db.commit()
-
+        await self.db.execute('WITH GONE AS ('
+                              'DELETE FROM MENTORS_STUDENTS WHERE STUDENT = %s '
+                              'RETURNING MENTOR) '
+                              'UPDATE MENTORS SET LOAD = LOAD - 1 '
+                              'WHERE ID IN (SELECT MENTOR FROM GONE)', (id_field,))
+        await self._drop_student_course_works(id_field)
+        await self.db.execute('DELETE FROM ACCEPTED_SUBJECTS AS ACS '
+                              'USING ACCEPTED A '
+                              'WHERE ACS.COURSE_WORK = A.ID AND A.STUDENT = %s',
+                              (id_field,))
+        await self.db.execute('DELETE FROM ACCEPTED WHERE STUDENT = %s', (id_field,))
+        await self.db.execute('DELETE FROM STUDENTS WHERE ID = %s', (id_field,))
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
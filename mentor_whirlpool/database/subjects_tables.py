@@ -1,7 +1,17 @@
 import psycopg
-from asyncio import gather
+from mentor_whirlpool.database.pool import (with_connection, conninfo, after_commit,
+                                            PROCESS_TOKEN)
+from asyncio import sleep
+import logging
+
 
 class SubjectsTables:
+    # process-wide subject catalog, loaded on first use. None means it has to
+    # be (re)loaded from the database
+    _subjects_by_id = None
+    _subjects_by_name = None
+
+    @with_connection
     async def add_subject(self, subject):
         """
         Inserts a string into SUBJECTS table
@@ -21,17 +31,18 @@ class SubjectsTables:
         int
             Database ID of inserted subject
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('INSERT INTO SUBJECTS VALUES(DEFAULT, %s, 1) '
                               'ON CONFLICT (SUBJECT) DO '
                               'UPDATE SET COUNT = EXCLUDED.COUNT + 1 ',
                               (subject,))
         (id_f,) = await (await self.db.execute('SELECT ID FROM SUBJECTS '
                                                'WHERE SUBJECT = %s', (subject,))).fetchone()
-        await self.db.commit()
+        await self.db.execute("SELECT pg_notify('subjects', %s)", (PROCESS_TOKEN,))
+        await self.commit()
+        after_commit(self._cache_subject, id_f, subject)
         return id_f
 
+    @with_connection
     async def remove_subject(self, subj_id):
         """
         Removes a line from SUBJECTS table and wherever it is situated
@@ -46,22 +57,29 @@ class SubjectsTables:
         DBAccessError whatever
         DBDoesNotExist
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        await gather(self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
-                                     'WHERE SUBJECT = %s', (subj_id,)),
-                     self.db.execute('DELETE FROM ACCEPTED_SUBJECTS '
-                                     'WHERE SUBJECT = %s', (subj_id,)),
-                     self.db.execute('DELETE FROM MENTORS_SUBJECTS '
-                                     'WHERE SUBJECT = %s', (subj_id,)),
-                     self.db.execute('DELETE FROM SUBJECTS '
-                                     'WHERE ID = %s', (subj_id,)))
-        await self.db.commit()
+        async with self.pipeline():
+            await self.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS '
+                                  'WHERE SUBJECT = %s', (subj_id,))
+            await self.db.execute('DELETE FROM ACCEPTED_SUBJECTS '
+                                  'WHERE SUBJECT = %s', (subj_id,))
+            await self.db.execute('DELETE FROM MENTORS_SUBJECTS '
+                                  'WHERE SUBJECT = %s', (subj_id,))
+            await self.db.execute('DELETE FROM SUBJECTS '
+                                  'WHERE ID = %s', (subj_id,))
+            await self.db.execute("SELECT pg_notify('subjects', %s)", (PROCESS_TOKEN,))
+        await self.commit()
+        after_commit(self.schedule_stats_refresh)
+        after_commit(self._uncache_subject, int(subj_id))
 
-    async def get_subjects(self, id_field=None, work_id=None, mentor_id=None):
+    async def get_subjects(self, id_field=None, work_id=None, mentor_id=None,
+                           name=None):
         """
         Gets all lines from SUBJECTS table
 
+        Whole catalog, id_field and name lookups are served from an in-memory
+        copy of SUBJECTS table, which is loaded once and kept up to date by
+        add_subject, remove_subject and listen_subjects
+
         Parameters
         ---------
         id_field : int or None
@@ -70,51 +88,189 @@ class SubjectsTables:
             Database ID of course work to get subjects from
         mentor_id : int or None
             Database ID of mentor to get subjects from
+        name : str or None
+            Name of subject
 
         Returns
         ------
         iterable
             Iterable over all subjects (str's)
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        if id_field is not None:
-            subject = await (await self.db.execute('SELECT * FROM SUBJECTS '
-                                                   'WHERE ID = %s', (id_field,))).fetchone()
-            return [{'id': subject[0], 'subject': subject[1]}]
         if work_id is not None:
-            # this code right here may look horrible and ugly and unreadable
-            # and that may be true, but doing it this way, according to the
-            # testsm is cutting overall time in this function threefold,
-            # leaving most of the time spent asynchronously waiting for
-            # database to respond. this branch can only be improved with
-            # less lists comprehension, but even then that's debatable
-            ids = await (await self.db.execute('SELECT SUBJECT FROM COURSE_WORKS_SUBJECTS '
-                                               'WHERE COURSE_WORK = %s',
-                                               (work_id,))).fetchall()
-            subj_cur = await gather(*[self.db.execute('SELECT * FROM SUBJECTS '
-                                                      'WHERE ID = %s', (id_f,))
-                                      for (id_f,) in ids])
-            subjects = await gather(*[subj.fetchone()
-                                      for subj in subj_cur])
-            ids = await (await self.db.execute('SELECT SUBJECT FROM ACCEPTED_SUBJECTS '
-                                               'WHERE COURSE_WORK = %s', (work_id,))).fetchall()
-            subj_cur = await gather(*[self.db.execute('SELECT * FROM SUBJECTS '
-                                                      'WHERE ID = %s', (id_f,))
-                                      for (id_f,) in ids])
-            subjects += await gather(*[subj.fetchone()
-                                      for subj in subj_cur])
-            return [{'id': subj[0], 'subject': subj[1]} for subj in subjects]
+            return (await self.get_subjects_for_works([work_id]))[int(work_id)]
         if mentor_id is not None:
-            ids = [cur for (cur,) in
-                   await (await self.db.execute('SELECT SUBJECT FROM MENTORS_SUBJECTS '
-                                                'WHERE MENTOR = %s',
-                                                (mentor_id,))).fetchall()]
-            ids = set(ids)
-            subjects = [(await (await self.db.execute('SELECT * FROM SUBJECTS '
-                                                      'WHERE ID = %s', (id_f,))).fetchone())
-                        for id_f in ids]
-            return [{'id': subj[0], 'subject': subj[1]} for subj in subjects]
-
-        cur = await (await self.db.execute('SELECT * FROM SUBJECTS')).fetchall()
-        return [{'id': subj[0], 'subject': subj[1]} for subj in cur]
+            return await self.get_mentor_subjects(mentor_id)
+        subjects = await self.load_subjects()
+        if id_field is not None:
+            id_field = int(id_field)
+            if id_field not in subjects:
+                # might have been added by another process
+                subjects = await self.load_subjects(reload=True)
+            if id_field not in subjects:
+                return []
+            return [{'id': id_field, 'subject': subjects[id_field]}]
+        if name is not None:
+            names = await self.load_subjects(by_name=True)
+            if name not in names:
+                names = await self.load_subjects(reload=True, by_name=True)
+            if name not in names:
+                return []
+            return [{'id': names[name], 'subject': name}]
+        return [{'id': id_f, 'subject': subj} for (id_f, subj) in subjects.items()]
+
+    @with_connection
+    async def get_mentor_subjects(self, mentor_id):
+        """
+        Gets subjects of a mentor
+
+        Parameters
+        ----------
+        mentor_id : int
+            Database ID of mentor to get subjects from
+
+        Returns
+        -------
+        list(dict)
+            A list of dictionaries with keys: 'id' : int, 'subject' : str
+        """
+        subjects = await (await self.db.execute('SELECT S.ID, S.SUBJECT '
+                                                'FROM MENTORS_SUBJECTS MS '
+                                                'JOIN SUBJECTS S ON S.ID = MS.SUBJECT '
+                                                'WHERE MS.MENTOR = %s',
+                                                (mentor_id,))).fetchall()
+        return [{'id': subj[0], 'subject': subj[1]} for subj in subjects]
+
+    async def load_subjects(self, reload=False, by_name=False):
+        """
+        Loads subject catalog if it has not been loaded yet
+
+        Parameters
+        ----------
+        reload : bool
+            Load the catalog even if it is already in memory
+        by_name : bool
+            Return the mapping of names to IDs instead
+
+        Returns
+        -------
+        dict
+            Maps subject IDs to their names, or names to IDs if by_name. Use
+            it instead of the class attributes, the listener may drop them
+            whenever the method awaits
+        """
+        by_id = SubjectsTables._subjects_by_id
+        names = SubjectsTables._subjects_by_name
+        if reload or by_id is None:
+            (by_id, names) = await self._fetch_subjects()
+        return names if by_name else by_id
+
+    @with_connection
+    async def _fetch_subjects(self):
+        cur = await (await self.db.execute('SELECT ID, SUBJECT FROM SUBJECTS '
+                                           'ORDER BY ID')).fetchall()
+        by_id = dict(cur)
+        names = {subj: id_f for (id_f, subj) in cur}
+        SubjectsTables._subjects_by_id = by_id
+        SubjectsTables._subjects_by_name = names
+        return (by_id, names)
+
+    def _cache_subject(self, id_f, subject):
+        if SubjectsTables._subjects_by_id is not None:
+            SubjectsTables._subjects_by_id[id_f] = subject
+            SubjectsTables._subjects_by_name[subject] = id_f
+
+    def _uncache_subject(self, id_f):
+        if SubjectsTables._subjects_by_id is not None:
+            subject = SubjectsTables._subjects_by_id.pop(id_f, None)
+            SubjectsTables._subjects_by_name.pop(subject, None)
+
+    def invalidate_subjects(self):
+        """
+        Drops in-memory subject catalog, so that it is loaded again on next use
+        """
+        SubjectsTables._subjects_by_id = None
+        SubjectsTables._subjects_by_name = None
+
+    async def listen_subjects(self, retry_interval=5):
+        """
+        Invalidates subject catalog whenever another process changes SUBJECTS
+        table. Runs forever on a dedicated connection, reconnecting on errors
+
+        Parameters
+        ----------
+        retry_interval : float
+            Seconds to wait before reconnecting
+        """
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo(),
+                                                                 autocommit=True) as conn:
+                    await conn.execute('LISTEN SUBJECTS')
+                    # changes made while we were not listening
+                    self.invalidate_subjects()
+                    async for notify in conn.notifies():
+                        # this process has updated its catalog already
+                        if notify.payload == PROCESS_TOKEN:
+                            continue
+                        self.invalidate_subjects()
+            except psycopg.OperationalError as exc:
+                logging.warning(f'SUBJECTS listener disconnected: {exc}')
+                self.invalidate_subjects()
+                await sleep(retry_interval)
+
+    @with_connection
+    async def get_subjects_for_works(self, work_ids):
+        """
+        Gets subjects of many course works in a single query
+
+        Parameters
+        ----------
+        work_ids : iterable(int)
+            Database IDs of course works, either pending or accepted
+
+        Returns
+        -------
+        dict
+            Maps every ID from work_ids to the list get_subjects(work_id=...)
+            would return for it
+        """
+        return await self._get_subjects_by_link(
+            'SELECT WS.COURSE_WORK, S.ID, S.SUBJECT '
+            'FROM (SELECT COURSE_WORK, SUBJECT, 0 AS SRC '
+            'FROM COURSE_WORKS_SUBJECTS WHERE COURSE_WORK = ANY(%(ids)s) '
+            'UNION ALL '
+            'SELECT COURSE_WORK, SUBJECT, 1 '
+            'FROM ACCEPTED_SUBJECTS WHERE COURSE_WORK = ANY(%(ids)s)) WS '
+            'JOIN SUBJECTS S ON S.ID = WS.SUBJECT '
+            'ORDER BY WS.SRC', work_ids)
+
+    @with_connection
+    async def get_subjects_for_ideas(self, idea_ids):
+        """
+        Gets subjects of many ideas in a single query
+
+        Parameters
+        ----------
+        idea_ids : iterable(int)
+            Database IDs of ideas
+
+        Returns
+        -------
+        dict
+            Maps every ID from idea_ids to a list of its subjects
+        """
+        return await self._get_subjects_by_link(
+            'SELECT I.IDEA, S.ID, S.SUBJECT '
+            'FROM IDEAS_SUBJECTS I '
+            'JOIN SUBJECTS S ON S.ID = I.SUBJECT '
+            'WHERE I.IDEA = ANY(%(ids)s)', idea_ids)
+
+    async def _get_subjects_by_link(self, query, ids):
+        ids = [int(id_f) for id_f in ids]
+        subjects = {id_f: [] for id_f in ids}
+        if not ids:
+            return subjects
+        cur = await (await self.db.execute(query, {'ids': ids})).fetchall()
+        for (id_f, subj_id, subj) in cur:
+            subjects[id_f].append({'id': subj_id, 'subject': subj})
+        return subjects
@@ -1,7 +1,8 @@
-import psycopg
+from mentor_whirlpool.database.pool import with_connection, after_commit
 
 
 class SupportsTables:
+    @with_connection
     async def add_support(self, line):
         """
         Adds a support to the database
@@ -16,13 +17,13 @@ class SupportsTables:
         DBAccessError whatever
         DBAlreadyExists
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('INSERT INTO SUPPORTS VALUES('
                               'DEFAULT, %(chat_id)s, %(name)s)'
                               'ON CONFLICT DO NOTHING', line)
-        await self.db.commit()
+        await self.commit()
+        after_commit(self.invalidate_roles, line['chat_id'])
 
+    @with_connection
     async def remove_support(self, id_field=None, chat_id=None):
         """
         Removes a support from the database
@@ -34,15 +35,14 @@ class SupportsTables:
         chat_id : (optional) int
             Chat ID of the support
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         if id_field is not None:
             await self.db.execute('DELETE FROM SUPPORTS '
                                   'WHERE ID = %s', (id_field,))
         if chat_id is not None:
             await self.db.execute('DELETE FROM SUPPORTS '
                                   'WHERE CHAT_ID = %s', (chat_id,))
-        await self.db.commit()
+        await self.commit()
+        after_commit(self.invalidate_roles, chat_id)
 
     async def assemble_supports_dict(self, res):
         list = []
@@ -57,6 +57,7 @@ class SupportsTables:
             list.append(line)
         return list
 
+    @with_connection
     async def get_supports(self, id_field=None, chat_id=None):
         """
         If any arguments are supplied, they are used as a key to find
@@ -75,8 +76,6 @@ class SupportsTables:
             A list of dictionaries with keys: 'id' : int, 'chat_id' : int,
             'name' : str
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         res = None
         if id_field is not None:
             res = [await (await self.db.execute('SELECT * FROM SUPPORTS '
@@ -90,6 +89,7 @@ class SupportsTables:
             res = await (await self.db.execute('SELECT * FROM SUPPORTS')).fetchall()
         return await self.assemble_supports_dict(res)
 
+    @with_connection
     async def add_support_request(self, line):
         """
         Adds a support request to the database
@@ -100,14 +100,13 @@ class SupportsTables:
             Dictionary with keys: 'chat_id' : int, 'name' : str and
             'issue' : str or None
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('INSERT INTO SUPPORT_REQUESTS VALUES('
                               'DEFAULT, %(chat_id)s, %(name)s, %(issue)s, NULL)'
                               'ON CONFLICT DO NOTHING',
                               line)
-        await self.db.commit()
+        await self.commit()
 
+    @with_connection
     async def remove_support_request(self, id_field=None):
         """
         Removes a support request from the database
@@ -117,11 +116,9 @@ class SupportsTables:
         id_field : int
             Database id of the support request
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         await self.db.execute('DELETE FROM SUPPORT_REQUESTS '
                               'WHERE ID = %s', (id_field,))
-        await self.db.commit()
+        await self.commit()
 
     async def assemble_support_requests_dict(self, cursor):
         list = []
@@ -141,6 +138,7 @@ class SupportsTables:
             list.append(line)
         return list
 
+    @with_connection
     async def get_support_requests(self, id_field=None, chat_id=None):
         """
         If any arguments are supplied, they are used as a key to find
@@ -160,8 +158,6 @@ class SupportsTables:
             A list of dictionaries with keys: 'id' : int, 'chat_id' : int,
             'name' : str, 'issue' : str or None, 'support' : dict
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
         res = None
         if id_field is not None:
             res = [await (await self.db.execute('SELECT * FROM SUPPORT_REQUESTS '
@@ -189,9 +185,4 @@ class SupportsTables:
         boolean
             True if exists, false otherwise
         """
-        if self.db is None:
-            self.db = await psycopg.AsyncConnection.connect(self.conn_opts)
-        return (await (await self.db.execute('SELECT EXISTS('
-                                             'SELECT * FROM SUPPORTS '
-                                             'WHERE CHAT_ID = %s)',
-                                             (chat_id,))).fetchone())[0]
+        return (await self.get_roles(chat_id))['support']
@@ -0,0 +1,137 @@
+from collections import deque
+from asyncio import Queue, QueueFull, Event, create_task, gather
+from os import environ as env
+import logging
+
+
+def chat_key(update):
+    """
+    Returns
+    -------
+    int or tuple
+        Id of the chat an update belongs to, or a key unique to the update if
+        it doesn't belong to any
+    """
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                  'my_chat_member', 'chat_member', 'chat_join_request'):
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.chat.id
+    call = getattr(update, 'callback_query', None)
+    if call is not None:
+        return call.message.chat.id if call.message is not None else call.from_user.id
+    for field in ('inline_query', 'chosen_inline_result', 'shipping_query',
+                  'pre_checkout_query'):
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.from_user.id
+    return ('update', update.update_id)
+
+
+class UpdateDispatcher:
+    """
+    Processes updates of different chats concurrently and updates of the same
+    chat one after another, in the order they were submitted
+
+    Every chat with updates is queued once. A worker takes the chat, processes
+    its oldest update and queues the chat again if it has more, behind other
+    chats, so a busy chat can't hold up the rest. Thus a double click on
+    a button or two quick messages never run at the same time, while the
+    amount of concurrently processed updates stays bounded by the number of
+    workers
+    """
+    def __init__(self, process, workers=None, max_pending=None):
+        """
+        Parameters
+        ----------
+        process : coroutine function
+            Called with every update
+        workers : int or None
+            Updates processed concurrently, UPDATE_WORKERS or 8
+        max_pending : int or None
+            Updates submitted but not processed yet, above which submitters
+            have to wait, UPDATE_QUEUE_SIZE or 1000
+        """
+        self.process = process
+        self.workers = int(workers or env.get('UPDATE_WORKERS', 8))
+        self.max_pending = int(max_pending or env.get('UPDATE_QUEUE_SIZE', 1000))
+        # chat key -> updates waiting, present while the chat is queued or
+        # one of its updates is processed
+        self.chats = {}
+        self.ready = Queue()
+        self.space = Event()
+        self.space.set()
+        self.tasks = []
+        self.stats = {'pending': 0, 'processed': 0, 'failed': 0}
+
+    def start(self):
+        """
+        Starts the workers unless they are running. Called on first submit
+        """
+        if not self.tasks:
+            self.tasks = [create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Cancels the workers, updates left are dropped
+        """
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task.cancel()
+        await gather(*tasks, return_exceptions=True)
+
+    def _enqueue(self, update):
+        self.start()
+        self.stats['pending'] += 1
+        key = chat_key(update)
+        updates = self.chats.get(key)
+        if updates is not None:
+            updates.append(update)
+            return
+        self.chats[key] = deque([update])
+        self.ready.put_nowait(key)
+
+    async def submit(self, updates):
+        """
+        Queues updates one by one, every update waits until there are less
+        than max_pending updates, so a producer which awaits submit is slowed
+        down to the pace of the workers
+        """
+        for update in updates:
+            while self.stats['pending'] >= self.max_pending:
+                self.space.clear()
+                await self.space.wait()
+            self._enqueue(update)
+
+    def submit_nowait(self, update):
+        """
+        Queues an update
+
+        Raises
+        ------
+        asyncio.QueueFull
+            If there are max_pending updates already
+        """
+        if self.stats['pending'] >= self.max_pending:
+            raise QueueFull()
+        self._enqueue(update)
+
+    async def work(self):
+        while True:
+            key = await self.ready.get()
+            updates = self.chats[key]
+            update = updates.popleft()
+            try:
+                await self.process(update)
+                self.stats['processed'] += 1
+            except Exception:
+                self.stats['failed'] += 1
+                logging.exception(f'DISPATCHER: failed to process update {update.update_id}')
+            finally:
+                self.stats['pending'] -= 1
+                if self.stats['pending'] < self.max_pending:
+                    self.space.set()
+                if updates:
+                    self.ready.put_nowait(key)
+                else:
+                    del self.chats[key]
@@ -0,0 +1,238 @@
+from collections import defaultdict
+from asyncio import sleep
+import logging
+
+
+class Matcher:
+    """
+    Assigns pending course works to mentors
+
+    A course work goes to the mentor with the best score among the mentors
+    who lead one of its subjects, don't mentor its student already and have
+    free places. The score prefers mentors with larger overlap of subjects and
+    then larger free share of capacity. Older course works are assigned first
+
+    Matching is incremental. Every course work left after a run has no
+    mentor to go to, so only new course works and course works of mentors
+    who have changed are scored on the next run
+    """
+    def __init__(self, subject_weight=2.0):
+        """
+        Parameters
+        ----------
+        subject_weight : float
+            Weight of subject overlap relative to free share of capacity
+        """
+        self.subject_weight = subject_weight
+        # id -> dict with fields 'subjects', 'students', 'load', 'capacity'
+        self.mentors = {}
+        # id -> dict with fields 'student', 'subjects'
+        self.requests = {}
+        self.mentors_by_subject = defaultdict(set)
+        self.requests_by_subject = defaultdict(set)
+        self.requests_by_student = defaultdict(set)
+        # ids of requests to be scored on the next run
+        self.stale = set()
+        self.last_request = None
+
+    def update_mentor(self, mentor_id, subjects, students, load, capacity):
+        """
+        Adds a mentor or updates it if anything has changed
+        """
+        mentor = {'subjects': frozenset(subjects), 'students': frozenset(students),
+                  'load': load, 'capacity': capacity}
+        old = self.mentors.get(mentor_id)
+        if old == mentor:
+            return
+        if old is not None:
+            for subj in old['subjects']:
+                self.mentors_by_subject[subj].discard(mentor_id)
+        self.mentors[mentor_id] = mentor
+        for subj in mentor['subjects']:
+            self.mentors_by_subject[subj].add(mentor_id)
+        if load < capacity:
+            for subj in mentor['subjects']:
+                self.stale |= self.requests_by_subject[subj]
+
+    def remove_mentor(self, mentor_id):
+        mentor = self.mentors.pop(mentor_id, None)
+        if mentor is None:
+            return
+        for subj in mentor['subjects']:
+            self.mentors_by_subject[subj].discard(mentor_id)
+
+    def sync_mentors(self, mentors):
+        """
+        Replaces known mentors with mentors from
+        Database.get_mentors_for_matching
+        """
+        for mentor_id in set(self.mentors).difference(ment['id'] for ment in mentors):
+            self.remove_mentor(mentor_id)
+        for ment in mentors:
+            self.update_mentor(ment['id'], ment['subjects'], ment['students'],
+                               ment['load'], ment['capacity'])
+
+    def add_request(self, request_id, student, subjects):
+        if request_id in self.requests:
+            return
+        request = {'student': student, 'subjects': frozenset(subjects)}
+        self.requests[request_id] = request
+        for subj in request['subjects']:
+            self.requests_by_subject[subj].add(request_id)
+        self.requests_by_student[student].add(request_id)
+        self.stale.add(request_id)
+        if self.last_request is None or request_id > self.last_request:
+            self.last_request = request_id
+
+    def remove_request(self, request_id):
+        request = self.requests.pop(request_id, None)
+        if request is None:
+            return
+        for subj in request['subjects']:
+            self.requests_by_subject[subj].discard(request_id)
+        self.requests_by_student[request['student']].discard(request_id)
+        if not self.requests_by_student[request['student']]:
+            del self.requests_by_student[request['student']]
+        self.stale.discard(request_id)
+
+    def sync_requests(self, request_ids):
+        """
+        Drops known requests which are not pending anymore, e.g. deleted,
+        accepted by hand or of a student accepted meanwhile
+
+        Parameters
+        ----------
+        request_ids : set(int)
+            Database.get_pending_request_ids
+        """
+        for request_id in set(self.requests).difference(request_ids):
+            self.remove_request(request_id)
+
+    def best_mentor(self, request):
+        best = None
+        candidates = set().union(*[self.mentors_by_subject[subj]
+                                   for subj in request['subjects']])
+        for mentor_id in candidates:
+            mentor = self.mentors[mentor_id]
+            if mentor['load'] >= mentor['capacity'] or \
+                    request['student'] in mentor['students']:
+                continue
+            score = (len(request['subjects'] & mentor['subjects']) /
+                     len(request['subjects']) * self.subject_weight +
+                     (mentor['capacity'] - mentor['load']) / mentor['capacity'])
+            # older mentors win ties
+            key = (score, -mentor_id)
+            if best is None or key > best[0]:
+                best = (key, mentor_id)
+        return None if best is None else best[1]
+
+    def match(self):
+        """
+        Scores stale requests and assigns them, one request per student
+
+        Loads of the mentors are updated right away. Results of assignments
+        have to be reported with accepted and rejected
+
+        Returns
+        -------
+        list(tuple(int, int))
+            Pairs of request and mentor database ids
+        """
+        assignments = []
+        taken = set()
+        for request_id in sorted(self.stale):
+            request = self.requests.get(request_id)
+            if request is None or request['student'] in taken:
+                continue
+            mentor_id = self.best_mentor(request)
+            if mentor_id is None:
+                continue
+            mentor = self.mentors[mentor_id]
+            mentor['load'] += 1
+            mentor['students'] = mentor['students'] | {request['student']}
+            taken.add(request['student'])
+            assignments.append((request_id, mentor_id))
+        self.stale = set()
+        return assignments
+
+    def accepted(self, request_id):
+        """
+        Removes an accepted request along with other requests of the student,
+        just like Database.accept_work does
+        """
+        request = self.requests.get(request_id)
+        if request is None:
+            return
+        for other in list(self.requests_by_student[request['student']]):
+            self.remove_request(other)
+
+    def rejected(self, request_id):
+        """
+        Removes a request, which could not be accepted, and lets other
+        requests of the student be assigned on the next run
+        """
+        request = self.requests.get(request_id)
+        if request is None:
+            return
+        self.remove_request(request_id)
+        self.stale |= self.requests_by_student.get(request['student'], set())
+
+
+async def run_matching(db, matcher, default_capacity=5, notify=None):
+    """
+    Feeds changes from the database to a Matcher and accepts course works it
+    assigns
+
+    Parameters
+    ----------
+    db : mentor_whirlpool.database.Database
+    matcher : Matcher
+    default_capacity : int
+        Capacity of mentors with no CAPACITY set
+    notify : coroutine function or None
+        Called with mentor database id and the course work dict after
+        a course work is accepted
+
+    Returns
+    -------
+    int
+        Amount of accepted course works
+    """
+    matcher.sync_mentors(await db.get_mentors_for_matching(default_capacity))
+    matcher.sync_requests(await db.get_pending_request_ids())
+    for request in await db.get_pending_requests(after_id=matcher.last_request):
+        matcher.add_request(request['id'], request['student'], request['subjects'])
+    accepted = 0
+    for (request_id, mentor_id) in matcher.match():
+        work = await db.get_course_works(request_id)
+        # accepted or deleted meanwhile, or its student was accepted, fresh
+        # loads are read on the next run
+        if not work or not await db.accept_work(mentor_id, request_id,
+                                                new_student=True):
+            matcher.rejected(request_id)
+            continue
+        matcher.accepted(request_id)
+        accepted += 1
+        if notify is not None:
+            try:
+                await notify(mentor_id, work[0])
+            except Exception:
+                logging.exception(f'MATCHING: failed to notify of work {request_id}')
+    return accepted
+
+
+async def matching_job(db, interval, default_capacity=5, notify=None):
+    """
+    Runs matching every interval seconds until cancelled
+    """
+    matcher = Matcher()
+    while True:
+        try:
+            accepted = await run_matching(db, matcher, default_capacity, notify)
+            if accepted:
+                logging.info(f'MATCHING: assigned {accepted} course works')
+        except Exception:
+            logging.exception('MATCHING: run failed')
+            # start over from the database, the state may be inconsistent
+            matcher = Matcher()
+        await sleep(interval)
@@ -1,7 +1,8 @@
 from mentor_whirlpool.telegram import bot
 from telebot import types
 from mentor_whirlpool.database import Database
-from mentor_whirlpool.utils import get_pretty_mention_db
+from mentor_whirlpool.utils import (get_pretty_mention_db, PAGE_SIZE, split_page,
+                                    paging_buttons, parse_paging)
 from asyncio import gather
 import logging
 
@@ -31,33 +32,48 @@ async def works(message: types.Message) -> None:
     if not mentor["subjects"]:
         await bot.send_message(message.chat.id, '__Сначала добавьте направления!__')
         return
-    course_works = await db.get_course_works(subjects=[subj['id'] for subj in mentor["subjects"]])
-    logging.debug(f'available course works for specified subjects: {course_works}')
-    logging.debug(f'served students: {mentor["students"]}')
+    markup = await works_markup(db, mentor)
+
+    logging.debug(f'chat_id: {message.from_user.id} preparing COURSE_WORKS')
+    await bot.send_message(message.chat.id, '__Доступные курсовые работы__',
+                           reply_markup=markup)
+    logging.debug(f'chat_id: {message.from_user.id} done COURSE_WORKS')
 
-    for stud in mentor["students"]:
-        for work in stud['course_works']:
-            try:
-                course_works.remove(work)
-                logging.debug(f'removed work from list: {work}')
-            except ValueError:
-                continue
-    logging.debug('finished removing works')
+
+async def works_markup(db, mentor, after_id=None, before_id=None):
+    """
+    Prepares buttons of a page of course works available to a mentor
+    """
+    course_works, has_prev, has_next = split_page(
+        await db.get_open_requests_for_mentor(mentor['id'], limit=PAGE_SIZE + 1,
+                                              after_id=after_id, before_id=before_id),
+        after_id, before_id)
+    logging.debug(f'available course works for specified subjects: {course_works}')
 
     markup = types.InlineKeyboardMarkup(row_width=1)
 
     for work in course_works:
-        stud = (await db.get_students(work["student"]))[0]
-        line = f'{stud["name"]} - {work["subjects"][0]["subject"]} - {work["description"]}'
-        if await db.get_accepted(student=work['student']):
+        line = f'{work["student_name"]} - {work["subjects"][0]["subject"]} - {work["description"]}'
+        if work['additional']:
             line += ' (доп. запрос)'
         markup.add(
             types.InlineKeyboardButton(line, callback_data=f'mnt_work_{work["id"]}'))
+    markup.row(*paging_buttons('mnt_works_page_', course_works, has_prev, has_next))
+    return markup
 
-    logging.debug(f'chat_id: {message.from_user.id} preparing COURSE_WORKS')
-    await bot.send_message(message.chat.id, '__Доступные курсовые работы__',
-                           reply_markup=markup)
-    logging.debug(f'chat_id: {message.from_user.id} done COURSE_WORKS')
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('mnt_works_page_'))
+async def callback_works_page(call: types.CallbackQuery) -> None:
+    db = Database()
+    if not await db.check_is_mentor(call.from_user.id):
+        logging.warn(f'chat_id: {call.from_user.id} is not a mentor')
+        return
+    mentor = (await db.get_mentors(chat_id=call.from_user.id))[0]
+    after_id, before_id = parse_paging(call.data, 'mnt_works_page_')
+    await gather(bot.answer_callback_query(call.id),
+                 bot.edit_message_reply_markup(call.from_user.id, call.message.id,
+                                               reply_markup=await works_markup(
+                                                   db, mentor, after_id, before_id)))
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('mnt_work_'))
@@ -75,8 +91,12 @@ async def callback_query_work(call: types.CallbackQuery) -> None:
 
     stud = (await db.get_students(id_field=course_work_info["student"]))[0]
     logging.debug(f'chat_id: {call.from_user.id} preparing mnt_work')
-    await gather(db.accept_work(mentor_info['id'], call.data[9:]),
-                 bot.answer_callback_query(call.id),
+    if not await db.accept_work(mentor_info['id'], int(call.data[9:])):
+        await gather(bot.answer_callback_query(call.id),
+                     bot.send_message(call.from_user.id, 'Запрос уже не действителен!'),
+                     bot.delete_message(call.from_user.id, call.message.id))
+        return
+    await gather(bot.answer_callback_query(call.id),
                  bot.delete_message(call.from_user.id, call.message.id),
                  bot.send_message(call.from_user.id,
                                   f'Вы взялись за __{course_work_info["description"]}__\n'
@@ -85,3 +105,25 @@ async def callback_query_work(call: types.CallbackQuery) -> None:
                                   f'Ментор {get_pretty_mention_db(mentor_info)} принял Ваш запрос __{course_work_info["description"]}__\n'
                                   'Если вам будет необходимо запросить дополнительного ментора, воспользуйтесь "Добавить запрос"'))
     logging.debug(f'chat_id: {call.from_user.id} done mnt_work')
+
+
+async def notify_assignment(mentor_id, work):
+    """
+    Tells a mentor and a student about a course work assigned by matching
+
+    Parameters
+    ----------
+    mentor_id : int
+        Database id of the mentor
+    work : dict
+        The course work as returned by Database.get_course_works
+    """
+    db = Database()
+    mentor_info, stud = await gather(db.get_mentors(id=mentor_id),
+                                     db.get_students(id_field=work['student']))
+    await gather(bot.send_message(mentor_info[0]['chat_id'],
+                                  f'Вам назначена курсовая работа __{work["description"]}__\n'
+                                  f'Напишите {get_pretty_mention_db(stud[0])}'),
+                 bot.send_message(stud[0]['chat_id'],
+                                  f'Ментор {get_pretty_mention_db(mentor_info[0])} принял Ваш запрос __{work["description"]}__\n'
+                                  'Если вам будет необходимо запросить дополнительного ментора, воспользуйтесь "Добавить запрос"'))
@@ -0,0 +1,204 @@
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from asyncio import sleep, Event
+from aiohttp import web
+import logging
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# queries made outside of handlers, e.g. by background jobs
+BACKGROUND = 'background'
+
+# counters of the handler processing the current update, shared with every
+# task it spawns
+_current = ContextVar('metrics_update', default=None)
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.max_queries = 0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.queries_per_call = [0] * (len(QUERIES_BUCKETS) + 1)
+
+    def observe(self, seconds, queries, query_seconds, failed):
+        self.calls += 1
+        self.errors += failed
+        self.seconds += seconds
+        self.queries += queries
+        self.query_seconds += query_seconds
+        self.max_queries = max(self.max_queries, queries)
+        self.latency[_bucket(LATENCY_BUCKETS, seconds)] += 1
+        self.queries_per_call[_bucket(QUERIES_BUCKETS, queries)] += 1
+
+
+def _bucket(bounds, value):
+    for (i, bound) in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+class Metrics:
+    """
+    Collects latency and database queries of every bot handler
+
+    Handlers are timed by timed, which MentorWhirlpoolBot applies to every
+    handler it registers. Queries are counted by the cursor of pooled
+    connections and attributed to the handler running in the current task,
+    so N+1 regressions show up as a growing amount of queries per call
+
+    Results are rendered in Prometheus text format by render or logged by
+    log_summary
+    """
+    def __init__(self):
+        # handler name -> HandlerStats
+        self.handlers = {}
+        # name -> dict of numbers, rendered as is, e.g. Outbound.stats
+        self.sources = {}
+
+    def stats(self, name):
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        return stats
+
+    def timed(self, handler, name=None):
+        """
+        Wraps a handler coroutine function to record its latency, failures
+        and database queries under name, module.function by default
+        """
+        if name is None:
+            name = f'{handler.__module__}.{handler.__qualname__}'
+
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            update = {'queries': 0, 'query_seconds': 0.0}
+            token = _current.set(update)
+            start = perf_counter()
+            failed = True
+            try:
+                res = await handler(*args, **kwargs)
+                failed = False
+                return res
+            finally:
+                _current.reset(token)
+                self.stats(name).observe(perf_counter() - start, update['queries'],
+                                         update['query_seconds'], failed)
+        return wrapper
+
+    def record_query(self, seconds):
+        """
+        Attributes a database query to the handler of the current task
+        """
+        update = _current.get()
+        if update is None:
+            stats = self.stats(BACKGROUND)
+            stats.queries += 1
+            stats.query_seconds += seconds
+            return
+        update['queries'] += 1
+        update['query_seconds'] += seconds
+
+    def add_source(self, name, values):
+        """
+        Renders a dict of numbers along with handler metrics. The dict is
+        read on every render, so it may be updated in place
+        """
+        self.sources[name] = values
+
+    def render(self):
+        """
+        Returns
+        -------
+        str
+            All metrics in Prometheus text exposition format
+        """
+        lines = []
+
+        def histogram(metric, help, bounds, attr, total):
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} histogram')
+            for (name, stats) in sorted(self.handlers.items()):
+                cumulative = 0
+                counts = getattr(stats, attr)
+                for (bound, count) in zip(list(bounds) + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{handler="{name}",le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{metric}_sum{{handler="{name}"}} {total(stats)}')
+                lines.append(f'{metric}_count{{handler="{name}"}} {stats.calls}')
+
+        def counter(metric, help, value, kind='counter'):
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for (name, stats) in sorted(self.handlers.items()):
+                lines.append(f'{metric}{{handler="{name}"}} {value(stats)}')
+
+        histogram('mentor_whirlpool_handler_seconds', 'Handler latency',
+                  LATENCY_BUCKETS, 'latency', lambda stats: stats.seconds)
+        histogram('mentor_whirlpool_handler_queries', 'Database queries per handler call',
+                  QUERIES_BUCKETS, 'queries_per_call', lambda stats: stats.queries)
+        counter('mentor_whirlpool_handler_errors_total', 'Handler calls which raised',
+                lambda stats: stats.errors)
+        counter('mentor_whirlpool_handler_query_seconds_total', 'Time spent in queries',
+                lambda stats: stats.query_seconds)
+        counter('mentor_whirlpool_handler_max_queries', 'Most queries in a single call',
+                lambda stats: stats.max_queries, kind='gauge')
+        for (source, values) in sorted(self.sources.items()):
+            for (key, value) in sorted(values.items()):
+                lines.append(f'mentor_whirlpool_{source}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def log_summary(self):
+        """
+        Logs a line per handler, slowest on average first
+        """
+        for (name, stats) in sorted(self.handlers.items(),
+                                    key=lambda item: -item[1].seconds / max(item[1].calls, 1)):
+            calls = max(stats.calls, 1)
+            logging.info(f'METRICS: {name} calls={stats.calls} errors={stats.errors} '
+                         f'avg_ms={stats.seconds / calls * 1000:.1f} '
+                         f'queries_per_call={stats.queries / calls:.1f} '
+                         f'max_queries={stats.max_queries} '
+                         f'query_ms={stats.query_seconds * 1000:.1f}')
+        for (source, values) in sorted(self.sources.items()):
+            logging.info(f'METRICS: {source} ' +
+                         ' '.join(f'{key}={value}' for (key, value) in sorted(values.items())))
+
+
+metrics = Metrics()
+
+
+async def log_metrics_job(interval):
+    """
+    Logs a metrics summary every interval seconds until cancelled
+    """
+    while True:
+        await sleep(interval)
+        metrics.log_summary()
+
+
+async def serve_metrics(host='0.0.0.0', port=9100, path='/metrics'):
+    """
+    Serves metrics for Prometheus to scrape until cancelled
+    """
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(),
+                            content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f'METRICS: serving on {host}:{port}{path}')
+    try:
+        await Event().wait()
+    finally:
+        await runner.cleanup()
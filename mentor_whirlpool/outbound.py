@@ -0,0 +1,144 @@
+from telebot.asyncio_helper import ApiTelegramException
+from asyncio import sleep
+from time import monotonic
+from os import environ as env
+import logging
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, with bursts of up to burst calls
+
+    Tokens are reserved in the order callers arrive, so waiting callers are
+    served first come, first served
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Takes a token
+
+        Returns
+        -------
+        float
+            Seconds to wait before the token may be used
+        """
+        self._refill()
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """
+        Makes the next token available not earlier than in seconds
+        """
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class Outbound:
+    """
+    Sends requests to Telegram within its flood limits
+
+    Every request waits for a token of its chat and then for a global one.
+    Requests rejected with 429 Too Many Requests are retried after the
+    retry_after Telegram asks for, which also holds back the chat in question,
+    so that broadcasts finish as fast as allowed without dropping messages
+    """
+    def __init__(self, global_rate=None, chat_rate=None, group_rate=None,
+                 chat_burst=None, max_retries=None):
+        """
+        Parameters
+        ----------
+        global_rate : float or None
+            Requests per second to all chats, OUTBOUND_GLOBAL_RATE or 30
+        chat_rate : float or None
+            Requests per second to a private chat, OUTBOUND_CHAT_RATE or 1
+        group_rate : float or None
+            Requests per second to a group chat, OUTBOUND_GROUP_RATE or 20/60
+        chat_burst : int or None
+            Requests to a chat sent without waiting, OUTBOUND_CHAT_BURST or 3
+        max_retries : int or None
+            Attempts after 429 before giving up, OUTBOUND_MAX_RETRIES or 5
+        """
+        self.global_rate = float(global_rate or env.get('OUTBOUND_GLOBAL_RATE', 30))
+        self.chat_rate = float(chat_rate or env.get('OUTBOUND_CHAT_RATE', 1))
+        self.group_rate = float(group_rate or env.get('OUTBOUND_GROUP_RATE', 20 / 60))
+        self.chat_burst = int(chat_burst or env.get('OUTBOUND_CHAT_BURST', 3))
+        self.max_retries = int(max_retries or env.get('OUTBOUND_MAX_RETRIES', 5))
+        self.bucket = TokenBucket(self.global_rate, int(self.global_rate))
+        self.chats = {}
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'waiting': 0,
+                      'throttled_seconds': 0.0}
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) > 10000:
+                self.chats = {key: val for (key, val) in self.chats.items()
+                              if not val.idle()}
+            # group chats have negative ids
+            rate = self.group_rate if int(chat_id) < 0 else self.chat_rate
+            bucket = self.chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _wait(self, bucket):
+        delay = bucket.reserve()
+        if delay > 0:
+            self.stats['throttled_seconds'] += delay
+            await sleep(delay)
+
+    async def call(self, chat_id, request, *args, **kwargs):
+        """
+        Calls request(*args, **kwargs) when limits allow
+
+        Parameters
+        ----------
+        chat_id : int or str or None
+            Chat the request is sent to, only the global limit applies if None
+        request : coroutine function
+            Bot API method
+
+        Raises
+        ------
+        telebot.asyncio_helper.ApiTelegramException
+            If Telegram rejects the request for another reason than flood
+            control, or it's still rejected after max_retries attempts
+        """
+        self.stats['waiting'] += 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                if chat_id is not None:
+                    await self._wait(self.chat_bucket(chat_id))
+                await self._wait(self.bucket)
+                try:
+                    res = await request(*args, **kwargs)
+                except ApiTelegramException as exc:
+                    if exc.error_code != 429 or attempt == self.max_retries:
+                        self.stats['failed'] += 1
+                        raise
+                    retry_after = (exc.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    logging.warn(f'OUTBOUND: flood control for chat_id: {chat_id}, '
+                                 f'retrying in {retry_after}s')
+                    self.stats['retried'] += 1
+                    if chat_id is not None:
+                        self.chat_bucket(chat_id).pause(retry_after)
+                    else:
+                        self.bucket.pause(retry_after)
+                    continue
+                self.stats['sent'] += 1
+                return res
+        finally:
+            self.stats['waiting'] -= 1
@@ -0,0 +1,223 @@
+from telebot.asyncio_storage import StateStorageBase
+from psycopg.types.json import Jsonb
+from asyncio import create_task, current_task, sleep
+from copy import deepcopy
+from time import monotonic
+import logging
+import psycopg
+
+from mentor_whirlpool.database.pool import connection, conninfo, PROCESS_TOKEN
+
+
+class PostgresStateStorage(StateStorageBase):
+    """
+    Keeps states of users in STATES table, so that multi-step flows survive
+    restarts and may be shared by several bot processes
+
+    Reads go through a local cache, which holds every entry for cache_ttl
+    seconds. Writes are applied to the cache immediately and written to the
+    database in batches every flush_interval seconds
+
+    Entries read from the database are only cached while listen_states runs,
+    which drops entries other processes change, so that a user whose next
+    update goes to another process doesn't get a stale state
+    """
+    def __init__(self, flush_interval=0.5, cache_ttl=10):
+        """
+        Parameters
+        ----------
+        flush_interval : float
+            Seconds changes are accumulated for before being written
+        cache_ttl : float
+            Seconds a state read from the database is trusted for
+        """
+        super().__init__()
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        # (chat_id, user_id) -> (expiration time, state, data), state is None
+        # if user has no state
+        self.cache = {}
+        # (chat_id, user_id) -> (state, data), not yet written to the database
+        self.dirty = {}
+        self.flusher = None
+        # True while listen_states is connected
+        self.listening = False
+
+    async def _get(self, chat_id, user_id):
+        key = (int(chat_id), int(user_id))
+        entry = self.cache.get(key)
+        if key in self.dirty or (self.listening and entry is not None
+                                 and entry[0] > monotonic()):
+            return entry[1], entry[2]
+        async with connection() as conn:
+            line = await (await conn.execute('SELECT STATE, DATA FROM STATES '
+                                              'WHERE CHAT_ID = %s AND USER_ID = %s',
+                                              key)).fetchone()
+        state, data = line if line is not None else (None, None)
+        self.cache[key] = (monotonic() + self.cache_ttl, state, data)
+        return state, data
+
+    def _put(self, chat_id, user_id, state, data):
+        key = (int(chat_id), int(user_id))
+        self.cache[key] = (monotonic() + self.cache_ttl, state, data)
+        self.dirty[key] = (state, data)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if (self.flusher is None or self.flusher.done()
+                or self.flusher is current_task()):
+            self.flusher = create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """
+        Writes all pending changes to the database
+        """
+        dirty, self.dirty = self.dirty, {}
+        if not dirty:
+            return
+        upserts = [(chat_id, user_id, state, Jsonb(data))
+                   for ((chat_id, user_id), (state, data)) in dirty.items()
+                   if state is not None]
+        deletes = [key for (key, (state, _)) in dirty.items() if state is None]
+        try:
+            async with connection() as conn:
+                async with conn.cursor() as cur:
+                    if upserts:
+                        await cur.executemany('INSERT INTO STATES VALUES(%s, %s, %s, %s) '
+                                              'ON CONFLICT (CHAT_ID, USER_ID) DO '
+                                              'UPDATE SET STATE = EXCLUDED.STATE, '
+                                              'DATA = EXCLUDED.DATA', upserts)
+                    if deletes:
+                        await cur.executemany('DELETE FROM STATES '
+                                              'WHERE CHAT_ID = %s AND USER_ID = %s',
+                                              deletes)
+                    # delivered on commit, other processes drop their copies
+                    await cur.executemany("SELECT pg_notify('states', %s)",
+                                          [(f'{PROCESS_TOKEN} {chat_id}:{user_id}',)
+                                           for (chat_id, user_id) in dirty])
+                await conn.commit()
+        except Exception:
+            logging.exception('STATES: failed to write states, retrying later')
+            # keep changes made while we were writing, they are newer
+            for (key, value) in dirty.items():
+                self.dirty.setdefault(key, value)
+            self.flusher = create_task(self._flush_later())
+            return
+        now = monotonic()
+        self.cache = {key: entry for (key, entry) in self.cache.items()
+                      if entry[0] > now or key in self.dirty}
+        # changed while we were writing, nothing else would write them
+        if self.dirty:
+            self._schedule_flush()
+
+    def _invalidate(self, key=None):
+        """
+        Drops a cached entry, or every entry if key is None, keeping changes
+        not written yet
+        """
+        if key is None:
+            self.cache = {k: entry for (k, entry) in self.cache.items()
+                          if k in self.dirty}
+        elif key not in self.dirty:
+            self.cache.pop(key, None)
+
+    async def listen_states(self, retry_interval=5):
+        """
+        Drops cached states whenever another process changes them. Runs
+        forever on a dedicated connection, reconnecting on errors. States are
+        not cached while it is not connected
+
+        Parameters
+        ----------
+        retry_interval : float
+            Seconds to wait before reconnecting
+        """
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(conninfo(),
+                                                                 autocommit=True) as conn:
+                    await conn.execute('LISTEN STATES')
+                    # changes made while we were not listening
+                    self._invalidate()
+                    self.listening = True
+                    async for notify in conn.notifies():
+                        (token, key) = notify.payload.split(' ')
+                        if token == PROCESS_TOKEN:
+                            continue
+                        (chat_id, user_id) = key.split(':')
+                        self._invalidate((int(chat_id), int(user_id)))
+            except psycopg.OperationalError as exc:
+                logging.warning(f'STATES listener disconnected: {exc}')
+                await sleep(retry_interval)
+            finally:
+                self.listening = False
+
+    async def set_state(self, chat_id, user_id, state, *args, **kwargs):
+        if hasattr(state, 'name'):
+            state = state.name
+        _, data = await self._get(chat_id, user_id)
+        self._put(chat_id, user_id, state, data if data is not None else {})
+        return True
+
+    async def delete_state(self, chat_id, user_id, *args, **kwargs):
+        state, _ = await self._get(chat_id, user_id)
+        if state is None:
+            return False
+        self._put(chat_id, user_id, None, None)
+        return True
+
+    async def get_state(self, chat_id, user_id, *args, **kwargs):
+        state, _ = await self._get(chat_id, user_id)
+        return state
+
+    async def get_data(self, chat_id, user_id, *args, **kwargs):
+        _, data = await self._get(chat_id, user_id)
+        return deepcopy(data)
+
+    async def reset_data(self, chat_id, user_id, *args, **kwargs):
+        state, _ = await self._get(chat_id, user_id)
+        if state is None:
+            return False
+        self._put(chat_id, user_id, state, {})
+        return True
+
+    async def set_data(self, chat_id, user_id, key, value, *args, **kwargs):
+        state, data = await self._get(chat_id, user_id)
+        if state is None:
+            raise RuntimeError(f'chat_id {chat_id} and user_id {user_id} does not exist')
+        data = deepcopy(data)
+        data[key] = value
+        self._put(chat_id, user_id, state, data)
+        return True
+
+    def get_interactive_data(self, chat_id, user_id, *args, **kwargs):
+        return StateData(self, chat_id, user_id)
+
+    async def save(self, chat_id, user_id, data, *args, **kwargs):
+        state, _ = await self._get(chat_id, user_id)
+        if state is None:
+            return False
+        self._put(chat_id, user_id, state, deepcopy(data))
+        return True
+
+
+class StateData:
+    """
+    async with context of bot.retrieve_data, saves data back on exit
+    """
+    def __init__(self, storage, chat_id, user_id):
+        self.storage = storage
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.data = None
+
+    async def __aenter__(self):
+        self.data = await self.storage.get_data(self.chat_id, self.user_id)
+        return self.data
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self.storage.save(self.chat_id, self.user_id, self.data)
@@ -81,21 +81,19 @@ async def readmission_request(call: types.CallbackQuery) -> None:
     cw_id = await db.readmission_work(accepted[0]['id'], new_subj['id'])
     accept_markup = types.InlineKeyboardMarkup(row_width=1)
     accept_markup.add(types.InlineKeyboardButton('Принять', callback_data=f'mnt_work_{cw_id}'))
-    mentors_to_alert = [ment for ment in await db.get_mentors()
-                        if new_subj in ment['subjects']]
+    mentors_to_alert = await db.get_mentor_chat_ids_for_subject(new_subj['id'],
+                                                                exclude_student=id[0]['id'])
     logging.debug(f'chat_id: {call.from_user.id} preparing ADD_REQUEST')
     await gather(bot.answer_callback_query(call.id),
                  bot.send_message(call.from_user.id,
                                   'Ты успешно запросил доп. ментора!\n'
                                   'Если передумаешь, можно отменить '
                                   'запрос, используя "Удалить запрос"'),
-                 *[bot.send_message(ment['chat_id'],
-                                    f'Поступил новый запрос на доп. ментора по вашему направлению: {new_subj["subject"]} от '
-                                    f'{get_pretty_mention(call.from_user)}'
-                                    f'Тема: {accepted[0]["description"]}',
-                                    reply_markup=accept_markup)
-                   for ment in mentors_to_alert
-                   if ment not in await db.get_mentors(student=id[0]['id'])])
+                 bot.broadcast(mentors_to_alert,
+                               f'Поступил новый запрос на доп. ментора по вашему направлению: {new_subj["subject"]} от '
+                               f'{get_pretty_mention(call.from_user)}'
+                               f'Тема: {accepted[0]["description"]}',
+                               reply_markup=accept_markup))
     logging.debug(f'chat_id: {call.from_user.id} done ADD_REQUEST')
 
 
@@ -134,19 +132,17 @@ async def save_request(message: types.Message) -> None:
     accept_markup = types.InlineKeyboardMarkup(row_width=1)
     accept_markup.add(types.InlineKeyboardButton('Принять', callback_data=f'mnt_work_{cw_id}'))
     subject = (await subject)[0]
-    mentors_to_alert = [ment['chat_id'] for ment in await db.get_mentors()
-                        if subject in ment['subjects']]
+    mentors_to_alert = await db.get_mentor_chat_ids_for_subject(subject['id'])
     await gather(bot.delete_state(message.from_user.id, message.chat.id),
                  bot.send_message(message.chat.id, "Работа успешно добавлена! Ожидайте ответа ментора. "
                                                    "\nЕсли вы захотите запросить дополнительного ментора, нажми кнопку "
                                                    "__\"Добавить запрос\"__",
                                                    reply_markup=keyboard),
-                 *[bot.send_message(ment,
-                                    f'Поступил новый запрос по вашему направлению: {subject["subject"]} от '
-                                    f'{get_pretty_mention_db(student_dict)}!\n'
-                                    f'Тема: {student_dict["description"]}',
-                                    reply_markup=accept_markup)
-                   for ment in mentors_to_alert])
+                 bot.broadcast(mentors_to_alert,
+                               f'Поступил новый запрос по вашему направлению: {subject["subject"]} от '
+                               f'{get_pretty_mention_db(student_dict)}!\n'
+                               f'Тема: {student_dict["description"]}',
+                               reply_markup=accept_markup))
     logging.debug(f'chat_id: {message.from_user.id} done add_work_flag')
 
 
@@ -70,16 +70,17 @@ async def delete_finale(call: types.CallbackQuery) -> None:
     id_ = call.data[14:]
 
     db = Database()
-    student = await db.get_students(id_)
-    mentors = await db.get_mentors(student=id_)
+    async with db.transaction():
+        student = await db.get_students(id_)
+        mentors = await db.get_mentors(student=id_)
+        await db.remove_student(id_)
 
     logging.debug(f'chat_id: {call.from_user.id} preparing delete_finale')
-    await gather(db.remove_student(id_), bot.answer_callback_query(call.id),
+    await gather(bot.answer_callback_query(call.id),
                  bot.send_message(call.from_user.id,
                                   "Курсовая работа успешно удалена. Но ты всегда можете начать новую!"),
-                 *[bot.send_message(ment['chat_id'],
-                                    f"Студент {get_pretty_mention_db(student[0])} удалил принятую вами "
-                                    f"курсовую работу \"{student[0]['course_works'][0]['description']}\"")
-                   for ment in mentors],
+                 bot.broadcast([ment['chat_id'] for ment in mentors],
+                               f"Студент {get_pretty_mention_db(student[0])} удалил принятую вами "
+                               f"курсовую работу \"{student[0]['course_works'][0]['description']}\""),
                  bot.delete_message(call.message.chat.id, call.message.id))
     logging.debug(f'chat_id: {call.from_user.id} done delete_finale')
@@ -58,10 +58,14 @@ async def callback_accept_idea(call: types.CallbackQuery) -> None:
     db = Database()
     idea_id = call.data[13:]
     idea = await db.get_ideas(id_field=idea_id)
+    if not idea or not await db.accept_idea({'name': call.from_user.username,
+                                             'chat_id': call.from_user.id}, idea_id):
+        await gather(bot.answer_callback_query(call.id),
+                     bot.send_message(call.from_user.id, 'Идея уже не доступна!'))
+        return
     await gather(
         bot.answer_callback_query(call.id),
         bot.send_message(call.from_user.id, 'Вы успешно взялись за идею от ментора'),
         bot.send_message((await db.get_mentors(id=idea[0]['mentor']))[0]['chat_id'],
                          f'Вашу идею принял {get_pretty_mention(call.from_user)}'),
-        db.accept_idea({'name': call.from_user.username, 'chat_id': call.from_user.id}, idea_id)
     )
@@ -18,8 +18,8 @@ async def request_support(message):
     """
     logging.debug(f'chat_id: {message.from_user.id} is in SUPPORT')
     db = Database()
-    is_ellegible = not any(await gather(db.check_is_admin(message.from_user.id),
-                                        db.check_is_support(message.from_user.id)))
+    roles = await db.get_roles(message.from_user.id)
+    is_ellegible = not (roles['admin'] or roles['support'])
     if not is_ellegible:
         logging.warn(f'chat_id: {message.from_user.id} is inellegible')
         return
@@ -30,8 +30,8 @@ async def request_support(message):
             'name': message.from_user.username,
             'issue': None,
         }),
-            *[bot.send_message(chat_id, 'Пользователю нужна помощь')
-              for chat_id in [rec['chat_id'] for rec in await db.get_supports()]],
+            bot.broadcast([rec['chat_id'] for rec in await db.get_supports()],
+                          'Пользователю нужна помощь'),
             bot.send_message(message.chat.id, 'Ждите ответ поддержки'))
         logging.debug(f'chat_id: {message.from_user.id} done SUPPORT')
     else:
@@ -1,5 +1,95 @@
 from telebot.async_telebot import AsyncTeleBot
 from telebot.asyncio_storage import StateMemoryStorage
+from mentor_whirlpool.state_storage import PostgresStateStorage
+from mentor_whirlpool.outbound import Outbound
+from mentor_whirlpool.metrics import metrics
+from mentor_whirlpool.dispatcher import UpdateDispatcher
+from asyncio import gather
 from os import environ
+import logging
 
-bot = AsyncTeleBot(environ['TELEGRAM_BOT_TOKEN'], state_storage=StateMemoryStorage(), parse_mode='Markdown')
+
+class MentorWhirlpoolBot(AsyncTeleBot):
+    """
+    AsyncTeleBot, which routes messages it sends, edits and deletes through
+    an Outbound, keeping them within Telegram flood limits, and times every
+    handler it registers with metrics
+
+    Updates are processed by an UpdateDispatcher, concurrently across chats
+    and in order within a chat
+    """
+    def __init__(self, *args, outbound=None, dispatcher=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbound = outbound if outbound is not None else Outbound()
+        self.dispatcher = dispatcher if dispatcher is not None \
+            else UpdateDispatcher(self.process_update)
+        metrics.add_source('outbound', self.outbound.stats)
+        metrics.add_source('updates', self.dispatcher.stats)
+
+    async def process_new_updates(self, updates):
+        await self.dispatcher.submit(updates)
+
+    async def get_updates(self, *args, **kwargs):
+        # polling runs process_new_updates in a task it never awaits, so wait
+        # for the previous batch to be queued before fetching the next one.
+        # Thus a full dispatcher stalls polling instead of piling up updates
+        if self._pending_tasks:
+            await gather(*self._pending_tasks, return_exceptions=True)
+        return await super().get_updates(*args, **kwargs)
+
+    async def process_update(self, update):
+        """
+        Runs handlers of a single update, waiting for them to finish
+        """
+        await super().process_new_updates([update])
+
+    @staticmethod
+    def _build_handler_dict(handler, pass_bot=False, **filters):
+        # every *_handler decorator and register_*_handler method ends up here
+        return AsyncTeleBot._build_handler_dict(metrics.timed(handler), pass_bot, **filters)
+
+    async def send_message(self, chat_id, *args, **kwargs):
+        return await self.outbound.call(chat_id, super().send_message,
+                                        chat_id, *args, **kwargs)
+
+    async def edit_message_text(self, text, chat_id=None, *args, **kwargs):
+        return await self.outbound.call(chat_id, super().edit_message_text,
+                                        text, chat_id, *args, **kwargs)
+
+    async def edit_message_reply_markup(self, chat_id=None, *args, **kwargs):
+        return await self.outbound.call(chat_id, super().edit_message_reply_markup,
+                                        chat_id, *args, **kwargs)
+
+    async def delete_message(self, chat_id, *args, **kwargs):
+        return await self.outbound.call(chat_id, super().delete_message,
+                                        chat_id, *args, **kwargs)
+
+    async def broadcast(self, chat_ids, text, **kwargs):
+        """
+        Sends the same message to many chats as fast as flood limits allow
+        A chat failing to receive it, e.g. because it blocked the bot, doesn't
+        affect the rest
+
+        Returns
+        -------
+        int
+            Amount of chats the message was delivered to
+        """
+        results = await gather(*[self.send_message(chat_id, text, **kwargs)
+                                 for chat_id in chat_ids],
+                               return_exceptions=True)
+        for (chat_id, res) in zip(chat_ids, results):
+            if isinstance(res, Exception):
+                logging.warn(f'OUTBOUND: failed to deliver to chat_id: {chat_id}: {res}')
+        return sum(not isinstance(res, Exception) for res in results)
+
+
+# STATE_STORAGE=memory keeps states in the process, losing them on restart
+if environ.get('STATE_STORAGE', 'postgres') == 'memory':
+    state_storage = StateMemoryStorage()
+else:
+    state_storage = PostgresStateStorage(
+        flush_interval=float(environ.get('STATE_FLUSH_INTERVAL', 0.5)),
+        cache_ttl=float(environ.get('STATE_CACHE_TTL', 10)))
+
+bot = MentorWhirlpoolBot(environ['TELEGRAM_BOT_TOKEN'], state_storage=state_storage, parse_mode='Markdown')
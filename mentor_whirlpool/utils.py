@@ -1,3 +1,9 @@
+from telebot import types
+
+# amount of entries shown at once by paginated lists
+PAGE_SIZE = 10
+
+
 def get_name(user):
     return markdown_escape(user.username) if user.username is not None\
            else markdown_escape(user.first_name + f" {user.last_name}") if user.last_name is not None else ""
@@ -17,3 +23,46 @@ def get_pretty_mention_db(user):
 def markdown_escape(text):
     special_characters = set('#*>`~_')
     return "".join('\\' + c if c in special_characters or c == '\\' else c for c in text)
+
+
+def split_page(lines, after_id=None, before_id=None, size=PAGE_SIZE):
+    """
+    Splits lines fetched by a paginated getter with limit=size + 1 into a page
+    and whether there are pages before and after it
+
+    Returns
+    -------
+    tuple(list, bool, bool)
+    """
+    if before_id is not None and after_id is None:
+        return lines[-size:], len(lines) > size, True
+    return lines[:size], after_id is not None, len(lines) > size
+
+
+def paging_buttons(prefix, page, has_prev, has_next):
+    """
+    Returns
+    -------
+    list(telebot.types.InlineKeyboardButton)
+        Buttons with callback data prefix + 'prev_<id>' and prefix + 'next_<id>'
+        to be parsed with parse_paging
+    """
+    buttons = []
+    if page and has_prev:
+        buttons.append(types.InlineKeyboardButton('⬅️', callback_data=f'{prefix}prev_{page[0]["id"]}'))
+    if page and has_next:
+        buttons.append(types.InlineKeyboardButton('➡️', callback_data=f'{prefix}next_{page[-1]["id"]}'))
+    return buttons
+
+
+def parse_paging(data, prefix):
+    """
+    Returns
+    -------
+    tuple(int or None, int or None)
+        after_id and before_id of the requested page
+    """
+    direction, id_ = data[len(prefix):].split('_')
+    if direction == 'next':
+        return int(id_), None
+    return None, int(id_)
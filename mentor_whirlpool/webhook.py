@@ -0,0 +1,112 @@
+from mentor_whirlpool.telegram import bot
+from telebot import types
+from aiohttp import web
+from asyncio import QueueFull, Event
+from hmac import compare_digest
+from secrets import token_urlsafe
+from os import environ as env
+import logging
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """
+    Receives Telegram updates over HTTP and hands them to the
+    UpdateDispatcher of the bot
+
+    When the dispatcher has too many pending updates, the server answers
+    with 503 and Telegram delivers the update again later, so bursts can't
+    pile up an unbounded amount of work
+
+    Updates may be posted by hand to test it locally:
+    curl -H 'X-Telegram-Bot-Api-Secret-Token: <secret>' -d @update.json \
+         http://localhost:8443/
+    """
+    def __init__(self, secret=None, path='/'):
+        """
+        Parameters
+        ----------
+        secret : str or None
+            Value of X-Telegram-Bot-Api-Secret-Token header, which every
+            request has to carry. Generated if None, then serve has to
+            register the webhook with it
+        path : str
+            Path updates are posted to
+        """
+        self.generated_secret = not secret
+        self.secret = secret or token_urlsafe(32)
+        self.app = web.Application()
+        self.app.router.add_post(path, self.receive)
+
+    async def receive(self, request: web.Request) -> web.Response:
+        # compared as bytes, compare_digest raises on non-ASCII str
+        header = request.headers.get(SECRET_HEADER, '').encode('utf-8', 'surrogateescape')
+        if not compare_digest(header, self.secret.encode()):
+            logging.warn(f'WEBHOOK: wrong secret token from {request.remote}')
+            return web.Response(status=403)
+        try:
+            payload = await request.json()
+            if not isinstance(payload, dict):
+                raise ValueError('update is not an object')
+            update = types.Update.de_json(payload)
+        except (ValueError, KeyError, TypeError):
+            logging.warn(f'WEBHOOK: malformed update from {request.remote}')
+            return web.Response(status=400)
+        try:
+            bot.dispatcher.submit_nowait(update)
+        except QueueFull:
+            logging.warn(f'WEBHOOK: queue is full, rejecting update {update.update_id}')
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        return web.Response()
+
+    async def serve(self, host='0.0.0.0', port=8443, url=None):
+        """
+        Serves updates until cancelled
+
+        Parameters
+        ----------
+        host : str
+            Address to listen on
+        port : int
+            Port to listen on
+        url : str or None
+            Public URL of the server. If supplied, it is registered with
+            Telegram, otherwise the webhook is expected to be set up already,
+            with the secret the server was created with
+
+        Raises
+        ------
+        RuntimeError
+            If url is None and the secret was generated, Telegram wouldn't
+            know it
+        """
+        if url is None and self.generated_secret:
+            raise RuntimeError('WEBHOOK_SECRET has to be set if WEBHOOK_URL is not')
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        bot.dispatcher.start()
+        if url is not None:
+            await bot.set_webhook(url, secret_token=self.secret)
+        logging.info(f'WEBHOOK: serving on {host}:{port} with '
+                     f'{bot.dispatcher.workers} workers')
+        try:
+            await Event().wait()
+        finally:
+            await bot.dispatcher.stop()
+            await runner.cleanup()
+
+
+async def serve_webhook():
+    """
+    Serves updates with a WebhookServer configured by WEBHOOK_* environment
+    variables. Workers and queue size are set by UPDATE_WORKERS and
+    UPDATE_QUEUE_SIZE, see UpdateDispatcher. Without WEBHOOK_SECRET a random
+    one is registered along with WEBHOOK_URL
+    """
+    server = WebhookServer(secret=env.get('WEBHOOK_SECRET'),
+                           path=env.get('WEBHOOK_PATH', '/'))
+    await server.serve(host=env.get('WEBHOOK_HOST', '0.0.0.0'),
+                       port=int(env.get('WEBHOOK_PORT', 8443)),
+                       url=env.get('WEBHOOK_URL'))
@@ -1 +1,5 @@
 import tests.database_unit_tests
+import tests.matching_unit_tests
+import tests.metrics_unit_tests
+import tests.dispatcher_unit_tests
+import tests.webhook_unit_tests
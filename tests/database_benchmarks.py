@@ -0,0 +1,106 @@
+import asynctest
+import random
+from mentor_whirlpool.database import Database, close_pool
+from mentor_whirlpool.metrics import Metrics
+from tests.seed import seed
+
+# amounts of students, mentors and subjects of every dataset
+SIZES = ((100, 10, 5), (1000, 50, 15), (5000, 200, 30))
+ROUNDS = 5
+
+
+def calls(db, data):
+    """
+    Returns
+    -------
+    list(tuple(str, function))
+        Benchmarked calls, every function takes the number of the round and
+        returns a coroutine. Calls which change data get other lines every
+        round
+    dict
+        Maps names of calls which change data to coroutine functions, which
+        take the number of the round and the result of the call and check
+        that it succeeded
+    """
+    subj = data['subjects'][0]
+    (stud, chat_id) = data['students'][0]
+    mentor = next(iter(data['mentors']))
+    mentor_chat = data['mentors'][mentor][0]
+    # one round more for warm-up
+    pending = data['pending'][:ROUNDS + 1]
+    to_accept = data['pending'][ROUNDS + 1:2 * ROUNDS + 2]
+    to_reject = data['accepted'][:ROUNDS + 1]
+    to_remove = data['accepted'][ROUNDS + 1:2 * ROUNDS + 2]
+
+    async def accepted(i, res):
+        return res is True
+
+    async def rejected(i, res):
+        return not await db.get_accepted(student=to_reject[i][0])
+
+    checks = {'accept_work': accepted, 'reject_student': rejected}
+    return [
+        ('get_subjects', lambda i: db.get_subjects()),
+        ('get_course_works', lambda i: db.get_course_works()),
+        ('get_course_works(subjects)', lambda i: db.get_course_works(subjects=[subj])),
+        ('get_accepted', lambda i: db.get_accepted()),
+        ('get_accepted(subjects)', lambda i: db.get_accepted(subjects=[subj])),
+        ('get_accepted(student)', lambda i: db.get_accepted(student=to_reject[0][0])),
+        ('get_students', lambda i: db.get_students()),
+        ('get_students(chat_id)', lambda i: db.get_students(chat_id=chat_id)),
+        ('get_mentors', lambda i: db.get_mentors()),
+        ('get_mentors(chat_id)', lambda i: db.get_mentors(chat_id=mentor_chat)),
+        ('get_ideas', lambda i: db.get_ideas()),
+        ('get_ideas(subjects)', lambda i: db.get_ideas(subjects=[subj])),
+        ('modify_course_work', lambda i: db.modify_course_work(
+            {'id': pending[i][0], 'subjects': ['subject1', 'subject2'],
+             'description': f'modified{i}'})),
+        ('accept_work', lambda i: db.accept_work(mentor, to_accept[i][0])),
+        ('reject_student', lambda i: db.reject_student(to_reject[i][1], to_reject[i][0])),
+        ('remove_student', lambda i: db.remove_student(to_remove[i][0])),
+    ], checks
+
+
+class TestDatabaseBenchmarks(asynctest.TestCase):
+    """
+    Times Database methods on datasets of several sizes and counts SQL
+    statements every call issues. Every benchmarked method has to take
+    the same amount of statements regardless of the size of the dataset
+
+    Needs a live database like the unit tests, and wipes it
+    """
+    async def test_round_trips(self):
+        db = Database()
+        await db.initdb()
+        metrics = Metrics()
+        # name -> [(size, statements, milliseconds)]
+        results = {}
+        for (students, mentors, subjects) in SIZES:
+            data = await seed(db, random.Random(625), students, mentors, subjects)
+            (benchmarked, checks) = calls(db, data)
+            for (name, call) in benchmarked:
+                check = checks.get(name)
+                # warm-up fills caches, e.g. of subjects and roles
+                res = await call(ROUNDS)
+                if check is not None:
+                    self.assertTrue(await check(ROUNDS, res), f'{name} failed')
+                timed = metrics.timed(call, name=f'{name}/{students}')
+                for i in range(ROUNDS):
+                    res = await timed(i)
+                    # outside of timed, so that its queries are not counted
+                    if check is not None:
+                        self.assertTrue(await check(i, res), f'{name} failed')
+                stats = metrics.handlers[f'{name}/{students}']
+                results.setdefault(name, []).append(
+                    (students, stats.max_queries, stats.seconds / stats.calls * 1000))
+        await close_pool()
+
+        print(f'\n{"method":<28}' +
+              ''.join(f'{f"{size[0]} stmts":>14}{f"{size[0]} ms":>12}' for size in SIZES))
+        for (name, runs) in results.items():
+            print(f'{name:<28}' + ''.join(f'{statements:>14}{ms:>12.2f}'
+                                          for (_, statements, ms) in runs))
+        for (name, runs) in results.items():
+            with self.subTest(method=name):
+                self.assertEqual(len({statements for (_, statements, _) in runs}), 1,
+                                 f'statements of {name} grow with the dataset: {runs}')
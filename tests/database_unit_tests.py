@@ -1,23 +1,33 @@
 import asynctest
-from asyncio import gather
-from mentor_whirlpool.database import Database
+from asyncio import gather, create_task, sleep, new_event_loop
+from mentor_whirlpool.database import Database, open_pool, close_pool
+from mentor_whirlpool.database.pool import conninfo, read_pool
+from mentor_whirlpool.database.subjects_tables import SubjectsTables
+from mentor_whirlpool.database.mentors_tables import MentorsTables
+from mentor_whirlpool.database.schema import migrations, schema_version
+from mentor_whirlpool.state_storage import PostgresStateStorage
+from mentor_whirlpool.metrics import Metrics
 import random
 import string
 
 
 async def clear_database(db):
-    await gather(db.db.execute('DELETE FROM COURSE_WORKS_SUBJECTS'),
-                 db.db.execute('DELETE FROM ACCEPTED_SUBJECTS'),
-                 db.db.execute('DELETE FROM MENTORS_SUBJECTS'),
-                 db.db.execute('DELETE FROM MENTORS_STUDENTS'),
-                 db.db.execute('DELETE FROM SUPPORT_REQUESTS'),
-                 db.db.execute('DELETE FROM ACCEPTED'),
-                 db.db.execute('DELETE FROM COURSE_WORKS'),
-                 db.db.execute('DELETE FROM ADMINS'),
-                 db.db.execute('DELETE FROM MENTORS'),
-                 db.db.execute('DELETE FROM STUDENTS'),
-                 db.db.execute('DELETE FROM SUBJECTS'),
-                 db.db.execute('DELETE FROM SUPPORTS'))
+    async with db.connection() as conn:
+        await gather(conn.execute('DELETE FROM COURSE_WORKS_SUBJECTS'),
+                     conn.execute('DELETE FROM ACCEPTED_SUBJECTS'),
+                     conn.execute('DELETE FROM MENTORS_SUBJECTS'),
+                     conn.execute('DELETE FROM MENTORS_STUDENTS'),
+                     conn.execute('DELETE FROM SUPPORT_REQUESTS'),
+                     conn.execute('DELETE FROM ACCEPTED'),
+                     conn.execute('DELETE FROM COURSE_WORKS'),
+                     conn.execute('DELETE FROM IDEAS_SUBJECTS'),
+                     conn.execute('DELETE FROM IDEAS'),
+                     conn.execute('DELETE FROM ADMINS'),
+                     conn.execute('DELETE FROM MENTORS'),
+                     conn.execute('DELETE FROM STUDENTS'),
+                     conn.execute('DELETE FROM SUBJECTS'),
+                     conn.execute('DELETE FROM SUPPORTS'),
+                     conn.execute('DELETE FROM STATES'))
 
 # fine to test altogether, because different tables are tested
 class TestDatabaseSimple(asynctest.TestCase):
@@ -31,15 +41,28 @@ class TestDatabaseSimple(asynctest.TestCase):
                            ('course_works_subjects',), ('mentors_subjects',),
                            ('mentors_students',), ('support_requests',),]
         # executemany is screwed
-        for table in expected_tables:
-            exists = await (await self.db.db.execute("""
-            SELECT EXISTS(
-            SELECT FROM information_schema.tables
-            WHERE table_catalog = \'mentor_whirlpool\' AND
-            table_name = %s)
-            """, table)).fetchone()
-            self.assertEqual((True,), exists)
-        await self.db.db.close()
+        async with self.db.connection() as conn:
+            for table in expected_tables:
+                exists = await (await conn.execute("""
+                SELECT EXISTS(
+                SELECT FROM information_schema.tables
+                WHERE table_catalog = \'mentor_whirlpool\' AND
+                table_name = %s)
+                """, table)).fetchone()
+                self.assertEqual((True,), exists)
+        await close_pool()
+
+class TestDatabaseSchema(asynctest.TestCase):
+    async def test_concurrent_migrate(self):
+        self.db = Database()
+        # every process runs initdb on startup
+        await gather(*[Database().initdb() for _ in range(4)])
+        async with self.db.connection() as conn:
+            self.assertEqual(await schema_version(conn), migrations()[-1][0])
+            (applied,) = await (await conn.execute('SELECT COUNT(*) '
+                                                   'FROM SCHEMA_VERSION')).fetchone()
+        self.assertEqual(applied, len(migrations()))
+        await close_pool()
 
 class TestDatabaseSubject(asynctest.TestCase):
     async def test_add_subject_random(self):
@@ -57,7 +80,47 @@ class TestDatabaseSubject(asynctest.TestCase):
         dbsubj = await self.db.get_subjects()
         dbsubj.sort()
         self.assertListEqual(subjects, dbsubj)
-        await self.db.db.close()
+        await close_pool()
+
+    async def test_subject_catalog(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        self.db.invalidate_subjects()
+        ids = [await self.db.add_subject(subj) for subj in ['SQL', 'Qt', 'TCP']]
+        self.assertListEqual(await self.db.get_subjects(),
+                             [{'id': id_f, 'subject': subj}
+                              for (id_f, subj) in zip(ids, ['SQL', 'Qt', 'TCP'])])
+        self.assertListEqual(await self.db.get_subjects(name='Qt'),
+                             [{'id': ids[1], 'subject': 'Qt'}])
+        await self.db.remove_subject(ids[1])
+        self.assertListEqual(await self.db.get_subjects(ids[1]), [])
+        self.assertListEqual(await self.db.get_subjects(name='Qt'), [])
+        # catalog loaded from the database matches the one kept in memory
+        cached = await self.db.get_subjects()
+        self.db.invalidate_subjects()
+        self.assertListEqual(cached, await self.db.get_subjects())
+        await close_pool()
+
+    async def test_subject_listener(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        listener = create_task(self.db.listen_subjects())
+        await sleep(0.1)
+        await self.db.load_subjects()
+        await self.db.add_subject('SQL')
+        await sleep(0.1)
+        # own changes are applied in place and don't drop the catalog
+        self.assertIsNotNone(SubjectsTables._subjects_by_id)
+        async with self.db.connection() as conn:
+            await conn.execute("SELECT pg_notify('subjects', 'another process')")
+            await conn.commit()
+        await sleep(0.1)
+        self.assertIsNone(SubjectsTables._subjects_by_id)
+        self.assertEqual(len(await self.db.get_subjects(name='SQL')), 1)
+        listener.cancel()
+        await close_pool()
 
 class TestDatabaseMentor(asynctest.TestCase):
     async def test_add_remove_mentor(self):
@@ -107,7 +170,7 @@ class TestDatabaseMentor(asynctest.TestCase):
             ment.pop('id', None)
             ment['subjects'].sort()
         self.assertListEqual(mentors, dbmentors)
-        await self.db.db.close()
+        await close_pool()
 
 
 class TestDatabaseCourseWork(asynctest.TestCase):
@@ -163,7 +226,7 @@ class TestDatabaseCourseWork(asynctest.TestCase):
 
         # for student in dbstudents:
         #     self.assertListEqual(await self.db.get_student_course_works(student['chat_id']), student['course_works'])
-        await self.db.db.close()
+        await close_pool()
 
 class TestDatabaseAdmins(asynctest.TestCase):
     async def test_add_remove_admins(self):
@@ -195,7 +258,7 @@ class TestDatabaseAdmins(asynctest.TestCase):
             self.assertFalse(await self.db.check_is_admin(chat_id))
 
         self.assertListEqual([], await self.db.get_admins())
-        await self.db.db.close()
+        await close_pool()
 
 class TestDatabaseSupport(asynctest.TestCase):
     async def test_add_remove_support(self):
@@ -244,7 +307,7 @@ class TestDatabaseSupport(asynctest.TestCase):
         dbsupports = await self.db.get_supports()
         dbsupports.sort(key=lambda x: x['chat_id'])
         self.assertListEqual(dbsupports, supports)
-        await self.db.db.close()
+        await close_pool()
 
     async def test_add_remove_support_request(self):
         self.db = Database()
@@ -292,7 +355,7 @@ class TestDatabaseSupport(asynctest.TestCase):
         dbsupport_requests = await self.db.get_support_requests()
         dbsupport_requests.sort(key=lambda x: x['chat_id'])
         self.assertListEqual(support_requests, dbsupport_requests)
-        await self.db.db.close()
+        await close_pool()
 
 
 class TestDatabaseAccepted(asynctest.TestCase):
@@ -380,7 +443,7 @@ class TestDatabaseAccepted(asynctest.TestCase):
         
 
         # await self.db.modify_course_work()
-        await self.db.db.close()
+        await close_pool()
 
 
 class TestDatabaseReject(asynctest.TestCase):
@@ -423,9 +486,55 @@ class TestDatabaseReject(asynctest.TestCase):
         dbworks = await self.db.get_course_works()
         dbworks.sort(key=lambda x: x['id'])
         self.assertListEqual(expected_works, dbworks)
-        await self.db.db.close()
+        await close_pool()
 
 
+class TestDatabaseConcurrentAccept(asynctest.TestCase):
+    async def test_concurrent_accept_course_work(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_course_work({'name': 'student', 'chat_id': 1,
+                                       'subjects': ['subject'],
+                                       'description': 'contested'})
+        await gather(*[self.db.add_mentor({'name': f'mentor{i}', 'chat_id': 100 + i,
+                                           'subjects': [], 'load': 0})
+                       for i in range(8)])
+        (work,) = await self.db.get_course_works()
+        mentors = await self.db.get_mentors()
+        accepted = await gather(*[self.db.accept_work(ment['id'], work['id'])
+                                  for ment in mentors])
+        self.assertEqual(accepted.count(True), 1)
+        self.assertEqual(sum(ment['load'] for ment in await self.db.get_mentors()), 1)
+        self.assertListEqual(await self.db.get_course_works(), [])
+        self.assertEqual(len(await self.db.get_accepted()), 1)
+        self.assertFalse(await self.db.accept_work(mentors[0]['id'], work['id']))
+        await close_pool()
+
+    async def test_concurrent_accept_works_of_student(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        for i in range(2):
+            await self.db.add_mentor({'name': f'mentor{i}', 'chat_id': 100 + i,
+                                      'subjects': [], 'load': 0})
+        mentors = await self.db.get_mentors()
+        for attempt in range(10):
+            works = [await self.db.add_course_work({'name': 'student', 'chat_id': attempt,
+                                                    'subjects': ['subject'],
+                                                    'description': f'work{i}'})
+                     for i in range(2)]
+            # would deadlock, unless acceptances of the student are serialised
+            accepted = await gather(*[self.db.accept_work(ment['id'], work)
+                                      for (ment, work) in zip(mentors, works)])
+            self.assertEqual(accepted.count(True), 1)
+        self.assertEqual(sum(ment['load'] for ment in await self.db.get_mentors()), 10)
+        self.assertListEqual(await self.db.get_course_works(), [])
+        self.assertEqual(len(await self.db.get_accepted()), 10)
+        await close_pool()
+
 class TestDatabaseRemoveStudent(asynctest.TestCase):
     async def test_remove_student(self):
         self.db = Database()
@@ -470,8 +579,232 @@ class TestDatabaseRemoveStudent(asynctest.TestCase):
         course_works.sort(key=lambda x: x['id'])
         self.assertListEqual(dbstudents, students)
         self.assertListEqual(dbcourse_works, course_works)
-        await self.db.db.close()
+        await close_pool()
+
+
+class TestDatabaseLoad(asynctest.TestCase):
+    async def test_load_follows_students(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': ['subject'], 'load': 0})
+        works = [await self.db.add_course_work({'name': f'student{i}', 'chat_id': i,
+                                                'subjects': ['subject'],
+                                                'description': f'work{i}'})
+                 for i in range(3)]
+        (mentor,) = await self.db.get_mentors()
+        for work in works:
+            await self.db.accept_work(mentor['id'], work)
+        (mentor,) = await self.db.get_mentors()
+        self.assertEqual(mentor['load'], 3)
+
+        await self.db.reject_student(mentor['id'], mentor['students'][0]['id'])
+        # not a student of the mentor anymore
+        await self.db.reject_student(mentor['id'], mentor['students'][0]['id'])
+        (mentor,) = await self.db.get_mentors()
+        self.assertEqual(mentor['load'], 2)
+        self.assertEqual(len(await self.db.get_course_works()), 1)
 
+        async with self.db.connection() as conn:
+            await conn.execute('UPDATE MENTORS SET LOAD = 42')
+        self.assertEqual(await self.db.reconcile_loads(), 1)
+        self.assertEqual(await self.db.reconcile_loads(), 0)
+        (mentor,) = await self.db.get_mentors()
+        self.assertEqual(mentor['load'], 2)
+        await close_pool()
+
+class TestDatabaseTransaction(asynctest.TestCase):
+    async def count_accepted(self):
+        # a connection outside of the transaction
+        async with (await open_pool()).connection() as conn:
+            (count,) = await (await conn.execute('SELECT COUNT(*) FROM ACCEPTED')).fetchone()
+            return count
+
+    async def test_transaction(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': ['subject'], 'load': 0})
+        (mentor,) = await self.db.get_mentors()
+        line = {'name': 'student', 'chat_id': 1, 'subjects': ['subject'],
+                'description': 'work'}
+        async with self.db.transaction():
+            await self.db.accept_work(mentor['id'], await self.db.add_course_work(line))
+            self.assertEqual(len(await self.db.get_accepted()), 1)
+            # not committed by the methods
+            self.assertEqual(await self.count_accepted(), 0)
+        self.assertEqual(await self.count_accepted(), 1)
+
+        with self.assertRaises(RuntimeError):
+            async with self.db.transaction():
+                await self.db.remove_student((await self.db.get_students())[0]['id'])
+                raise RuntimeError()
+        self.assertEqual(await self.count_accepted(), 1)
+        self.assertEqual(len(await self.db.get_students()), 1)
+        await close_pool()
+
+    async def test_caches_updated_after_commit(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        await self.db.load_subjects()
+
+        with self.assertRaises(RuntimeError):
+            async with self.db.transaction():
+                subj_id = await self.db.add_subject('rolled back')
+                raise RuntimeError()
+        self.assertNotIn(subj_id, await self.db.load_subjects())
+
+        self.assertFalse((await self.db.get_roles(100))['admin'])
+        async with self.db.transaction():
+            await self.db.add_admin(100)
+            # cached roles stay until the change is committed
+            self.assertFalse((await self.db.get_roles(100))['admin'])
+        self.assertTrue((await self.db.get_roles(100))['admin'])
+        await close_pool()
+
+class TestDatabaseMentorsStats(asynctest.TestCase):
+    async def test_mentors_overview(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': ['a', 'b'], 'load': 0})
+        await self.db.add_mentor({'name': 'idle', 'chat_id': 101,
+                                  'subjects': None, 'load': 0})
+        works = [await self.db.add_course_work({'name': f'student{i}', 'chat_id': i,
+                                                'subjects': ['a'],
+                                                'description': f'work{i}'})
+                 for i in range(2)]
+        (mentor,) = await self.db.get_mentors(chat_id=100)
+        for work in works:
+            await self.db.accept_work(mentor['id'], work)
+        await self.db.refresh_mentors_stats()
+
+        (busy, idle) = await self.db.get_mentors_overview()
+        self.assertListEqual(busy['subjects'], [{'subject': 'a', 'students': 2},
+                                                {'subject': 'b', 'students': 0}])
+        self.assertEqual(busy['load'], 2)
+        self.assertListEqual(idle['subjects'], [])
+        page = await self.db.get_mentors_overview(limit=1, after_id=busy['id'])
+        self.assertListEqual([ment['name'] for ment in page], ['idle'])
+        await close_pool()
+
+    async def test_refresh_scheduled_after_loop_change(self):
+        self.db = Database()
+        self.db.stats_refresh_delay = 0
+        await self.db.initdb()
+        await clear_database(self.db)
+        # a refresh left pending by a test case with its own event loop
+        loop = new_event_loop()
+        MentorsTables._stats_refresh = loop.create_task(sleep(1))
+        loop.close()
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': ['a'], 'load': 0})
+        work = await self.db.add_course_work({'name': 'student', 'chat_id': 1,
+                                              'subjects': ['a'], 'description': 'work'})
+        (mentor,) = await self.db.get_mentors()
+        await self.db.accept_work(mentor['id'], work)
+        await sleep(0.5)
+        (mentor,) = await self.db.get_mentors_overview()
+        self.assertListEqual(mentor['subjects'], [{'subject': 'a', 'students': 1}])
+        await close_pool()
+
+class TestDatabaseRemoveMentor(asynctest.TestCase):
+    async def test_remove_mentor(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': ['subject'], 'load': 0})
+        await gather(*[self.db.add_course_work({'name': f'student{i}', 'chat_id': i,
+                                                'subjects': ['subject'],
+                                                'description': f'work{i}'})
+                       for i in range(30)])
+        await self.db.add_idea({'name': 'mentor', 'chat_id': 100,
+                                'subjects': ['subject'], 'description': 'idea'})
+        (mentor,) = await self.db.get_mentors()
+        course_works = await self.db.get_course_works()
+        for work in course_works:
+            await self.db.accept_work(mentor['id'], work['id'])
+        self.assertListEqual(await self.db.get_course_works(), [])
+
+        await self.db.remove_mentor(id_field=mentor['id'])
+        self.assertListEqual(await self.db.get_mentors(), [])
+        self.assertListEqual(await self.db.get_accepted(), [])
+        self.assertListEqual(await self.db.get_ideas(), [])
+        dbcourse_works = await self.db.get_course_works()
+        dbcourse_works.sort(key=lambda x: x['id'])
+        course_works.sort(key=lambda x: x['id'])
+        self.assertListEqual(dbcourse_works, course_works)
+        await close_pool()
+
+def plan_indexes(plan):
+    indexes = set()
+    if 'Index Name' in plan:
+        indexes.add(plan['Index Name'].upper())
+    for sub in plan.get('Plans', []):
+        indexes |= plan_indexes(sub)
+    return indexes
+
+
+class TestDatabaseIndexes(asynctest.TestCase):
+    async def test_hot_queries_use_indexes(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        # tables large enough for the planner to prefer an index over
+        # a sequential scan on its own, rolled back at the end
+        seeding = ["INSERT INTO SUBJECTS(SUBJECT, COUNT) "
+                   "SELECT 'subject' || I, 0 FROM generate_series(1, 500) I",
+                   "INSERT INTO STUDENTS(NAME, CHAT_ID) "
+                   "SELECT 'student' || I, I FROM generate_series(1, 50000) I",
+                   "INSERT INTO MENTORS(NAME, CHAT_ID, LOAD) "
+                   "SELECT 'mentor' || I, I, 0 FROM generate_series(1, 5000) I",
+                   "INSERT INTO COURSE_WORKS(STUDENT, DESCRIPTION) "
+                   "SELECT ID, 'work' FROM STUDENTS",
+                   "INSERT INTO ACCEPTED(STUDENT, DESCRIPTION) "
+                   "SELECT ID, 'work' FROM STUDENTS",
+                   'INSERT INTO COURSE_WORKS_SUBJECTS SELECT ID, '
+                   '(SELECT MIN(ID) FROM SUBJECTS) + ID % 500 FROM COURSE_WORKS',
+                   'INSERT INTO ACCEPTED_SUBJECTS SELECT ID, '
+                   '(SELECT MIN(ID) FROM SUBJECTS) + ID % 500 FROM ACCEPTED',
+                   'INSERT INTO MENTORS_STUDENTS SELECT '
+                   '(SELECT MIN(ID) FROM MENTORS) + ID % 5000, ID FROM STUDENTS',
+                   "INSERT INTO IDEAS(MENTOR, DESCRIPTION) SELECT "
+                   "(SELECT MIN(ID) FROM MENTORS) + ID % 5000, 'idea' FROM STUDENTS"]
+        async with self.db.connection() as conn:
+            for query in seeding:
+                await conn.execute(query)
+            await conn.execute('ANALYZE')
+            ((subject, student, mentor),) = await (await conn.execute(
+                'SELECT (SELECT MIN(ID) FROM SUBJECTS), (SELECT MIN(ID) FROM STUDENTS), '
+                '(SELECT MIN(ID) FROM MENTORS)')).fetchall()
+            queries = [('SELECT * FROM COURSE_WORKS WHERE STUDENT = %s',
+                        (student,), 'COURSE_WORKS_STUDENT_IDX'),
+                       ('SELECT COURSE_WORK FROM COURSE_WORKS_SUBJECTS WHERE SUBJECT = %s',
+                        (subject,), 'COURSE_WORKS_SUBJECTS_SUBJECT_IDX'),
+                       ('SELECT MENTOR FROM MENTORS_STUDENTS WHERE STUDENT = %s',
+                        (student,), 'MENTORS_STUDENTS_STUDENT_IDX'),
+                       ('SELECT COURSE_WORK FROM ACCEPTED_SUBJECTS WHERE SUBJECT = %s',
+                        (subject,), 'ACCEPTED_SUBJECTS_SUBJECT_IDX'),
+                       ('SELECT * FROM IDEAS WHERE MENTOR = %s',
+                        (mentor,), 'IDEAS_MENTOR_IDX')]
+            for (query, args, index) in queries:
+                # EXPLAIN takes no bound parameters, ids are inlined
+                ((plan,),) = await (await conn.execute('EXPLAIN (FORMAT JSON) ' +
+                                                       query % args)).fetchall()
+                self.assertIn(index, plan_indexes(plan[0]['Plan']), query)
+            await conn.rollback()
+        await close_pool()
 
 class TestDatabaseFiltered(asynctest.TestCase):
     async def test_filter_for_get_course_works(self):
@@ -523,8 +856,76 @@ class TestDatabaseFiltered(asynctest.TestCase):
         # be bothered anymore to fix this stupid junk
         # self.assertListEqual(filtered_course_works, answ_filtered_course_works)
         self.assertListEqual(difference, [])
-        await self.db.db.close()
+        await close_pool()
+
 
+class TestDatabasePaging(asynctest.TestCase):
+    async def test_keyset_paging(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await gather(*[self.db.add_course_work({'name': f'student{i}', 'chat_id': i,
+                                                'subjects': ['subject'],
+                                                'description': f'work{i}'})
+                       for i in range(25)])
+        for getter in (self.db.get_course_works, self.db.get_students):
+            everything = await getter()
+            pages = [await getter(limit=10)]
+            while pages[-1]:
+                pages.append(await getter(limit=10, after_id=pages[-1][-1]['id']))
+            self.assertListEqual([len(page) for page in pages], [10, 10, 5, 0])
+            self.assertListEqual([line for page in pages for line in page], everything)
+            self.assertListEqual(await getter(limit=10, before_id=pages[2][0]['id']),
+                                 pages[1])
+        await close_pool()
+
+class TestDatabaseBatching(asynctest.TestCase):
+    async def test_fan_outs_take_one_statement(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        metrics = Metrics()
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': None, 'load': 0})
+        (mentor,) = await self.db.get_mentors()
+        subjects = [await self.db.add_subject(f'subject{i}') for i in range(20)]
+        await metrics.timed(self.db.add_mentor_subjects, name='add')(mentor['id'], subjects)
+        await metrics.timed(self.db.remove_mentor_subjects, name='remove')(mentor['id'],
+                                                                           subjects[:10])
+        self.assertEqual(metrics.handlers['add'].queries, 1)
+        self.assertEqual(metrics.handlers['remove'].queries, 1)
+        (mentor,) = await self.db.get_mentors()
+        self.assertEqual(len(mentor['subjects']), 10)
+        await close_pool()
+
+class TestDatabaseReadReplica(asynctest.TestCase):
+    async def test_getters_read_replica_until_write(self):
+        writer = Database()
+        await writer.initdb()
+        await clear_database(writer)
+        await writer.add_mentor({'name': 'first', 'chat_id': 1,
+                                 'subjects': None, 'load': 0})
+        # the same database in read-only sessions stands in for a replica,
+        # any write routed to it would fail
+        replica = conninfo() + " options='-c default_transaction_read_only=on'"
+        self.db = Database(read_dsn=replica)
+
+        self.assertEqual(len(await self.db.get_mentors()), 1)
+        self.assertEqual(len(await self.db.get_mentors_overview()), 1)
+        requests = read_pool(replica).get_stats()['requests_num']
+        self.assertEqual(requests, 2)
+
+        await self.db.add_mentor({'name': 'second', 'chat_id': 2,
+                                  'subjects': None, 'load': 0})
+        # reads after a write see it, they go to the primary
+        self.assertEqual(len(await self.db.get_mentors()), 2)
+        self.assertEqual(read_pool(replica).get_stats()['requests_num'], requests)
+
+        await Database(read_dsn=replica).get_students()
+        self.assertEqual(read_pool(replica).get_stats()['requests_num'], requests + 1)
+        await close_pool()
 
 class TestDatabaseMentorSubjects(asynctest.TestCase):
     async def test_add_remove_mentor_subjects(self):
@@ -580,8 +981,97 @@ class TestDatabaseMentorSubjects(asynctest.TestCase):
             dbmentor = (await self.db.get_mentors(chat_id=ment['chat_id']))[0]
             dbmentor['subjects'].sort()
             self.assertEqual(dbmentor, ment)
-        await self.db.db.close()
+        await close_pool()
+
+
+class TestDatabaseMentorsForSubject(asynctest.TestCase):
+    async def test_get_mentor_chat_ids_for_subject(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await gather(self.db.add_mentor({'name': 'first', 'chat_id': 100,
+                                         'subjects': ['subject', 'other'], 'load': 0}),
+                     self.db.add_mentor({'name': 'second', 'chat_id': 101,
+                                         'subjects': ['subject'], 'load': 0}),
+                     self.db.add_mentor({'name': 'third', 'chat_id': 102,
+                                         'subjects': ['other'], 'load': 0}))
+        (subject,) = await self.db.get_subjects(name='subject')
+        self.assertListEqual(sorted(await self.db.get_mentor_chat_ids_for_subject(subject['id'])),
+                             [100, 101])
+
+        work = await self.db.add_course_work({'name': 'student', 'chat_id': 1,
+                                              'subjects': [subject['id']],
+                                              'description': 'work'})
+        (first,) = await self.db.get_mentors(chat_id=100)
+        await self.db.accept_work(first['id'], work)
+        (student,) = await self.db.get_students(chat_id=1)
+        self.assertListEqual(await self.db.get_mentor_chat_ids_for_subject(
+                                 subject['id'], exclude_student=student['id']),
+                             [101])
+        await close_pool()
+
+class TestDatabaseOpenRequests(asynctest.TestCase):
+    async def test_get_open_requests_for_mentor(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_mentor({'name': 'mentor', 'chat_id': 100,
+                                  'subjects': ['subject'], 'load': 0})
+        await self.db.add_subject('other')
+        (subject,) = await self.db.get_subjects(name='subject')
+        (other,) = await self.db.get_subjects(name='other')
+        works = [await self.db.add_course_work({'name': f'student{i}', 'chat_id': i,
+                                                'subjects': [subject['id'] if i % 3 else other['id']],
+                                                'description': f'work{i}'})
+                 for i in range(12)]
+        (mentor,) = await self.db.get_mentors()
+        await self.db.accept_work(mentor['id'], works[1])
+        # additional request of the own student
+        accepted = await self.db.get_accepted()
+        await self.db.readmission_work(accepted[0]['id'], subject['id'])
+
+        expected = [work for (i, work) in enumerate(works) if i % 3 and i != 1]
+        requests = await self.db.get_open_requests_for_mentor(mentor['id'])
+        self.assertListEqual([req['id'] for req in requests], expected)
+        self.assertTrue(all(req['student_name'] == f'student{req["student_chat_id"]}'
+                            for req in requests))
+        page = await self.db.get_open_requests_for_mentor(mentor['id'], limit=3,
+                                                          after_id=expected[2])
+        self.assertListEqual([req['id'] for req in page], expected[3:6])
+        await close_pool()
+
+class TestDatabasePendingRequests(asynctest.TestCase):
+    async def test_accepted_students_left_out(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+
+        await self.db.add_mentor({'name': 'first', 'chat_id': 100,
+                                  'subjects': ['subject'], 'load': 0})
+        await self.db.add_mentor({'name': 'second', 'chat_id': 101,
+                                  'subjects': ['subject'], 'load': 0})
+        (first, second) = await self.db.get_mentors()
+        (subject,) = await self.db.get_subjects(name='subject')
+        works = [await self.db.add_course_work({'name': f'student{i}', 'chat_id': i,
+                                                'subjects': [subject['id']],
+                                                'description': f'work{i}'})
+                 for i in range(2)]
+        await self.db.accept_work(first['id'], works[0])
+        (accepted,) = await self.db.get_accepted()
+        await self.db.readmission_work(accepted['id'], subject['id'])
+        (readmission,) = [work['id'] for work in await self.db.get_course_works()
+                          if work['id'] != works[1]]
 
+        pending = await self.db.get_pending_requests()
+        self.assertListEqual([req['id'] for req in pending], [works[1]])
+        self.assertSetEqual(await self.db.get_pending_request_ids(), {works[1]})
+        self.assertFalse(await self.db.accept_work(second['id'], readmission,
+                                                   new_student=True))
+        self.assertTrue(await self.db.accept_work(second['id'], works[1],
+                                                  new_student=True))
+        await close_pool()
 
 class TestDatabaseModifyCourseWork(asynctest.TestCase):
     async def test_modify_course_work(self):
@@ -619,4 +1109,60 @@ class TestDatabaseModifyCourseWork(asynctest.TestCase):
         for work in course_works:
             work['subjects'].sort()
         self.assertListEqual(course_works, new_works)
-        await self.db.db.close()
+        await close_pool()
+
+
+class TestStateStorage(asynctest.TestCase):
+    async def test_states_survive_restart(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        storage = PostgresStateStorage()
+        await storage.set_state(1, 1, 'AddSubject:subject')
+        async with storage.get_interactive_data(1, 1) as data:
+            data['subject'] = 42
+        await storage.set_state(2, 2, 'AddSubject:subject')
+        await storage.delete_state(2, 2)
+        await storage.flush()
+        # a fresh storage has nothing cached and reads the table
+        storage = PostgresStateStorage()
+        self.assertEqual(await storage.get_state(1, 1), 'AddSubject:subject')
+        self.assertDictEqual(await storage.get_data(1, 1), {'subject': 42})
+        self.assertIsNone(await storage.get_state(2, 2))
+        await close_pool()
+
+    async def test_states_changed_by_other_process(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        # two storages stand in for two bot processes
+        first = PostgresStateStorage()
+        second = PostgresStateStorage()
+        listener = create_task(first.listen_states())
+        while not first.listening:
+            await sleep(0.01)
+        await second.set_state(1, 1, 'AddSubject:subject')
+        await second.flush()
+        self.assertEqual(await first.get_state(1, 1), 'AddSubject:subject')
+        await second.set_state(1, 1, 'AddSubject:topic')
+        await second.flush()
+        await sleep(0.1)
+        self.assertEqual(await first.get_state(1, 1), 'AddSubject:topic')
+        listener.cancel()
+        await close_pool()
+
+    async def test_state_set_during_flush_is_written(self):
+        self.db = Database()
+        await self.db.initdb()
+        await clear_database(self.db)
+        storage = PostgresStateStorage(flush_interval=0)
+        await storage.set_state(1, 1, 'AddSubject:subject')
+        # let the flusher take the change and start writing it
+        await sleep(0)
+        await sleep(0)
+        await storage.set_state(1, 1, 'AddSubject:topic')
+        await sleep(0.2)
+        self.assertDictEqual(storage.dirty, {})
+        storage = PostgresStateStorage()
+        self.assertEqual(await storage.get_state(1, 1), 'AddSubject:topic')
+        await close_pool()
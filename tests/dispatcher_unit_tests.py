@@ -0,0 +1,67 @@
+import asynctest
+from asyncio import sleep, QueueFull, Event, create_task, wait_for
+from types import SimpleNamespace
+from mentor_whirlpool.dispatcher import UpdateDispatcher
+
+
+def update(update_id, chat_id):
+    return SimpleNamespace(update_id=update_id,
+                           message=SimpleNamespace(chat=SimpleNamespace(id=chat_id)))
+
+
+class TestUpdateDispatcher(asynctest.TestCase):
+    async def test_order_within_chat(self):
+        processed = []
+        running = set()
+        overlaps = []
+
+        async def process(upd):
+            chat_id = upd.message.chat.id
+            overlaps.append(chat_id in running)
+            running.add(chat_id)
+            # later updates of the chat finish first if they run concurrently
+            await sleep(0.01 * (10 - upd.update_id % 10))
+            running.discard(chat_id)
+            processed.append(upd.update_id)
+
+        dispatcher = UpdateDispatcher(process, workers=4, max_pending=100)
+        await dispatcher.submit([update(chat * 10 + i, chat)
+                                 for i in range(5) for chat in range(3)])
+        while dispatcher.stats['pending']:
+            await sleep(0.01)
+        await dispatcher.stop()
+        self.assertFalse(any(overlaps))
+        for chat in range(3):
+            self.assertListEqual([i for i in processed if i // 10 == chat],
+                                 [chat * 10 + i for i in range(5)])
+        self.assertEqual(dispatcher.stats['processed'], 15)
+        self.assertDictEqual(dispatcher.chats, {})
+
+    async def test_bounded(self):
+        async def process(upd):
+            await sleep(1)
+
+        dispatcher = UpdateDispatcher(process, workers=1, max_pending=2)
+        dispatcher.submit_nowait(update(1, 1))
+        dispatcher.submit_nowait(update(2, 2))
+        with self.assertRaises(QueueFull):
+            dispatcher.submit_nowait(update(3, 3))
+        await dispatcher.stop()
+
+    async def test_slow_process_stalls_submit(self):
+        release = Event()
+
+        async def process(upd):
+            await release.wait()
+
+        dispatcher = UpdateDispatcher(process, workers=1, max_pending=2)
+        producer = create_task(dispatcher.submit([update(i, i) for i in range(5)]))
+        await sleep(0.05)
+        self.assertFalse(producer.done())
+        self.assertEqual(dispatcher.stats['pending'], 2)
+        release.set()
+        await wait_for(producer, 1)
+        while dispatcher.stats['pending']:
+            await sleep(0.01)
+        await dispatcher.stop()
+        self.assertEqual(dispatcher.stats['processed'], 5)
@@ -0,0 +1,301 @@
+"""
+End-to-end benchmark of the bot
+
+Seeds the database with a deterministic dataset, feeds synthetic updates to
+the registered handlers through the update dispatcher and answers Bot API
+requests with a local fake Telegram server. Reports latency percentiles and
+database queries per update for every scenario, and compares them with
+a baseline saved by an earlier run. A scenario whose handlers raise fails
+the run, its figures are not reliable
+
+Needs the same POSTGRE_* environment as the unit tests. THE DATABASE IS
+WIPED. Run from the repository root:
+
+python3 -m tests.e2e_benchmark --save baseline.json
+python3 -m tests.e2e_benchmark --baseline baseline.json
+"""
+import os
+
+# must be set before the bot is created, the fake API has no flood control
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:benchmark')
+os.environ.setdefault('OUTBOUND_GLOBAL_RATE', '1000000')
+os.environ.setdefault('OUTBOUND_CHAT_RATE', '1000000')
+os.environ.setdefault('OUTBOUND_CHAT_BURST', '1000')
+
+from argparse import ArgumentParser
+from asyncio import run, sleep, create_task
+from collections import Counter
+from math import ceil
+from time import perf_counter
+import json
+import random
+import sys
+
+from aiohttp import web
+from telebot import asyncio_helper, types
+
+from mentor_whirlpool.telegram import bot, state_storage
+from mentor_whirlpool.database import Database, close_pool
+from mentor_whirlpool.dispatcher import UpdateDispatcher
+from mentor_whirlpool.metrics import metrics, BACKGROUND
+import mentor_whirlpool.common
+import mentor_whirlpool.confirm
+import mentor_whirlpool.student_handle
+import mentor_whirlpool.admin_handle
+import mentor_whirlpool.mentor_handle
+import mentor_whirlpool.support_handles
+import mentor_whirlpool.support_request_handler
+from tests.seed import seed, NEW_STUDENTS_CHAT, ADMIN_CHAT
+
+class FakeTelegram:
+    """
+    Answers every Bot API method with a plausible result
+    """
+    def __init__(self, latency=0):
+        """
+        Parameters
+        ----------
+        latency : float
+            Seconds every request takes, to imitate the network
+        """
+        self.latency = latency
+        self.calls = Counter()
+        self.message_id = 0
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(request.query)
+        params.update(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await sleep(self.latency)
+        return web.json_response({'ok': True, 'result': self.result(method, params)})
+
+    def result(self, method, params):
+        chat_id = int(params.get('chat_id', 0))
+        if method.startswith('send') or method.startswith('edit'):
+            self.message_id += 1
+            return {'message_id': self.message_id, 'date': 0,
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'text': params.get('text', '')}
+        if method == 'getChat':
+            return {'id': chat_id, 'type': 'private', 'username': f'user{chat_id}'}
+        return True
+
+    async def start(self, port):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', port).start()
+        asyncio_helper.API_URL = f'http://127.0.0.1:{port}/bot{{0}}/{{1}}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class Updates:
+    """
+    Builds Telegram updates sent by users
+    """
+    def __init__(self):
+        self.update_id = 0
+
+    def user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}',
+                'username': f'user{chat_id}'}
+
+    def message(self, chat_id, text):
+        self.update_id += 1
+        return types.Update.de_json({
+            'update_id': self.update_id,
+            'message': {'message_id': self.update_id, 'date': 0,
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'from': self.user(chat_id), 'text': text}})
+
+    def callback(self, chat_id, data):
+        self.update_id += 1
+        return types.Update.de_json({
+            'update_id': self.update_id,
+            'callback_query': {'id': str(self.update_id), 'chat_instance': '0',
+                               'from': self.user(chat_id), 'data': data,
+                               'message': {'message_id': self.update_id, 'date': 0,
+                                           'chat': {'id': chat_id, 'type': 'private'},
+                                           'text': ''}}})
+
+
+def scenarios(rand, updates, data, requests):
+    """
+    Returns
+    -------
+    list(tuple(str, list(telebot.types.Update)))
+        Scenarios to run one after another, with their updates
+    """
+    mentor_subjects = dict(data['mentors'].values())
+    mentor_chats = list(mentor_subjects)
+    new_students = [NEW_STUDENTS_CHAT + i for i in range(requests)]
+    accepts = []
+    for (work, subj) in rand.sample(data['pending'], min(requests, len(data['pending']))):
+        chat = rand.choice([chat for (chat, subjs) in mentor_subjects.items()
+                            if subj in subjs])
+        accepts.append(updates.callback(chat, f'mnt_work_{work}'))
+    return [
+        ('start', [updates.message(rand.choice(data['students'])[1], '/start')
+                   for _ in range(requests)]),
+        ('add_request', [updates.message(chat, 'Добавить запрос') for chat in new_students]),
+        ('add_request_subject', [updates.callback(chat, f'add_request_{rand.choice(data["subjects"])}')
+                                 for chat in new_students]),
+        ('add_request_topic', [updates.message(chat, f'topic{chat}') for chat in new_students]),
+        ('mentor_requests', [updates.message(rand.choice(mentor_chats), 'Запросы')
+                             for _ in range(requests)]),
+        ('accept', accepts),
+        ('admin_mentors', [updates.message(ADMIN_CHAT, 'Менторы') for _ in range(20)]),
+    ]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[max(ceil(pct / 100 * len(values)) - 1, 0)]
+
+
+def handler_queries():
+    return sum(stats.queries for (name, stats) in metrics.handlers.items()
+               if name != BACKGROUND)
+
+
+def handler_errors():
+    # telebot logs exceptions of handlers instead of raising them, timed
+    # wrappers of the handlers count them
+    return sum(stats.errors for stats in metrics.handlers.values())
+
+
+async def run_scenario(updates):
+    """
+    Processes updates with the dispatcher of the bot
+
+    Returns
+    -------
+    dict
+        Latency percentiles in milliseconds, queries per update, throughput
+        in updates per second and the amount of handlers which raised
+    """
+    latencies = []
+
+    async def process(update):
+        start = perf_counter()
+        try:
+            await bot.process_update(update)
+        finally:
+            latencies.append(perf_counter() - start)
+
+    bot.dispatcher = UpdateDispatcher(process, workers=bot.dispatcher.workers)
+    queries = handler_queries()
+    errors = handler_errors()
+    start = perf_counter()
+    await bot.dispatcher.submit(updates)
+    while bot.dispatcher.stats['pending']:
+        await sleep(0.01)
+    elapsed = perf_counter() - start
+    await bot.dispatcher.stop()
+    return {'updates': len(updates),
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'queries_per_update': (handler_queries() - queries) / len(updates),
+            'updates_per_second': len(updates) / elapsed,
+            'errors': handler_errors() - errors + bot.dispatcher.stats['failed']}
+
+
+def report(results, baseline=None, tolerance=None):
+    """
+    Prints results and their change from the baseline
+
+    Returns
+    -------
+    list(str)
+        Scenarios whose p95 latency or queries per update grew more than
+        tolerance allows, or whose handlers raised
+    """
+    regressions = []
+    print(f'{"scenario":<22}{"updates":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}'
+          f'{"queries":>10}{"upd/s":>10}{"errors":>8}')
+    for (name, res) in results.items():
+        print(f'{name:<22}{res["updates"]:>8}{res["p50_ms"]:>10.1f}{res["p95_ms"]:>10.1f}'
+              f'{res["p99_ms"]:>10.1f}{res["queries_per_update"]:>10.1f}'
+              f'{res["updates_per_second"]:>10.1f}{res.get("errors", 0):>8}')
+        # timings of handlers which failed partway are meaningless
+        if res.get('errors'):
+            regressions.append(name)
+            continue
+        base = (baseline or {}).get(name)
+        if base is None:
+            continue
+        changes = {key: (res[key] - base[key]) / base[key] if base[key] else 0
+                   for key in ('p95_ms', 'queries_per_update')}
+        print(f'{"":<22}{"vs baseline":>18}{changes["p95_ms"]:>+20.0%}'
+              f'{changes["queries_per_update"]:>+20.0%}')
+        if tolerance is not None and any(change > tolerance for change in changes.values()):
+            regressions.append(name)
+    return regressions
+
+
+async def main(args):
+    rand = random.Random(args.seed)
+    api = FakeTelegram(args.api_latency / 1000)
+    await api.start(args.api_port)
+    db = Database()
+    listener = None
+    try:
+        await db.initdb()
+        if hasattr(state_storage, 'listen_states'):
+            listener = create_task(state_storage.listen_states())
+        start = perf_counter()
+        data = await seed(db, rand, args.students, args.mentors, args.subjects)
+        print(f'seeded {args.students} students, {args.mentors} mentors, '
+              f'{args.subjects} subjects in {perf_counter() - start:.1f}s')
+        updates = Updates()
+        results = {}
+        for (name, scenario) in scenarios(rand, updates, data, args.requests):
+            results[name] = await run_scenario(scenario)
+        print(f'Bot API calls: {dict(api.calls)}')
+    finally:
+        if listener is not None:
+            listener.cancel()
+        if hasattr(state_storage, 'flush'):
+            await state_storage.flush()
+        await bot.close_session()
+        await api.stop()
+        await close_pool()
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(prog='tests.e2e_benchmark')
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--mentors', type=int, default=200)
+    parser.add_argument('--subjects', type=int, default=30)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='updates per scenario')
+    parser.add_argument('--seed', type=int, default=625)
+    parser.add_argument('--api-port', type=int, default=8089)
+    parser.add_argument('--api-latency', type=float, default=0,
+                        help='milliseconds every Bot API request takes')
+    parser.add_argument('--save', help='file to save results to')
+    parser.add_argument('--baseline', help='file with results to compare with')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='fail if p95 latency or queries per update grow '
+                             'more than this share of the baseline')
+    args = parser.parse_args()
+    results = run(main(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    regressions = report(results, baseline, args.tolerance)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if regressions:
+        print(f'regressed or failed: {", ".join(regressions)}')
+        sys.exit(1)
@@ -0,0 +1,135 @@
+import asynctest
+from mentor_whirlpool.matching import Matcher, run_matching
+from time import perf_counter
+import random
+
+
+class FakeDatabase:
+    """
+    Database methods run_matching uses, on in-memory course works
+    """
+    def __init__(self):
+        # id -> (student, subjects)
+        self.works = {}
+        self.accepted = set()
+        self.mentor = {'id': 1, 'subjects': [1], 'students': [], 'load': 0, 'capacity': 1}
+
+    async def get_mentors_for_matching(self, default_capacity):
+        return [dict(self.mentor)]
+
+    def pending(self):
+        return {id_f: work for (id_f, work) in self.works.items()
+                if work[0] not in self.accepted}
+
+    async def get_pending_request_ids(self):
+        return set(self.pending())
+
+    async def get_pending_requests(self, after_id=None):
+        return [{'id': id_f, 'student': student, 'subjects': subjects}
+                for (id_f, (student, subjects)) in sorted(self.pending().items())
+                if after_id is None or id_f > after_id]
+
+    async def get_course_works(self, id_field):
+        return [{'id': id_field}] if id_field in self.works else []
+
+    async def accept_work(self, mentor_id, work_id, new_student=False):
+        (student, _) = self.works[work_id]
+        if new_student and student in self.accepted:
+            return False
+        self.accepted.add(student)
+        del self.works[work_id]
+        return True
+
+
+class TestMatcher(asynctest.TestCase):
+    def test_match(self):
+        matcher = Matcher()
+        matcher.update_mentor(1, subjects=[1], students=[], load=0, capacity=1)
+        matcher.update_mentor(2, subjects=[1, 2], students=[], load=1, capacity=4)
+        matcher.update_mentor(3, subjects=[2], students=[30], load=0, capacity=2)
+        # both subjects only overlap with mentor 2
+        matcher.add_request(10, student=100, subjects=[1, 2])
+        # mentor 1 has the larger free share
+        matcher.add_request(11, student=101, subjects=[1])
+        # mentor 3 already mentors the student
+        matcher.add_request(12, student=30, subjects=[2])
+        # one request per student
+        matcher.add_request(13, student=100, subjects=[1])
+        self.assertListEqual(matcher.match(), [(10, 2), (11, 1), (12, 2)])
+        for (request, _) in [(10, 2), (11, 1), (12, 2)]:
+            matcher.accepted(request)
+        self.assertDictEqual(matcher.requests, {})
+
+    def test_incremental(self):
+        matcher = Matcher()
+        matcher.update_mentor(1, subjects=[1], students=[], load=1, capacity=1)
+        matcher.add_request(10, student=100, subjects=[1])
+        self.assertListEqual(matcher.match(), [])
+        # nothing has changed, nothing is scored
+        self.assertSetEqual(matcher.stale, set())
+        self.assertListEqual(matcher.match(), [])
+        # a student left the mentor
+        matcher.update_mentor(1, subjects=[1], students=[], load=0, capacity=1)
+        self.assertListEqual(matcher.match(), [(10, 1)])
+        matcher.rejected(10)
+        self.assertDictEqual(matcher.requests, {})
+
+    def test_benchmark(self):
+        rand = random.Random(625)
+        matcher = Matcher()
+        for mentor in range(300):
+            matcher.update_mentor(mentor, subjects=rand.sample(range(50), 3),
+                                  students=[], load=rand.randrange(5), capacity=40)
+        start = perf_counter()
+        for request in range(20000):
+            matcher.add_request(request, student=request,
+                                subjects=rand.sample(range(50), rand.randint(1, 2)))
+        assignments = matcher.match()
+        elapsed = perf_counter() - start
+        for (request, _) in assignments:
+            matcher.accepted(request)
+        print(f'matched {len(assignments)} of 20000 requests in {elapsed:.3f}s')
+        self.assertLess(elapsed, 1)
+        self.assertTrue(all(ment['load'] <= ment['capacity']
+                            for ment in matcher.mentors.values()))
+
+        # a new request and a freed mentor only score what they touch
+        matcher.update_mentor(0, subjects=matcher.mentors[0]['subjects'], students=[],
+                              load=0, capacity=40)
+        matcher.add_request(20000, student=20000, subjects=[0])
+        start = perf_counter()
+        matcher.match()
+        self.assertLess(perf_counter() - start, 0.1)
+
+    def test_sync_requests(self):
+        matcher = Matcher()
+        matcher.add_request(10, student=100, subjects=[1])
+        matcher.add_request(11, student=101, subjects=[1])
+        matcher.sync_requests({11})
+        self.assertListEqual(list(matcher.requests), [11])
+        self.assertNotIn(100, matcher.requests_by_student)
+
+    async def test_run_matching_prunes_requests(self):
+        db = FakeDatabase()
+        # the only mentor is busy, so the requests stay in the matcher
+        db.mentor['load'] = 1
+        db.works = {10: (100, [1]), 11: (101, [1])}
+        matcher = Matcher()
+        self.assertEqual(await run_matching(db, matcher), 0)
+        self.assertSetEqual(set(matcher.requests), {10, 11})
+        # deleted by the student and accepted by hand
+        del db.works[10]
+        db.accepted.add(101)
+        db.mentor['load'] = 0
+        self.assertEqual(await run_matching(db, matcher), 0)
+        self.assertDictEqual(matcher.requests, {})
+
+    async def test_run_matching_skips_accepted_students(self):
+        db = FakeDatabase()
+        # a new request of a student who has a mentor already
+        db.works = {10: (100, [1]), 11: (101, [1])}
+        db.accepted.add(100)
+        matcher = Matcher()
+        self.assertEqual(await run_matching(db, matcher), 1)
+        self.assertListEqual(list(db.works), [10])
+        self.assertDictEqual(matcher.requests, {})
@@ -0,0 +1,42 @@
+import asynctest
+from asyncio import gather
+from mentor_whirlpool.metrics import Metrics
+
+
+class TestMetrics(asynctest.TestCase):
+    async def test_queries_per_call(self):
+        metrics = Metrics()
+
+        async def handler(queries):
+            # queries of tasks spawned by the handler count too
+            await gather(*[query() for _ in range(queries)])
+
+        async def query():
+            metrics.record_query(0.001)
+
+        timed = metrics.timed(handler, name='handler')
+        await timed(1)
+        await timed(12)
+        metrics.record_query(0.5)
+        stats = metrics.handlers['handler']
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.queries, 13)
+        self.assertEqual(stats.max_queries, 12)
+        self.assertEqual(metrics.handlers['background'].queries, 1)
+
+        metrics.add_source('outbound', {'sent': 3})
+        text = metrics.render()
+        self.assertIn('mentor_whirlpool_handler_queries_bucket{handler="handler",le="1"} 1', text)
+        self.assertIn('mentor_whirlpool_handler_queries_bucket{handler="handler",le="20"} 2', text)
+        self.assertIn('mentor_whirlpool_handler_queries_count{handler="handler"} 2', text)
+        self.assertIn('mentor_whirlpool_outbound_sent 3', text)
+
+    async def test_errors(self):
+        metrics = Metrics()
+
+        async def handler():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            await metrics.timed(handler, name='handler')()
+        self.assertEqual(metrics.handlers['handler'].errors, 1)
@@ -0,0 +1,10 @@
+#!/bin/sh
+# wipes the database, see tests/database_benchmarks.py and tests/e2e_benchmark.py
+# pass --save FILE to store a baseline, --baseline FILE to compare with it
+
+pushd $(git rev-parse --show-toplevel)
+
+python3 -m nose2 --verbose tests.database_benchmarks
+python3 -m tests.e2e_benchmark "$@"
+
+popd
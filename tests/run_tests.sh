@@ -2,6 +2,6 @@
 
 pushd $(git rev-parse --show-toplevel)
 
-python3 -m nose2 --verbose tests.database_unit_tests
+python3 -m nose2 --verbose tests.database_unit_tests tests.matching_unit_tests tests.metrics_unit_tests tests.dispatcher_unit_tests tests.webhook_unit_tests
 
 popd
@@ -0,0 +1,95 @@
+from collections import defaultdict
+
+MENTORS_CHAT = 1000000
+STUDENTS_CHAT = 2000000
+NEW_STUDENTS_CHAT = 3000000
+ADMIN_CHAT = 4000000
+
+
+async def seed(db, rand, students, mentors, subjects):
+    """
+    Wipes the database and fills it with a dataset for benchmarks: subjects,
+    mentors with 3 subjects and an idea each, students with a course work
+    each, every other one accepted by a mentor of its subject, and an admin
+
+    Parameters
+    ----------
+    db : mentor_whirlpool.database.Database
+    rand : random.Random
+        Source of randomness, seeded to get the same dataset every time
+    students, mentors, subjects : int
+        Amounts to create
+
+    Returns
+    -------
+    dict
+        'subjects': list of subject ids,
+        'mentors': dict of mentor id -> (chat_id, list of subject ids),
+        'students': list of (id, chat_id),
+        'pending': list of pending course works as (id, subject id),
+        'accepted': list of accepted students as (student id, mentor id)
+    """
+    async with db.connection() as conn:
+        for table in ('STATES', 'SUPPORT_REQUESTS', 'SUPPORTS', 'ADMINS',
+                      'IDEAS_SUBJECTS', 'IDEAS', 'MENTORS_STUDENTS',
+                      'MENTORS_SUBJECTS', 'ACCEPTED_SUBJECTS', 'ACCEPTED',
+                      'COURSE_WORKS_SUBJECTS', 'COURSE_WORKS', 'MENTORS',
+                      'STUDENTS', 'SUBJECTS'):
+            await conn.execute(f'DELETE FROM {table}')
+        subject_ids = [i for (i,) in await (await conn.execute(
+            "INSERT INTO SUBJECTS(SUBJECT, COUNT) SELECT 'subject' || I, 0 "
+            'FROM generate_series(1, %s) I RETURNING ID', (subjects,))).fetchall()]
+        mentor_lines = await (await conn.execute(
+            "INSERT INTO MENTORS(NAME, CHAT_ID, LOAD) SELECT 'mentor' || I, %s + I, 0 "
+            'FROM generate_series(1, %s) I RETURNING ID, CHAT_ID',
+            (MENTORS_CHAT, mentors))).fetchall()
+        mentor_info = {ment: (chat_id, rand.sample(subject_ids, min(3, subjects)))
+                       for (ment, chat_id) in mentor_lines}
+        by_subject = defaultdict(list)
+        for (ment, (_, subjs)) in mentor_info.items():
+            for subj in subjs:
+                by_subject[subj].append(ment)
+        student_lines = await (await conn.execute(
+            "INSERT INTO STUDENTS(NAME, CHAT_ID) SELECT 'student' || I, %s + I "
+            'FROM generate_series(1, %s) I RETURNING ID, CHAT_ID',
+            (STUDENTS_CHAT, students))).fetchall()
+        cur = conn.cursor()
+        await cur.executemany('INSERT INTO MENTORS_SUBJECTS VALUES(%s, %s)',
+                              [(ment, subj) for (ment, (_, subjs)) in mentor_info.items()
+                               for subj in subjs])
+        for (ment, (_, subjs)) in mentor_info.items():
+            (idea,) = await (await conn.execute(
+                'INSERT INTO IDEAS VALUES(DEFAULT, %s, %s) RETURNING ID',
+                (ment, f'idea{ment}'))).fetchone()
+            await conn.execute('INSERT INTO IDEAS_SUBJECTS VALUES(%s, %s)', (idea, subjs[0]))
+        led = [subj for subj in subject_ids if by_subject[subj]]
+        pending = []
+        accepted = []
+        for (i, (stud, _)) in enumerate(student_lines):
+            subj = rand.choice(led)
+            if i % 2:
+                ment = rand.choice(by_subject[subj])
+                # accepted works keep the id of the course work they were,
+                # which comes from the COURSE_WORKS sequence
+                (work,) = await (await conn.execute(
+                    "INSERT INTO ACCEPTED VALUES(nextval(pg_get_serial_sequence("
+                    "'course_works', 'id')), %s, %s) RETURNING ID",
+                    (stud, f'work{i}'))).fetchone()
+                await conn.execute('INSERT INTO ACCEPTED_SUBJECTS VALUES(%s, %s)', (work, subj))
+                await conn.execute('INSERT INTO MENTORS_STUDENTS VALUES(%s, %s)', (ment, stud))
+                accepted.append((stud, ment))
+            else:
+                (work,) = await (await conn.execute(
+                    'INSERT INTO COURSE_WORKS VALUES(DEFAULT, %s, %s) RETURNING ID',
+                    (stud, f'work{i}'))).fetchone()
+                await conn.execute('INSERT INTO COURSE_WORKS_SUBJECTS VALUES(%s, %s)',
+                                   (work, subj))
+                pending.append((work, subj))
+        await conn.execute('INSERT INTO ADMINS VALUES(DEFAULT, %s)', (ADMIN_CHAT,))
+    await db.reconcile_loads()
+    await db.refresh_mentors_stats()
+    db.invalidate_roles()
+    await db.load_subjects(reload=True)
+    return {'subjects': subject_ids, 'mentors': mentor_info,
+            'students': [tuple(line) for line in student_lines],
+            'pending': pending, 'accepted': accepted}
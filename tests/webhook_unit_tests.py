@@ -0,0 +1,29 @@
+import os
+
+# the bot is created on import of the webhook module
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:test')
+
+import asynctest
+from aiohttp.test_utils import TestClient, TestServer
+from mentor_whirlpool.webhook import WebhookServer, SECRET_HEADER
+
+
+class TestWebhookServer(asynctest.TestCase):
+    async def test_rejects_requests(self):
+        server = WebhookServer(secret='secret')
+        async with TestClient(TestServer(server.app)) as client:
+            for headers in ({}, {SECRET_HEADER: 'wrong'}, {SECRET_HEADER: 'секрет'}):
+                with self.subTest(headers=headers):
+                    resp = await client.post('/', data='{}', headers=headers)
+                    self.assertEqual(resp.status, 403)
+            for body in ('[]', '1', '{}', 'not json'):
+                with self.subTest(body=body):
+                    resp = await client.post('/', data=body,
+                                             headers={SECRET_HEADER: 'secret'})
+                    self.assertEqual(resp.status, 400)
+
+    async def test_generated_secret(self):
+        server = WebhookServer()
+        self.assertTrue(server.secret)
+        with self.assertRaises(RuntimeError):
+            await server.serve(url=None)